@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import tables
+from window import WindowIndicator
+
+class ATRData(tables.IsDescription):
+    date = tables.TimeCol()
+    value = tables.Float32Col()
+
+class ATR(WindowIndicator):
+    """Average true range.  The true range of a session is its high less
+    its low, widened to the previous close if that is outside of them.
+    The average is the mean of the first period true ranges, then Wilder's
+    smoothing of them."""
+    FIELDS = ("adjhigh", "adjlow", "adjclose")
+    DATA = ATRData
+
+    def __init__(self, period=14):
+        WindowIndicator.__init__(self, 2)
+        self.period = period
+        self.sum = 0.0
+
+    def key(self):
+        return (self.period,)
+
+    def _refresh(self):
+        high = self.window("adjhigh").newest()
+        low = self.window("adjlow").newest()
+        tr = high - low
+        if self.seen() > 1:
+            close = self.window().get(self.window().count - 2)
+            tr = max(tr, abs(high - close), abs(low - close))
+
+        n = self.seen()
+        if n <= self.period:
+            self.sum += tr
+            self.value = self.sum / n
+        else:
+            self.value = ((self.value * (self.period - 1)) + tr) / self.period
+
+    def _getState(self):
+        return {'value': self.value, 'sum': self.sum}
+
+    def _setState(self, state):
+        self.value = state['value']
+        self.sum = state['sum']
+
+if __name__ == "__main__":
+    import unittest
+
+    class ATRTest(unittest.TestCase):
+
+        def test_Value(self):
+            atr = ATR(3)
+            self.assertEqual(atr.update((11.0, 9.0, 10.0)), 2.0)
+            # The gap up from the previous close widens the range to 4
+            self.assertEqual(atr.update((14.0, 12.0, 13.0)), 3.0)
+            self.assertEqual(atr.update((13.0, 12.0, 12.5)), 7.0 / 3)
+            self.assertAlmostEqual(atr.update((13.0, 12.0, 12.5)), ((7.0 / 3) * 2 + 1.0) / 3)
+
+        def test_State(self):
+            atr = ATR(3)
+            for i in xrange(10):
+                atr.update((i + 2.0, i + 1.0, i + 1.5))
+            resumed = ATR(3)
+            resumed.setState(atr.getState())
+            self.assertEqual(resumed.update((20.0, 12.0, 15.0)), atr.update((20.0, 12.0, 15.0)))
+
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import math
+import numpy
+import tables
+from window import WindowIndicator
+
+class StdDevData(tables.IsDescription):
+    date = tables.TimeCol()
+    value = tables.Float32Col()
+    mean = tables.Float32Col()
+
+class BollingerData(tables.IsDescription):
+    date = tables.TimeCol()
+    value = tables.Float32Col()
+    upper = tables.Float32Col()
+    lower = tables.Float32Col()
+
+class StdDev(WindowIndicator):
+    """Population standard deviation of the latest period closes, or of
+    all of them until there are period.  The mean and the sum of squared
+    deviations are updated as values enter and leave the window."""
+    DATA = StdDevData
+    COLUMNS = ("mean",)
+
+    def __init__(self, period):
+        WindowIndicator.__init__(self, period + 1)
+        self.period = period
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def key(self):
+        return (self.period,)
+
+    def _refresh(self):
+        window = self.window()
+        x = window.newest()
+        n = min(self.seen(), self.period)
+        if self.seen() > self.period:
+            y = window.get(window.count - 1 - self.period)
+            mean = self.mean
+            self.mean += (x - y) / self.period
+            self.m2 += (x - y) * (x - self.mean + y - mean)
+        else:
+            delta = x - self.mean
+            self.mean += delta / n
+            self.m2 += delta * (x - self.mean)
+        self._values(n)
+
+    def _resum(self):
+        values = self.window().latest(min(self.seen(), self.period))
+        self.mean = float(values.mean())
+        self.m2 = float(((values - self.mean) ** 2).sum())
+        self._values(len(values))
+
+    def _values(self, n):
+        self.std = math.sqrt(max(self.m2, 0.0) / n)
+        self.value = self.std
+
+    def _getState(self):
+        return {'mean': self.mean, 'm2': self.m2}
+
+    def _setState(self, state):
+        self.mean = state['mean']
+        self.m2 = state['m2']
+        if self.seen() > 0:
+            self._values(min(self.seen(), self.period))
+
+class Bollinger(StdDev):
+    """Bollinger bands, the value is the moving average of the latest
+    period closes and the bands are width standard deviations above and
+    below it"""
+    DATA = BollingerData
+    COLUMNS = ("upper", "lower")
+
+    def __init__(self, period=20, width=2.0):
+        StdDev.__init__(self, period)
+        self.width = width
+        self.upper = None
+        self.lower = None
+
+    def key(self):
+        return (self.period, self.width)
+
+    def _values(self, n):
+        StdDev._values(self, n)
+        self.value = self.mean
+        self.upper = self.mean + (self.width * self.std)
+        self.lower = self.mean - (self.width * self.std)
+
+if __name__ == "__main__":
+    import unittest
+    from sma import SMA
+    from window import Window
+
+    class BollingerTest(unittest.TestCase):
+
+        def test_Bands(self):
+            values = 100 + numpy.cumsum(numpy.random.RandomState(1).normal(size=500))
+            bands = Bollinger(20, 2.0)
+            for i, v in enumerate(values):
+                bands.update(v)
+                window = values[max(0, i-19):i+1]
+                self.assertAlmostEqual(bands.value, window.mean())
+                self.assertAlmostEqual(bands.upper, window.mean() + 2 * window.std())
+                self.assertAlmostEqual(bands.lower, window.mean() - 2 * window.std())
+
+        def test_Shared(self):
+            values = 100 + numpy.cumsum(numpy.random.RandomState(2).normal(size=300))
+            windows = {"adjclose": Window()}
+            shared = [SMA(20), StdDev(20), Bollinger(50)]
+            for indicator in shared:
+                indicator.attach(windows)
+            alone = [SMA(20), StdDev(20), Bollinger(50)]
+            for v in values:
+                windows["adjclose"].append(v)
+                for a, b in zip(shared, alone):
+                    self.assertAlmostEqual(a.refresh(), b.update(v))
+            self.assertEqual(len(windows["adjclose"].data), 51)
+
+        def test_State(self):
+            values = 100 + numpy.cumsum(numpy.random.RandomState(3).normal(size=100))
+            bands = Bollinger(10)
+            for v in values[:50]:
+                bands.update(v)
+            resumed = Bollinger(10)
+            resumed.setState(bands.getState())
+            self.assertAlmostEqual(resumed.upper, bands.upper)
+            for v in values[50:]:
+                bands.update(v)
+                resumed.update(v)
+            self.assertAlmostEqual(resumed.lower, bands.lower)
+
+    unittest.main()
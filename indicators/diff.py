@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import numpy
+import tables
+
+class DiffData(tables.IsDescription):
+    date = tables.TimeCol()
+    value = tables.Float32Col()
+
+class Diff(object):
+    """The change of a value from the previous session, zero for the
+    first one.  The value is a quote field or another indicator."""
+    def __init__(self, source="adjclose"):
+        self.source = source
+        self.value = None
+        self.last = None
+        self.tbl = None
+
+    def key(self):
+        return ()
+
+    def inputs(self):
+        return [self.source]
+
+    def bind(self, inputs):
+        self.source = inputs[0]
+
+    def setupH5(self, h5file, h5where, h5name):
+        if h5file != None and h5where != None and h5name != None:
+            try:
+                self.tbl = h5file.getNode(h5where, h5name, classname="Table")
+            except tables.NoSuchNodeError:
+                self.tbl = h5file.createTable(h5where, h5name, DiffData)
+
+    def getState(self):
+        """The state needed to resume updating, see setState"""
+        return {'value': self.value, 'last': self.last}
+
+    def setState(self, state):
+        self.value = state['value']
+        self.last = state['last']
+
+    def _transform(self, value):
+        if self.last == None:
+            self.last = value
+        result = value - self.last
+        self.last = value
+        return result
+
+    def _transformSeries(self, values):
+        if self.last == None:
+            self.last = values[0]
+        result = numpy.diff(numpy.concatenate(([self.last], values)))
+        self.last = float(values[-1])
+        return result
+
+    def update(self, value, date=None):
+        self.value = self._transform(value)
+        if self.tbl != None and date:
+            self.tbl.row["date"] = date.date().toordinal()
+            self.tbl.row["value"] = self.value
+            self.tbl.row.append()
+
+        return self.value
+
+    def updateSeries(self, values, dates=None):
+        """Array form of update"""
+        values = numpy.asarray(values, dtype=float)
+        if len(values) == 0:
+            return numpy.empty(0)
+        result = self._transformSeries(values)
+        self.value = float(result[-1])
+
+        if self.tbl != None and dates != None:
+            self.tbl.append(zip([d.date().toordinal() for d in dates], result))
+
+        return result
+
+class Gain(Diff):
+    """The value when it is positive, otherwise zero, usually of a Diff"""
+    def __init__(self, source=None):
+        Diff.__init__(self, source or Diff())
+
+    def getState(self):
+        return {'value': self.value}
+
+    def setState(self, state):
+        self.value = state['value']
+
+    def _transform(self, value):
+        return max(value, 0.0)
+
+    def _transformSeries(self, values):
+        return numpy.where(values > 0, values, 0.0)
+
+class Loss(Gain):
+    """The negated value when it is negative, otherwise zero, usually of
+    a Diff"""
+    def _transform(self, value):
+        return max(-value, 0.0)
+
+    def _transformSeries(self, values):
+        return numpy.where(values < 0, -values, 0.0)
+
+if __name__ == "__main__":
+    import unittest
+
+    class DiffTest(unittest.TestCase):
+
+        def test_Diff(self):
+            diff = Diff()
+            self.assertEqual([diff.update(v) for v in (5.0, 7.0, 4.0)], [0.0, 2.0, -3.0])
+            resumed = Diff()
+            resumed.setState(diff.getState())
+            self.assertEqual(list(resumed.updateSeries([6.0, 6.0])), [2.0, 0.0])
+
+        def test_GainLoss(self):
+            values = numpy.random.RandomState(1).normal(size=50)
+            gain, loss = Gain(), Loss()
+            self.assertEqual([gain.update(v) for v in values], list(Gain().updateSeries(values)))
+            self.assertEqual([loss.update(v) for v in values], list(Loss().updateSeries(values)))
+            self.assertTrue(numpy.allclose(Gain().updateSeries(values) - Loss().updateSeries(values), values))
+
+    unittest.main()
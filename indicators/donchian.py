@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import tables
+from window import WindowIndicator, RollingExtreme
+
+class DonchianData(tables.IsDescription):
+    date = tables.TimeCol()
+    value = tables.Float32Col()
+    upper = tables.Float32Col()
+    lower = tables.Float32Col()
+
+class Donchian(WindowIndicator):
+    """Donchian channel, upper is the highest high and lower the lowest
+    low of the latest period sessions and the value is halfway between"""
+    FIELDS = ("adjhigh", "adjlow")
+    DATA = DonchianData
+    COLUMNS = ("upper", "lower")
+
+    def __init__(self, period=20):
+        WindowIndicator.__init__(self, period)
+        self.period = period
+        self.highest = RollingExtreme(period)
+        self.lowest = RollingExtreme(period, largest=False)
+        self.upper = None
+        self.lower = None
+
+    def key(self):
+        return (self.period,)
+
+    def _refresh(self):
+        self.highest.push(self.window("adjhigh"))
+        self.lowest.push(self.window("adjlow"))
+        self._values()
+
+    def _values(self):
+        self.upper = self.highest.value(self.window("adjhigh"))
+        self.lower = self.lowest.value(self.window("adjlow"))
+        self.value = (self.upper + self.lower) / 2
+
+    def _setState(self, state):
+        self.value = state['value']
+        self.highest.rebuild(self.window("adjhigh"), self.seen())
+        self.lowest.rebuild(self.window("adjlow"), self.seen())
+        if self.seen() > 0:
+            self._values()
+
+if __name__ == "__main__":
+    import unittest
+    import numpy
+
+    class DonchianTest(unittest.TestCase):
+
+        def test_Channel(self):
+            closes = 100 + numpy.cumsum(numpy.random.RandomState(1).normal(size=200))
+            highs, lows = closes + 1, closes - 1
+            channel = Donchian(20)
+            for i in xrange(len(closes)):
+                channel.update((highs[i], lows[i]))
+                self.assertEqual(channel.upper, highs[max(0, i-19):i+1].max())
+                self.assertEqual(channel.lower, lows[max(0, i-19):i+1].min())
+                self.assertEqual(channel.value, (channel.upper + channel.lower) / 2)
+
+        def test_State(self):
+            channel = Donchian(5)
+            for i in xrange(20):
+                channel.update((i + 1.0, i - 1.0))
+            resumed = Donchian(5)
+            resumed.setState(channel.getState())
+            self.assertEqual((resumed.upper, resumed.lower), (channel.upper, channel.lower))
+            self.assertEqual(resumed.update((10.0, 9.0)), channel.update((10.0, 9.0)))
+
+    unittest.main()
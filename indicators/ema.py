@@ -16,6 +16,8 @@ You should have received a copy of the GNU General Public License
 along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
+import math
+import numpy
 import tables
 
 class EMAData(tables.IsDescription):
@@ -23,14 +25,36 @@ class EMAData(tables.IsDescription):
     value = tables.Float32Col()
 
 class EMA(object):
-    def __init__(self, period):
+    def __init__(self, period, source="adjclose"):
         self.value = None
+        self.period = period
         self.alpha = 2.0 / (period+1)
+        self.source = source
         self.tbl = None
 
+    def key(self):
+        return (self.period,)
+
+    def inputs(self):
+        """The quote field or indicator averaged, see IndicatorGraph"""
+        return [self.source]
+
+    def bind(self, inputs):
+        self.source = inputs[0]
+
     def setupH5(self, h5file, h5where, h5name):
         if h5file != None and h5where != None and h5name != None:
-            self.tbl = h5file.createTable(h5where, h5name, EMAData)
+            try:
+                self.tbl = h5file.getNode(h5where, h5name, classname="Table")
+            except tables.NoSuchNodeError:
+                self.tbl = h5file.createTable(h5where, h5name, EMAData)
+
+    def getState(self):
+        """The state needed to resume updating, see setState"""
+        return {'value': self.value}
+
+    def setState(self, state):
+        self.value = state['value']
 
     def update(self, value, date=None):
         if self.value == None:
@@ -41,10 +65,42 @@ class EMA(object):
             self.tbl.row["date"] = date.date().toordinal()
             self.tbl.row["value"] = self.value
             self.tbl.row.append()
-            self.tbl.flush()
 
         return self.value
 
+    def updateSeries(self, values, dates=None):
+        """Array form of update.  Continues from the current value over all
+        of the values at once and returns the average after each of them.
+        The recurrence is solved in closed form over blocks short enough
+        that the powers of (1 - alpha) stay well conditioned."""
+        values = numpy.asarray(values, dtype=float)
+        result = numpy.empty(len(values))
+        if len(values) == 0:
+            return result
+
+        start = 0
+        value = self.value
+        if value == None:
+            value = result[0] = values[0]
+            start = 1
+
+        decay = 1 - self.alpha
+        if decay <= 0:
+            result[start:] = values[start:]
+        else:
+            block = max(1, int(math.log(1e-8) / math.log(decay)))
+            for i in xrange(start, len(values), block):
+                x = values[i:i+block]
+                powers = decay ** numpy.arange(len(x))
+                result[i:i+block] = powers * ((decay * value) + (self.alpha * numpy.cumsum(x / powers)))
+                value = result[i+len(x)-1]
+        self.value = float(result[-1])
+
+        if self.tbl != None and dates != None:
+            self.tbl.append(zip([d.date().toordinal() for d in dates], result))
+
+        return result
+
 if __name__ == "__main__":
     import unittest
 
@@ -79,5 +135,25 @@ if __name__ == "__main__":
             ema.update(2.)
             self.assertAlmostEqual(ema.value, 1.2)
 
+        def test_Series(self):
+            values = 100 + numpy.cumsum(numpy.random.RandomState(1).normal(size=1000))
+            for period in (1, 9, 15, 200):
+                ema = EMA(period)
+                expected = [ema.update(v) for v in values]
+                ema = EMA(period)
+                result = ema.updateSeries(values)
+                self.assertTrue(numpy.allclose(result, expected, rtol=1e-10))
+                self.assertAlmostEqual(ema.value, expected[-1])
+
+        def test_SeriesResume(self):
+            values = 100 + numpy.cumsum(numpy.random.RandomState(2).normal(size=300))
+            streaming = EMA(15)
+            expected = [streaming.update(v) for v in values]
+            ema = EMA(15)
+            for v in values[:100]:
+                ema.update(v)
+            result = ema.updateSeries(values[100:])
+            self.assertTrue(numpy.allclose(result, expected[100:], rtol=1e-10))
+
 
     unittest.main()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import numpy
+from window import Window
+
+def _inputs(indicator):
+    if hasattr(indicator, "inputs"):
+        return indicator.inputs()
+    return ["adjclose"]
+
+def _param(value):
+    if type(value) == float and value == int(value):
+        value = int(value)
+    return str(value)
+
+def _key(indicator):
+    if not hasattr(indicator, "key"):
+        return "%s@%x" % (type(indicator).__name__, id(indicator))
+    params = ",".join([_param(p) for p in indicator.key()])
+    inputs = [i if isinstance(i, str) else _key(i) for i in _inputs(indicator)]
+    return "%s(%s)<%s>" % (type(indicator).__name__, params, ",".join(inputs))
+
+def _flushed(indicator):
+    # The table an indicator writes its rows to, with any buffered rows
+    # written out, or None
+    tbl = getattr(indicator, "tbl", None)
+    if tbl == None:
+        return None
+    tbl.flush()
+    return getattr(tbl, "table", tbl)
+
+class Node(object):
+    def __init__(self, key, indicator, inputs, start):
+        self.key = key
+        self.indicator = indicator
+        self.inputs = inputs # quote fields or Nodes
+        self.windowed = hasattr(indicator, "refresh")
+        self.start = start    # the first session evaluated
+        self.position = start # the sessions evaluated so far
+
+    def evaluate(self, values, date=None):
+        if hasattr(self.indicator, "evaluate"):
+            return self.indicator.evaluate(values, date)
+        return self.indicator.update(values[0], date)
+
+    def evaluateSeries(self, values, dates=None):
+        indicator = self.indicator
+        if hasattr(indicator, "evaluateSeries"):
+            return indicator.evaluateSeries(values, dates)
+        if len(values) == 1 and hasattr(indicator, "updateSeries"):
+            return indicator.updateSeries(values[0], dates)
+        result = numpy.empty(len(dates))
+        for i, date in enumerate(dates):
+            value = self.evaluate([v[i] for v in values], date)
+            result[i] = numpy.nan if value == None else value
+        return result
+
+class Windows(dict):
+    """The Windows of a symbol by field, shared by the indicators over
+    them that started at the same session"""
+    def __init__(self, start):
+        dict.__init__(self)
+        self.position = start
+
+class IndicatorGraph(object):
+    """The indicators of a set of symbols, with every indicator that has
+    the same type, parameters and inputs on a symbol kept only once.
+
+    An indicator is identified by its key(), the parameters that set it
+    apart from others of its type, and its inputs(), the quote fields or
+    other indicators it is computed from (adjclose if it has no inputs).
+    Input indicators are added to the graph as well and bind() hands the
+    indicator the shared ones, so intermediate results such as the price
+    changes and averages inside RSI are computed once for everything that
+    uses them.  An indicator that is evaluated from its inputs implements
+    evaluate(values, date), and optionally evaluateSeries, otherwise its
+    update is called with its single input.  Indicators without a key are
+    never shared.
+
+    Nodes are kept in the order they were added, inputs first, so
+    evaluating them in that order is a topological order.  Indicators over
+    Windows of quote fields, see indicators.window, share one window per
+    symbol and field.
+
+    Ranges of sessions are evaluated as arrays.  Given a Results, the
+    series and end state of each indicator are loaded from it when the
+    indicator has been evaluated from the same state over the same inputs
+    before, and stored in it otherwise.
+
+    Several consumers, such as strategies, can share a graph as long as
+    they go through the same sessions.  The sessions of a symbol are
+    logged as they are evaluated and each consumer has a cursor into the
+    log; a node evaluates the sessions from where it was added on once,
+    for the first consumer to reach them.  Nodes added by a consumer that
+    is behind the others start at its cursor, so they are only shared
+    with nodes that started there too, and anything they are computed
+    from that is further along is duplicated for them.
+    """
+    def __init__(self, results=None):
+        self.results = results # utils.results.Results, or None
+        self.nodes = {}   # symbol: list of Node, inputs first
+        self.keys = {}    # symbol: dictionary(key=(node key, start), value=Node)
+        self.windows = {} # symbol: dictionary(key=start, value=Windows)
+        self.ticks = {}   # symbol: sessions evaluated, in order
+        self.cursors = {} # (consumer, symbol): ticks seen by a consumer
+
+    def cursor(self, consumer, symbol):
+        return self.cursors.get((consumer, symbol), 0)
+
+    def add(self, symbol, indicator, consumer=None):
+        """Adds an indicator of a symbol for a consumer and returns it, or
+        the one already in the graph with the same key and inputs"""
+        return self._add(symbol, indicator, self.cursor(consumer, symbol), False).indicator
+
+    def _add(self, symbol, indicator, start, fresh):
+        # fresh is set for the inputs of a new node, which need to be
+        # evaluated along with it
+        key = _key(indicator)
+        known = self.keys.setdefault(symbol, {})
+        node = known.get((key, start))
+        if node != None and (not fresh or node.position == start):
+            return node
+
+        inputs = [self._add(symbol, i, start, True) if not isinstance(i, str) else i for i in _inputs(indicator)]
+        if hasattr(indicator, "bind"):
+            indicator.bind([i if isinstance(i, str) else i.indicator for i in inputs])
+        if hasattr(indicator, "attach"):
+            windows = self.windows.setdefault(symbol, {})
+            if not windows.has_key(start) or windows[start].position != start:
+                windows[start] = Windows(start)
+            for field in indicator.FIELDS:
+                if not windows[start].has_key(field):
+                    windows[start][field] = Window()
+            indicator.attach(windows[start])
+
+        node = Node(key, indicator, inputs, start)
+        known[(key, start)] = node
+        self.nodes.setdefault(symbol, []).append(node)
+        return node
+
+    def fields(self, symbol):
+        """The quote fields the indicators of a symbol need"""
+        fields = set()
+        for windows in self.windows.get(symbol, {}).values():
+            fields.update(windows.keys())
+        for node in self.nodes.get(symbol, []):
+            fields.update([i for i in node.inputs if isinstance(i, str)])
+        return sorted(fields)
+
+    def _step(self, consumer, symbol, dates):
+        # Moves the consumer over the sessions and returns the nodes and
+        # windows that have not evaluated them yet
+        ticks = self.ticks.setdefault(symbol, [])
+        cursor = self.cursor(consumer, symbol)
+        if cursor == len(ticks):
+            ticks.extend(dates)
+        elif ticks[cursor:cursor + len(dates)] != list(dates):
+            raise ValueError, "Consumers of the indicators of %s are not in step" % symbol
+        self.cursors[(consumer, symbol)] = cursor + len(dates)
+
+        nodes = [node for node in self.nodes.get(symbol, []) if node.position == cursor]
+        windows = [w for w in self.windows.get(symbol, {}).values() if w.position == cursor]
+        for item in nodes + windows:
+            item.position += len(dates)
+        return nodes, windows
+
+    def update(self, consumer, symbol, date, quote):
+        """Evaluates the indicators of a symbol for a session, taking the
+        fields from quote"""
+        nodes, windows = self._step(consumer, symbol, [date])
+        for fields in windows:
+            for field, window in fields.items():
+                window.append(getattr(quote, field))
+        for node in nodes:
+            if node.windowed:
+                node.indicator.refresh(date)
+            else:
+                node.evaluate([getattr(quote, i) if isinstance(i, str) else i.indicator.value for i in node.inputs], date)
+
+    def updateSeries(self, consumer, symbol, dates, columns):
+        """Evaluates the indicators of a symbol for the sessions of dates,
+        columns is a dictionary of arrays of the values of the fields"""
+        if len(dates) == 0:
+            return
+        nodes, windows = self._step(consumer, symbol, dates)
+        series = {}
+
+        # The windows are filled once per session for all of the
+        # indicators sharing them
+        windowed = [node for node in nodes if node.windowed]
+        if len(windowed) > 0:
+            windows = [(window, columns[field]) for fields in windows for field, window in fields.items()]
+            digests = [self._digest(symbol, node, [columns[i] for i in node.inputs], dates) for node in windowed]
+            results = [self._cached(symbol, node, digest) for node, digest in zip(windowed, digests)]
+            if None not in results:
+                # The windows end up holding the latest values either way
+                for window, column in windows:
+                    window.extend(column)
+                for node, result in zip(windowed, results):
+                    series[node] = self._restore(node, result)
+            else:
+                tables = [_flushed(node.indicator) for node in windowed]
+                rows = [table.nrows if table != None else None for table in tables]
+                for node in windowed:
+                    series[node] = numpy.empty(len(dates))
+                for i, date in enumerate(dates):
+                    for window, column in windows:
+                        window.append(column[i])
+                    for node in windowed:
+                        value = node.indicator.refresh(date)
+                        series[node][i] = numpy.nan if value == None else value
+                for node, digest, start in zip(windowed, digests, rows):
+                    self._store(symbol, node, digest, series[node], start)
+
+        for node in nodes:
+            if not node.windowed:
+                values = [columns[i] if isinstance(i, str) else series[i] for i in node.inputs]
+                series[node] = self._evaluateSeries(symbol, node, values, dates)
+
+    def series(self, symbol, indicator, values, dates=None):
+        """Continues an indicator of a symbol over an array of values at
+        once, outside of the sessions the graph steps through, and returns
+        its value after each of them.  Used by the array form of
+        strategies, the result is loaded from the Results if it has it."""
+        for node in self.nodes.get(symbol, []):
+            if node.indicator is indicator and not node.windowed:
+                return self._evaluateSeries(symbol, node, [values], dates)
+        return indicator.updateSeries(values, dates)
+
+    def _evaluateSeries(self, symbol, node, values, dates):
+        digest = self._digest(symbol, node, values, dates)
+        result = self._cached(symbol, node, digest)
+        if result != None:
+            return self._restore(node, result)
+        table = _flushed(node.indicator)
+        start = table.nrows if table != None else None
+        result = numpy.asarray(node.evaluateSeries(values, dates), dtype=float)
+        self._store(symbol, node, digest, result, start)
+        return result
+
+    def _digest(self, symbol, node, values, dates):
+        # Indicators without a key are never shared, nor cached
+        if self.results == None or not hasattr(node.indicator, "key"):
+            return None
+        return self.results.digest(symbol, node.key, node.indicator.getState(), dates, values)
+
+    def _cached(self, symbol, node, digest):
+        if digest == None:
+            return None
+        result = self.results.get(symbol, digest)
+        # A result computed without an output file cannot fill a table
+        if result != None and result[2] is None and getattr(node.indicator, "tbl", None) != None:
+            return None
+        return result
+
+    def _restore(self, node, result):
+        series, state, rows = result
+        node.indicator.setState(state)
+        if getattr(node.indicator, "tbl", None) != None:
+            node.indicator.tbl.append(rows)
+        return series
+
+    def _store(self, symbol, node, digest, series, start):
+        if digest == None:
+            return
+        rows = None
+        if start != None:
+            rows = _flushed(node.indicator).read(start)
+        self.results.put(symbol, digest, series, node.indicator.getState(), rows)
+
+    def getState(self, symbol):
+        """The states of the indicators of a symbol by key"""
+        return dict([(node.key, node.indicator.getState()) for node in self.nodes.get(symbol, [])])
+
+    def setState(self, symbol, state):
+        """Restores getState, if it has a state for every indicator of the
+        symbol, and returns whether it did"""
+        nodes = self.nodes.get(symbol, [])
+        if len(nodes) == 0 or [node for node in nodes if not state.has_key(node.key)]:
+            return False
+        for node in nodes:
+            node.indicator.setState(state[node.key])
+        return True
+
+if __name__ == "__main__":
+    import unittest
+    import datetime
+    from ema import EMA
+    from rsi import RSI
+    from sma import SMA
+    from bollinger import Bollinger
+
+    class Quote(object):
+        def __init__(self, adjclose):
+            self.adjclose = adjclose
+
+    class MemoryResults(object):
+        # The interface of utils.results.Results, kept in a dictionary
+        def __init__(self):
+            self.results = {}
+            self.hits = 0
+
+        def digest(self, symbol, key, state, dates, values):
+            return repr((symbol, key, sorted(state.items()), dates, [list(v) for v in values]))
+
+        def get(self, symbol, digest):
+            result = self.results.get(digest)
+            if result != None:
+                self.hits += 1
+            return result
+
+        def put(self, symbol, digest, series, state, rows=None):
+            self.results[digest] = (numpy.array(series), state, rows)
+
+    class IndicatorGraphTest(unittest.TestCase):
+
+        def setUp(self):
+            self.values = 100 + numpy.cumsum(numpy.random.RandomState(1).normal(size=300))
+            self.dates = [datetime.datetime(2010, 1, 1) + datetime.timedelta(days=i) for i in xrange(len(self.values))]
+
+        def test_Dedup(self):
+            graph = IndicatorGraph()
+            ema = graph.add("spy", EMA(15))
+            self.assertTrue(graph.add("spy", EMA(15)) is ema)
+            self.assertFalse(graph.add("iwm", EMA(15)) is ema)
+            self.assertFalse(graph.add("spy", EMA(20)) is ema)
+
+            rsi = graph.add("spy", RSI(14))
+            # The gain and loss averages share one price change node
+            keys = [node.key for node in graph.nodes["spy"]]
+            self.assertEqual(len([key for key in keys if key.startswith("Diff")]), 1)
+            self.assertTrue(keys.index("Diff()<adjclose>") < keys.index(graph.nodes["spy"][-1].key))
+            self.assertTrue(graph.add("spy", RSI(14)) is rsi)
+
+        def test_Values(self):
+            graph = IndicatorGraph()
+            indicators = [graph.add("spy", i) for i in (EMA(15), RSI(14), SMA(10), Bollinger(20))]
+            alone = [EMA(15), RSI(14), SMA(10), Bollinger(20)]
+            consumer = object()
+            graph.updateSeries(consumer, "spy", self.dates[:100], {"adjclose": self.values[:100]})
+            for d, v in zip(self.dates[100:], self.values[100:]):
+                graph.update(consumer, "spy", d, Quote(v))
+            for v in self.values:
+                for indicator in alone:
+                    indicator.update(v)
+            for a, b in zip(indicators, alone):
+                self.assertAlmostEqual(a.value, b.value)
+
+        def test_Consumers(self):
+            graph = IndicatorGraph()
+            ema = graph.add("spy", EMA(15))
+            first, second = object(), object()
+            for d, v in zip(self.dates[:10], self.values[:10]):
+                graph.update(first, "spy", d, Quote(v))
+                graph.update(second, "spy", d, Quote(v))
+            alone = EMA(15)
+            for v in self.values[:10]:
+                alone.update(v)
+            self.assertEqual(ema.value, alone.value)
+            graph.update(second, "spy", self.dates[10], Quote(1.0))
+            self.assertRaises(ValueError, graph.update, first, "spy", self.dates[11], Quote(1.0))
+
+        def test_Late(self):
+            # A consumer that adds indicators after the graph was updated
+            # for another one catches them up as it goes through the same
+            # sessions
+            graph = IndicatorGraph()
+            first, second = object(), object()
+            rsi = graph.add("spy", RSI(14), first)
+            graph.updateSeries(first, "spy", self.dates[:100], {"adjclose": self.values[:100]})
+            self.assertTrue(graph.add("spy", RSI(14), second) is rsi)
+            late = graph.add("spy", RSI(20), second)
+            ema = graph.add("spy", EMA(15), second)
+            graph.updateSeries(second, "spy", self.dates[:100], {"adjclose": self.values[:100]})
+            for d, v in zip(self.dates[100:], self.values[100:]):
+                graph.update(first, "spy", d, Quote(v))
+                graph.update(second, "spy", d, Quote(v))
+            alone = [RSI(14), RSI(20), EMA(15)]
+            for v in self.values:
+                for indicator in alone:
+                    indicator.update(v)
+            for a, b in zip((rsi, late, ema), alone):
+                self.assertAlmostEqual(a.value, b.value)
+
+        def test_Results(self):
+            results = MemoryResults()
+            values = []
+            for run in xrange(2):
+                graph = IndicatorGraph(results)
+                indicators = [graph.add("spy", i) for i in (EMA(15), RSI(14), SMA(10), Bollinger(20))]
+                consumer = object()
+                graph.updateSeries(consumer, "spy", self.dates[:100], {"adjclose": self.values[:100]})
+                for d, v in zip(self.dates[100:], self.values[100:]):
+                    graph.update(consumer, "spy", d, Quote(v))
+                values.append([indicator.value for indicator in indicators])
+            # Every node of the second run was loaded
+            self.assertEqual(results.hits, len(graph.nodes["spy"]))
+            self.assertEqual(values[0], values[1])
+
+        def test_State(self):
+            graph = IndicatorGraph()
+            rsi = graph.add("spy", RSI(14))
+            consumer = object()
+            graph.updateSeries(consumer, "spy", self.dates[:100], {"adjclose": self.values[:100]})
+            resumed = IndicatorGraph()
+            self.assertFalse(resumed.setState("spy", graph.getState("spy")))
+            other = resumed.add("spy", RSI(14))
+            self.assertTrue(resumed.setState("spy", graph.getState("spy")))
+            graph.updateSeries(consumer, "spy", self.dates[100:], {"adjclose": self.values[100:]})
+            resumed.updateSeries(consumer, "spy", self.dates[100:], {"adjclose": self.values[100:]})
+            self.assertAlmostEqual(rsi.value, other.value)
+
+    unittest.main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import numpy
+import tables
+from ema import EMA
+
+class MACDData(tables.IsDescription):
+    date = tables.TimeCol()
+    value = tables.Float32Col()
+    signal = tables.Float32Col()
+    histogram = tables.Float32Col()
+
+class MACDLine(object):
+    """The fast EMA of the closes less the slow one"""
+    def __init__(self, fast, slow):
+        self.fast = fast
+        self.slow = slow
+        self.value = None
+
+    def key(self):
+        return ()
+
+    def inputs(self):
+        return [self.fast, self.slow]
+
+    def bind(self, inputs):
+        self.fast, self.slow = inputs
+
+    def getState(self):
+        return {'value': self.value}
+
+    def setState(self, state):
+        self.value = state['value']
+
+    def update(self, value, date=None):
+        self.value = self.fast.update(value) - self.slow.update(value)
+        return self.value
+
+    def evaluate(self, values, date=None):
+        fast, slow = values
+        if fast == None or slow == None:
+            self.value = None
+        else:
+            self.value = fast - slow
+        return self.value
+
+    def evaluateSeries(self, values, dates=None):
+        fast, slow = values
+        result = numpy.asarray(fast, dtype=float) - numpy.asarray(slow, dtype=float)
+        if len(result) > 0:
+            self.value = float(result[-1])
+        return result
+
+class MACD(object):
+    """Moving average convergence/divergence, the value is the fast EMA
+    of the closes less the slow one, signal is an EMA of the value and
+    histogram the value less the signal.
+
+    In an IndicatorGraph the EMAs are nodes of their own, so the fast and
+    slow averages are shared with any EMA of the closes of the same
+    period, and evaluate combines the line and its signal."""
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.line = MACDLine(self.fast, self.slow)
+        self.trigger = EMA(signal, self.line)
+        self.value = None
+        self.signal = None
+        self.histogram = None
+        self.tbl = None
+
+    def key(self):
+        return (self.fast.period, self.slow.period, self.trigger.period)
+
+    def inputs(self):
+        return [self.line, self.trigger]
+
+    def bind(self, inputs):
+        self.line, self.trigger = inputs
+        self.fast, self.slow = self.line.fast, self.line.slow
+
+    def setupH5(self, h5file, h5where, h5name):
+        if h5file != None and h5where != None and h5name != None:
+            try:
+                self.tbl = h5file.getNode(h5where, h5name, classname="Table")
+            except tables.NoSuchNodeError:
+                self.tbl = h5file.createTable(h5where, h5name, MACDData)
+
+    def getState(self):
+        """The state needed to resume updating, see setState"""
+        return {'value': self.value,
+                'fast': self.fast.getState(),
+                'slow': self.slow.getState(),
+                'signal': self.trigger.getState()}
+
+    def setState(self, state):
+        self.value = state['value']
+        self.fast.setState(state['fast'])
+        self.slow.setState(state['slow'])
+        self.trigger.setState(state['signal'])
+        self.line.value = self.value
+        self.signal = self.trigger.value
+        self.histogram = None
+        if self.value != None:
+            self.histogram = self.value - self.signal
+
+    def update(self, value, date=None):
+        return self.evaluate([self.line.update(value), self.trigger.update(self.line.value)], date)
+
+    def evaluate(self, values, date=None):
+        """Sets the MACD from the current line and signal"""
+        self.value, self.signal = values
+        self.histogram = None
+        if self.value != None and self.signal != None:
+            self.histogram = self.value - self.signal
+
+        if self.tbl != None and date:
+            self.tbl.row["date"] = date.date().toordinal()
+            self.tbl.row["value"] = self.value
+            self.tbl.row["signal"] = self.signal
+            self.tbl.row["histogram"] = self.histogram
+            self.tbl.row.append()
+
+        return self.value
+
+    def evaluateSeries(self, values, dates=None):
+        """Array form of evaluate"""
+        line, signal = [numpy.asarray(v, dtype=float) for v in values]
+        if len(line) == 0:
+            return numpy.empty(0)
+        histogram = line - signal
+        self.value = float(line[-1])
+        self.signal = float(signal[-1])
+        self.histogram = float(histogram[-1])
+
+        if self.tbl != None and dates != None:
+            self.tbl.append(zip([date.date().toordinal() for date in dates], line, signal, histogram))
+
+        return line
+
+if __name__ == "__main__":
+    import unittest
+    import datetime
+
+    class Quote(object):
+        def __init__(self, adjclose):
+            self.adjclose = adjclose
+
+    class MACDTest(unittest.TestCase):
+
+        def test_Value(self):
+            values = 100 + numpy.cumsum(numpy.random.RandomState(1).normal(size=200))
+            macd = MACD(12, 26, 9)
+            fast, slow, signal = EMA(12), EMA(26), EMA(9)
+            for v in values:
+                macd.update(v)
+                line = fast.update(v) - slow.update(v)
+                self.assertAlmostEqual(macd.value, line)
+                self.assertAlmostEqual(macd.signal, signal.update(line))
+                self.assertAlmostEqual(macd.histogram, macd.value - macd.signal)
+
+        def test_State(self):
+            macd = MACD()
+            for v in xrange(50):
+                macd.update(float(v))
+            resumed = MACD()
+            resumed.setState(macd.getState())
+            self.assertEqual(resumed.update(50.0), macd.update(50.0))
+            self.assertEqual(resumed.histogram, macd.histogram)
+
+        def test_Graph(self):
+            # The averages of MACD are shared with the EMAs of the closes
+            from graph import IndicatorGraph
+            values = 100 + numpy.cumsum(numpy.random.RandomState(2).normal(size=100))
+            dates = [datetime.datetime(2010, 1, 1) + datetime.timedelta(days=i) for i in xrange(len(values))]
+            graph = IndicatorGraph()
+            ema = graph.add("spy", EMA(12))
+            macd = graph.add("spy", MACD(12, 26, 9))
+            self.assertTrue(macd.fast is ema)
+            keys = [node.key for node in graph.nodes["spy"]]
+            self.assertEqual(keys.count("EMA(12)<adjclose>"), 1)
+
+            consumer = object()
+            graph.updateSeries(consumer, "spy", dates[:50], {"adjclose": values[:50]})
+            for d, v in zip(dates[50:], values[50:]):
+                graph.update(consumer, "spy", d, Quote(v))
+            alone = MACD(12, 26, 9)
+            for v in values:
+                alone.update(v)
+            self.assertAlmostEqual(macd.value, alone.value)
+            self.assertAlmostEqual(macd.signal, alone.signal)
+            self.assertAlmostEqual(macd.histogram, alone.histogram)
+
+    unittest.main()
@@ -27,9 +27,22 @@ class SimpleValue(object):
         self.value = 0.0
         self.tbl = None
 
+    def key(self):
+        return ()
+
     def setupH5(self, h5file, h5where, h5name):
         if h5file != None and h5where != None and h5name != None:
-            self.tbl = h5file.createTable(h5where, h5name, ValueData)
+            try:
+                self.tbl = h5file.getNode(h5where, h5name, classname="Table")
+            except tables.NoSuchNodeError:
+                self.tbl = h5file.createTable(h5where, h5name, ValueData)
+
+    def getState(self):
+        """The state needed to resume updating, see setState"""
+        return {'value': self.value}
+
+    def setState(self, state):
+        self.value = state['value']
 
     def update(self, value, date=None):
         self.value = value
@@ -37,6 +50,5 @@ class SimpleValue(object):
             self.tbl.row["date"] = date.date().toordinal()
             self.tbl.row["value"] = self.value
             self.tbl.row.append()
-            self.tbl.flush()
 
         return self.value
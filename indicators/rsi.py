@@ -18,7 +18,9 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 import tables
 import math
+import numpy
 from ema import EMA
+from diff import Gain, Loss
 
 class RSIData(tables.IsDescription):
     date = tables.TimeCol()
@@ -29,13 +31,40 @@ class RSI(object):
     def __init__(self, period):
         self.value = None
         self.last = None
-        self.ema_u = EMA(period)
-        self.ema_d = EMA(period)
+        self.period = period
+        self.ema_u = EMA(period, Gain())
+        self.ema_d = EMA(period, Loss())
         self.tbl = None
+
+    def key(self):
+        return (self.period,)
+
+    def inputs(self):
+        """In an IndicatorGraph the averages of the gains and losses are
+        nodes of their own, shared with any other indicator using them,
+        and evaluate combines them"""
+        return [self.ema_u, self.ema_d]
+
+    def bind(self, inputs):
+        self.ema_u, self.ema_d = inputs
     
     def setupH5(self, h5file, h5where, h5name):
         if h5file != None and h5where != None and h5name != None:
-            self.tbl = h5file.createTable(h5where, h5name, RSIData)
+            try:
+                self.tbl = h5file.getNode(h5where, h5name, classname="Table")
+            except tables.NoSuchNodeError:
+                self.tbl = h5file.createTable(h5where, h5name, RSIData)
+
+    def getState(self):
+        """The state needed to resume updating, see setState"""
+        return {'value': self.value, 'last': self.last,
+                'ema_u': self.ema_u.getState(), 'ema_d': self.ema_d.getState()}
+
+    def setState(self, state):
+        self.value = state['value']
+        self.last = state['last']
+        self.ema_u.setState(state['ema_u'])
+        self.ema_d.setState(state['ema_d'])
 
     def update(self, value, date=None):
         if self.last == None:
@@ -64,10 +93,67 @@ class RSI(object):
             self.tbl.row["date"] = date.date().toordinal()
             self.tbl.row["value"] = self.value
             self.tbl.row.append()
-            self.tbl.flush()
 
         return self.value
 
+    def evaluate(self, values, date=None):
+        """Sets the RSI from the current averages of the gains and losses"""
+        u, d = values
+        if d == 0:
+            self.value = 100.0
+        else:
+            self.value = 100.0 - (100.0 / (1 + (u / d)))
+
+        if self.tbl != None and date:
+            self.tbl.row["date"] = date.date().toordinal()
+            self.tbl.row["value"] = self.value
+            self.tbl.row.append()
+
+        return self.value
+
+    def evaluateSeries(self, values, dates=None):
+        """Array form of evaluate"""
+        u, d = values
+        if len(u) == 0:
+            return numpy.empty(0)
+        old = numpy.seterr(divide="ignore", invalid="ignore")
+        try:
+            result = numpy.where(d == 0, 100.0, 100.0 - (100.0 / (1 + (u / d))))
+        finally:
+            numpy.seterr(**old)
+        self.value = float(result[-1])
+
+        if self.tbl != None and dates != None:
+            self.tbl.append(zip([date.date().toordinal() for date in dates], result))
+
+        return result
+
+    def updateSeries(self, values, dates=None):
+        """Array form of update.  Continues from the current state over all
+        of the values at once and returns the RSI after each of them."""
+        values = numpy.asarray(values, dtype=float)
+        if len(values) == 0:
+            return numpy.empty(0)
+        if self.last == None:
+            self.last = values[0]
+
+        diffs = numpy.diff(numpy.concatenate(([self.last], values)))
+        self.last = float(values[-1])
+        u = self.ema_u.updateSeries(numpy.where(diffs > 0, diffs, 0.0))
+        d = self.ema_d.updateSeries(numpy.where(diffs < 0, -diffs, 0.0))
+
+        old = numpy.seterr(divide="ignore", invalid="ignore")
+        try:
+            result = numpy.where(d == 0, 100.0, 100.0 - (100.0 / (1 + (u / d))))
+        finally:
+            numpy.seterr(**old)
+        self.value = float(result[-1])
+
+        if self.tbl != None and dates != None:
+            self.tbl.append(zip([date.date().toordinal() for date in dates], result))
+
+        return result
+
 if __name__ == "__main__":
     import unittest
 
@@ -121,4 +207,16 @@ if __name__ == "__main__":
             rsi.update(50.)   # U = 10 D = 0, ema_u = 2, ema_d = 1.6, rs = 1.25, rsi = 55.555555  
             self.assertAlmostEqual(rsi.value, 55.555555555555)
 
+        def test_Series(self):
+            values = 100 + numpy.cumsum(numpy.random.RandomState(1).normal(size=1000))
+            rsi = RSI(14)
+            expected = [rsi.update(v) for v in values]
+            rsi = RSI(14)
+            self.assertTrue(numpy.allclose(rsi.updateSeries(values), expected, rtol=1e-9))
+            resumed = RSI(14)
+            for v in values[:10]:
+                resumed.update(v)
+            self.assertTrue(numpy.allclose(resumed.updateSeries(values[10:]), expected[10:], rtol=1e-9))
+            self.assertEqual(list(RSI(9).updateSeries([50., 40., 50.])[0:2]), [100.0, 0.0])
+
     unittest.main()
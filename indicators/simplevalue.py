@@ -16,6 +16,7 @@ You should have received a copy of the GNU General Public License
 along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
+import numpy
 import tables
 
 class ValueData(tables.IsDescription):
@@ -27,9 +28,22 @@ class SimpleValue(object):
         self.value = 0.0
         self.tbl = None
 
+    def key(self):
+        return ()
+
     def setupH5(self, h5file, h5where, h5name):
         if h5file != None and h5where != None and h5name != None:
-            self.tbl = h5file.createTable(h5where, h5name, ValueData)
+            try:
+                self.tbl = h5file.getNode(h5where, h5name, classname="Table")
+            except tables.NoSuchNodeError:
+                self.tbl = h5file.createTable(h5where, h5name, ValueData)
+
+    def getState(self):
+        """The state needed to resume updating, see setState"""
+        return {'value': self.value}
+
+    def setState(self, state):
+        self.value = state['value']
 
     def update(self, value, date=None):
         self.value = value
@@ -37,6 +51,17 @@ class SimpleValue(object):
             self.tbl.row["date"] = date.date().toordinal()
             self.tbl.row["value"] = self.value
             self.tbl.row.append()
-            self.tbl.flush()
 
         return self.value
+
+    def updateSeries(self, values, dates=None):
+        """Array form of update"""
+        result = numpy.array(values, dtype=float)
+        if len(result) == 0:
+            return result
+        self.value = float(result[-1])
+
+        if self.tbl != None and dates != None:
+            self.tbl.append(zip([d.date().toordinal() for d in dates], result))
+
+        return result
@@ -16,36 +16,68 @@ You should have received a copy of the GNU General Public License
 along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
+import numpy
 import tables
+from window import WindowIndicator
 
 class SMAData(tables.IsDescription):
     date = tables.TimeCol()
     value = tables.Float32Col()
 
-class SMA(object):
+class SMA(WindowIndicator):
+    """Simple moving average of the latest period closes.  The window
+    starts out as period zeros, so the average ramps up over the first
+    period values."""
+    DATA = SMAData
+
     def __init__(self, period):
-        self.values = [0.0 for x in xrange(period)]
-        self.value = 0.0
+        WindowIndicator.__init__(self, period + 1)
         self.period = period
-        self.tbl = None
+        self.value = 0.0
+        self.sum = 0.0
+
+    def key(self):
+        return (self.period,)
+
+    def _refresh(self):
+        window = self.window()
+        self.sum += window.newest()
+        if self.seen() > self.period:
+            self.sum -= window.get(window.count - 1 - self.period)
+        self.value = self.sum / self.period
+
+    def _resum(self):
+        self.sum = float(self.window().latest(min(self.seen(), self.period)).sum())
+        self.value = self.sum / self.period
 
-    def setupH5(self, h5file, h5where, h5name):
-        if h5file != None and h5where != None and h5name != None:
-            self.tbl = h5file.createTable(h5where, h5name, SMAData)
+    def _getState(self):
+        return {'value': self.value, 'sum': self.sum}
 
-    def update(self, value, date=None):
-        oldest = self.values.pop()
-        self.values.insert(0, value)
-       
-        self.value = self.value - (oldest / self.period) + (value / self.period) 
+    def _setState(self, state):
+        self.value = state['value']
+        self.sum = state['sum']
 
-        if self.tbl != None and date:
-            self.tbl.row["date"] = date.date().toordinal()
-            self.tbl.row["value"] = self.value
-            self.tbl.row.append()
-            self.tbl.flush()
+    def updateSeries(self, values, dates=None):
+        """Array form of update.  Continues from the current window over all
+        of the values at once and returns the average after each of them."""
+        if self.shared:
+            raise ValueError, "The windows are shared, append to them and call refresh"
+        values = numpy.asarray(values, dtype=float)
+        if len(values) == 0:
+            return numpy.empty(0)
 
-        return self.value
+        held = self.window().latest(min(self.seen(), self.period))
+        series = numpy.concatenate((numpy.zeros(self.period - len(held)), held, values))
+        sums = numpy.cumsum(numpy.concatenate(([0.0], series)))
+        result = (sums[self.period+1:] - sums[1:len(values)+1]) / self.period
+
+        self.window().extend(values)
+        self._resum()
+
+        if self.tbl != None and dates != None:
+            self.tbl.append(zip([d.date().toordinal() for d in dates], result))
+
+        return result
 
 if __name__ == "__main__":
     import unittest
@@ -71,4 +103,38 @@ if __name__ == "__main__":
             sma.update(5.0)
             self.assertEqual(sma.value, 5.0)
 
+        def test_Series(self):
+            values = 100 + numpy.cumsum(numpy.random.RandomState(1).normal(size=1000))
+            for period in (1, 5, 50):
+                sma = SMA(period)
+                expected = [sma.update(v) for v in values]
+                resumed = SMA(period)
+                for v in values[:10]:
+                    resumed.update(v)
+                sma = SMA(period)
+                self.assertTrue(numpy.allclose(sma.updateSeries(values), expected, rtol=1e-9))
+                self.assertTrue(numpy.allclose(resumed.updateSeries(values[10:]), expected[10:], rtol=1e-9))
+                self.assertAlmostEqual(sma.value, resumed.value)
+
+        def test_Drift(self):
+            # Large values with small changes lose precision in a running
+            # sum, the periodic resummation keeps it exact
+            values = 1e8 + numpy.random.RandomState(2).normal(size=20000)
+            sma = SMA(20)
+            for v in values:
+                sma.update(v)
+            self.assertAlmostEqual(sma.value, values[-20:].mean(), places=6)
+
+        def test_State(self):
+            values = 100 + numpy.cumsum(numpy.random.RandomState(3).normal(size=100))
+            sma = SMA(10)
+            for v in values[:60]:
+                sma.update(v)
+            resumed = SMA(10)
+            resumed.setState(sma.getState())
+            for v in values[60:]:
+                sma.update(v)
+                resumed.update(v)
+                self.assertAlmostEqual(sma.value, resumed.value)
+
     unittest.main()
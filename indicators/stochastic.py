@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import collections
+import tables
+from window import WindowIndicator, RollingExtreme
+
+class StochasticData(tables.IsDescription):
+    date = tables.TimeCol()
+    value = tables.Float32Col()
+    d = tables.Float32Col()
+
+class Stochastic(WindowIndicator):
+    """Stochastic oscillator, the value (%K) is where the close is between
+    the lowest low and highest high of the latest period sessions, from 0
+    to 100, and d (%D) is the average of the latest smooth values.  A
+    session range of zero puts the value at 50."""
+    FIELDS = ("adjhigh", "adjlow", "adjclose")
+    DATA = StochasticData
+    COLUMNS = ("d",)
+
+    def __init__(self, period=14, smooth=3):
+        WindowIndicator.__init__(self, period)
+        self.period = period
+        self.highest = RollingExtreme(period)
+        self.lowest = RollingExtreme(period, largest=False)
+        self.k = collections.deque(maxlen=smooth)
+        self.d = None
+
+    def key(self):
+        return (self.period, self.k.maxlen)
+
+    def _refresh(self):
+        self.highest.push(self.window("adjhigh"))
+        self.lowest.push(self.window("adjlow"))
+        high = self.highest.value(self.window("adjhigh"))
+        low = self.lowest.value(self.window("adjlow"))
+        if high > low:
+            self.value = 100.0 * (self.window().newest() - low) / (high - low)
+        else:
+            self.value = 50.0
+        self.k.append(self.value)
+        self.d = sum(self.k) / len(self.k)
+
+    def _getState(self):
+        return {'value': self.value, 'k': list(self.k)}
+
+    def _setState(self, state):
+        self.value = state['value']
+        self.k.clear()
+        self.k.extend(state['k'])
+        if len(self.k) > 0:
+            self.d = sum(self.k) / len(self.k)
+        self.highest.rebuild(self.window("adjhigh"), self.seen())
+        self.lowest.rebuild(self.window("adjlow"), self.seen())
+
+if __name__ == "__main__":
+    import unittest
+    import numpy
+
+    class StochasticTest(unittest.TestCase):
+
+        def test_Value(self):
+            closes = 100 + numpy.cumsum(numpy.random.RandomState(1).normal(size=200))
+            highs, lows = closes + 1, closes - 1
+            stochastic = Stochastic(14, 3)
+            ks = []
+            for i in xrange(len(closes)):
+                stochastic.update((highs[i], lows[i], closes[i]))
+                high, low = highs[max(0, i-13):i+1].max(), lows[max(0, i-13):i+1].min()
+                ks.append(100.0 * (closes[i] - low) / (high - low))
+                self.assertAlmostEqual(stochastic.value, ks[-1])
+                self.assertAlmostEqual(stochastic.d, numpy.mean(ks[-3:]))
+
+        def test_State(self):
+            closes = 100 + numpy.cumsum(numpy.random.RandomState(2).normal(size=100))
+            stochastic = Stochastic(14, 3)
+            for c in closes[:50]:
+                stochastic.update((c + 1, c - 1, c))
+            resumed = Stochastic(14, 3)
+            resumed.setState(stochastic.getState())
+            for c in closes[50:]:
+                self.assertAlmostEqual(resumed.update((c + 1, c - 1, c)), stochastic.update((c + 1, c - 1, c)))
+                self.assertAlmostEqual(resumed.d, stochastic.d)
+
+    unittest.main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import collections
+import numpy
+import tables
+
+class Window(object):
+    """The latest values of one field of a symbol, kept in a fixed size
+    array used as a ring buffer.
+
+    Values are numbered in the order they are appended, count is the
+    number appended so far and the value numbered seq is held while it is
+    one of the latest size values and not older than first.
+    """
+    def __init__(self, size=1):
+        self.data = numpy.zeros(max(1, size))
+        self.count = 0
+        self.first = 0
+
+    def __len__(self):
+        return self.count - max(self.first, self.count - len(self.data))
+
+    def grow(self, size):
+        """Makes room for at least size values, keeping the ones held"""
+        if size <= len(self.data):
+            return
+        held = self.latest(len(self))
+        self.data = numpy.zeros(size)
+        self.count -= len(held)
+        self.first = self.count
+        self.extend(held)
+
+    def append(self, value):
+        if value == None:
+            value = numpy.nan
+        self.data[self.count % len(self.data)] = value
+        self.count += 1
+
+    def extend(self, values):
+        values = numpy.asarray(values, dtype=float)
+        count = self.count + len(values)
+        values = values[-len(self.data):]
+        seqs = numpy.arange(count - len(values), count)
+        self.data[seqs % len(self.data)] = values
+        self.count = count
+
+    def get(self, seq):
+        return float(self.data[seq % len(self.data)])
+
+    def newest(self):
+        return float(self.data[(self.count - 1) % len(self.data)])
+
+    def latest(self, n):
+        """The latest n values, oldest first"""
+        n = min(n, len(self))
+        return self.data[numpy.arange(self.count - n, self.count) % len(self.data)]
+
+    def restore(self, values, count):
+        """Puts back the latest values from a saved state, numbering them
+        so that the last one is count - 1.  Windows shared by several
+        indicators are restored by each of them, the one that saved the
+        most values is kept."""
+        if count < self.count or (count == self.count and len(values) <= len(self)):
+            return
+        self.grow(len(values))
+        self.count = self.first = count - len(values)
+        self.extend(values)
+
+class RollingExtreme(object):
+    """The largest (or smallest) of the latest period values of a Window,
+    using a deque of the sequence numbers of the values that can still
+    become the extreme, so each update is O(1) amortized."""
+    def __init__(self, period, largest=True):
+        self.period = period
+        self.largest = largest
+        self.seqs = collections.deque()
+
+    def _dominated(self, held, value):
+        if self.largest:
+            return held <= value
+        return held >= value
+
+    def push(self, window, seq=None):
+        """Takes in the newest value of the window, or the one numbered seq"""
+        if seq == None:
+            seq = window.count - 1
+        value = window.get(seq)
+        while self.seqs and self._dominated(window.get(self.seqs[-1]), value):
+            self.seqs.pop()
+        self.seqs.append(seq)
+        while self.seqs[0] <= seq - self.period:
+            self.seqs.popleft()
+
+    def rebuild(self, window, n):
+        """Starts over from the latest n values of the window"""
+        self.seqs.clear()
+        for seq in xrange(window.count - min(n, len(window), self.period), window.count):
+            self.push(window, seq)
+
+    def value(self, window):
+        if not self.seqs:
+            return None
+        return window.get(self.seqs[0])
+
+class WindowData(tables.IsDescription):
+    date = tables.TimeCol()
+    value = tables.Float32Col()
+
+class WindowIndicator(object):
+    """Base of the streaming indicators computed from Windows of the
+    FIELDS of a quote.
+
+    On its own an indicator keeps windows of its own and update appends
+    the newest values to them.  Strategy.addIndicator instead attaches the
+    windows of the symbol, which are shared by all of its indicators:
+    each session the strategy appends the quote to them once and calls
+    refresh on every indicator.
+
+    Subclasses implement _refresh to take in the newest values, and may
+    implement _resum to recompute their running sums exactly from the
+    windows, which is done every resum updates (by default the size of
+    the window, keeping updates O(1) amortized) so they do not drift.
+    """
+    FIELDS = ("adjclose",)
+    DATA = WindowData
+    COLUMNS = ()
+
+    def __init__(self, size, resum=None):
+        self.size = size
+        self.windows = dict((field, Window(size)) for field in self.FIELDS)
+        self.shared = False
+        self.start = 0
+        self.resum = resum or max(size, 1)
+        self.updates = 0
+        self.value = None
+        self.tbl = None
+
+    def setupH5(self, h5file, h5where, h5name):
+        if h5file != None and h5where != None and h5name != None:
+            try:
+                self.tbl = h5file.getNode(h5where, h5name, classname="Table")
+            except tables.NoSuchNodeError:
+                self.tbl = h5file.createTable(h5where, h5name, self.DATA)
+
+    def attach(self, windows):
+        """Use windows, a dictionary of Window by field, instead of the
+        indicator's own, making them large enough for it"""
+        for field in self.FIELDS:
+            windows[field].grow(self.size)
+        self.windows = windows
+        self.shared = True
+        self.start = self.window().count
+
+    def inputs(self):
+        return list(self.FIELDS)
+
+    def window(self, field=None):
+        return self.windows[field or self.FIELDS[-1]]
+
+    def seen(self):
+        """The number of values the indicator has taken in"""
+        return self.window().count - self.start
+
+    def update(self, value, date=None):
+        """Appends a value, or a tuple with a value of each of the FIELDS,
+        to the indicator's own windows and refreshes it"""
+        if self.shared:
+            raise ValueError, "The windows are shared, append to them and call refresh"
+        if len(self.FIELDS) == 1:
+            value = (value,)
+        for field, v in zip(self.FIELDS, value):
+            self.windows[field].append(v)
+        return self.refresh(date)
+
+    def refresh(self, date=None):
+        """Takes in the newest values of the windows"""
+        self._refresh()
+        self.updates += 1
+        if self.updates % self.resum == 0:
+            self._resum()
+
+        if self.tbl != None and date:
+            self.tbl.row["date"] = date.date().toordinal()
+            self.tbl.row["value"] = self.value
+            for column in self.COLUMNS:
+                self.tbl.row[column] = getattr(self, column)
+            self.tbl.row.append()
+
+        return self.value
+
+    def _refresh(self):
+        raise NotImplementedError
+
+    def _resum(self):
+        pass
+
+    def _getState(self):
+        return {'value': self.value}
+
+    def _setState(self, state):
+        self.value = state['value']
+
+    def getState(self):
+        """The state needed to resume updating, see setState"""
+        state = self._getState()
+        state['seen'] = self.seen()
+        state['updates'] = self.updates
+        state['count'] = self.window().count
+        state['windows'] = {}
+        for field in self.FIELDS:
+            values = self.windows[field].latest(min(self.seen(), self.size))
+            state['windows'][field] = [float(v) for v in values]
+        return state
+
+    def setState(self, state):
+        for field in self.FIELDS:
+            self.windows[field].restore(state['windows'][field], state['count'])
+        self.start = state['count'] - state['seen']
+        # The running sums are recomputed at the same updates as they
+        # would have been without stopping
+        self.updates = state.get('updates', 0)
+        self._setState(state)
+
+if __name__ == "__main__":
+    import unittest
+
+    class WindowTest(unittest.TestCase):
+
+        def test_Ring(self):
+            window = Window(3)
+            for x in xrange(5):
+                window.append(float(x))
+            self.assertEqual(len(window), 3)
+            self.assertEqual(list(window.latest(3)), [2.0, 3.0, 4.0])
+            self.assertEqual(window.get(2), 2.0)
+            self.assertEqual(window.newest(), 4.0)
+
+            window.grow(5)
+            self.assertEqual(list(window.latest(5)), [2.0, 3.0, 4.0])
+            window.extend([5.0, 6.0])
+            self.assertEqual(list(window.latest(5)), [2.0, 3.0, 4.0, 5.0, 6.0])
+            self.assertEqual(window.count, 7)
+
+        def test_Restore(self):
+            window = Window(2)
+            window.restore([3.0, 4.0], 10)
+            window.restore([4.0], 10)
+            self.assertEqual(list(window.latest(2)), [3.0, 4.0])
+            window.restore([1.0, 2.0, 3.0, 4.0], 10)
+            self.assertEqual(list(window.latest(4)), [1.0, 2.0, 3.0, 4.0])
+            self.assertEqual(window.get(6), 1.0)
+
+        def test_RollingExtreme(self):
+            values = numpy.random.RandomState(3).normal(size=200)
+            window = Window(10)
+            largest = RollingExtreme(10)
+            smallest = RollingExtreme(10, largest=False)
+            for i, x in enumerate(values):
+                window.append(x)
+                largest.push(window)
+                smallest.push(window)
+                self.assertEqual(largest.value(window), values[max(0, i-9):i+1].max())
+                self.assertEqual(smallest.value(window), values[max(0, i-9):i+1].min())
+            largest.rebuild(window, 10)
+            self.assertEqual(largest.value(window), values[-10:].max())
+
+    unittest.main()
@@ -31,6 +31,7 @@ import new
 import traceback
 import pprint
 import os
+import ast
 
 class Commando(cmd.Cmd):
 
@@ -277,6 +278,69 @@ class command(object):
 	# to be able to call the functions without the prompt logic
         return f
 
+# LAZY REGISTRATION
+def scan(filename):
+    """Finds the functions decorated with @command in a python source file
+    without importing it.  Returns a list of (name, argnames, docstring).
+
+    >>> scan(__file__)
+    []
+    """
+    tree = ast.parse(open(filename).read(), filename)
+    commands = []
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        for decorator in node.decorator_list:
+            if not isinstance(decorator, ast.Call) or len(decorator.args) == 0:
+                continue
+            func = decorator.func
+            if getattr(func, "id", getattr(func, "attr", None)) != "command":
+                continue
+            if not isinstance(decorator.args[0], ast.Str):
+                continue
+            argnames = [arg.id for arg in node.args.args if isinstance(arg, ast.Name)]
+            commands.append((decorator.args[0].s, argnames, ast.get_docstring(node, clean=False)))
+    return commands
+
+def lazy(module, name, argnames, doc):
+    """Registers a command that imports the module implementing it the
+    first time it is run.  Importing the module replaces the placeholder
+    with the real command, which is then run with the same arguments.  A
+    module that fails to import is reported like a failed command.
+
+    >>> lazy("no_such_module", "broken", [], "")
+    >>> commando = Commando()
+    >>> Commando.ISATTY = True
+    >>> commando.do_broken("")
+    >>> del Commando.do_broken
+    """
+    f_name = "do_" + name
+    if hasattr(Commando, f_name):
+        return
+
+    def lazy_f(commando, argstr):
+        try:
+            __import__(module)
+        except Exception, e:
+            traceback.print_exc()
+            if not Commando.ISATTY: 
+                raise SystemExit
+            return
+        f = getattr(Commando, f_name)
+        if f.im_func is lazy_f:
+            print "*** %s does not define %s" % (module, name)
+            return
+        return f(commando, argstr)
+
+    lazy_f.__doc__ = "\nUsage: %s %s\n\n %s" % (name, " ".join(argnames), doc)
+    setattr(Commando, f_name, new.instancemethod(lazy_f, None, Commando))
+
+def register(filename, module):
+    """Registers every command found in a source file with L{lazy}"""
+    for name, argnames, doc in scan(filename):
+        lazy(module, name, argnames, doc)
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -20,146 +20,168 @@ import os
 import tables
 import datetime
 import math
+import numpy
+import multiprocessing
 from utils.progress_bar import ProgressBar
 from pycommando.commando import command
 
-def calculate_performance(inputfname="~/.quant/simulation.h5"):
+# Sessions per year used to annualize the daily risk metrics
+TRADING_DAYS = 252
+
+# Paths report_montecarlo resamples at once, each array it works on is
+# about MONTECARLO_CHUNK * sessions * 8 bytes
+MONTECARLO_CHUNK = 500
+
+# The percentiles report_montecarlo reports
+MONTECARLO_PERCENTILES = (5, 25, 50, 75, 95)
+
+def _longest_run(mask):
+    """The length of the longest run of True in a boolean array"""
+    if not mask.any():
+        return 0
+    edges = numpy.diff(numpy.concatenate(([0], mask.astype(numpy.int8), [0])))
+    return int((numpy.flatnonzero(edges == -1) - numpy.flatnonzero(edges == 1)).max())
+
+def equity_performance(dates, equity):
+    """The performance of an equity curve, given the date ordinals of its
+    sessions and the equity at each of them"""
     report = {}
+    dates = numpy.asarray(dates)
+    equity = numpy.asarray(equity)
+    starting_date = datetime.datetime.fromordinal(dates[0])
+    starting_value = equity[0]
+    ending_date = datetime.datetime.fromordinal(dates[-1])
+    ending_value = equity[-1]
 
-    inputFile = tables.openFile(os.path.expanduser(inputfname), "r")
+    # Analysis
+    #
+    # A drawdown runs from a highwater mark to the next session that
+    # reaches it again, or to the end of the simulation.  Its amount is
+    # measured from the highwater to the lowest equity before that
+    # session.
+    max_draw_down_duration = {'days': 0, 'start': None, 'end': None}
+    max_draw_down_amount = {'amount': 0.0, 'high': None, 'low': None}
+    # A curve with missing values, NaN, compares as neither above nor
+    # below its highwater
+    old = numpy.seterr(invalid="ignore")
     try:
-        tbl = inputFile.getNode("/Performance", classname="Table")
-
-        equity_curve = zip([datetime.datetime.fromordinal(int(x)) for x in tbl.col("date")], tbl.col("value"))
-        starting_date, starting_value = equity_curve[0]
-        ending_date, ending_value = equity_curve[-1] 
-
-        # Analysis
-        max_draw_down_duration = {'days': 0, 'start': None, 'end': None}
-        max_draw_down_amount = {'amount': 0.0, 'high': None, 'low': None}
-        daily_returns = [10000.0]
-        #benchmark_returns = [10000.0]
-        #excess_returns = []
-
-        last = equity_curve[0]
-        highwater = equity_curve[0] # The highwater date and equity
-        lowwater = equity_curve[0] # The highwater date and equity
-        for date, equity in equity_curve[1:]:
-            # If we have passed the highwater or we are at the end of the simulation
-            if equity >= highwater[1] or date == equity_curve[-1][0]:
-                drawdown_dur = (date - highwater[0]).days
-                drawdown_amt = highwater[1] - lowwater[1] 
-                if drawdown_dur > max_draw_down_duration['days']:
-                    max_draw_down_duration['days'] = drawdown_dur
-                    max_draw_down_duration['start'] = highwater
-                    max_draw_down_duration['end'] = (date, equity)
-                if drawdown_amt > max_draw_down_amount['amount']:
-                    max_draw_down_amount['amount'] = drawdown_amt
-                    max_draw_down_amount['high'] = highwater
-                    max_draw_down_amount['low'] = lowwater
-                highwater = (date, equity)
-                lowwater = (date, equity)
-
-            if equity <= lowwater[1]:
-                lowwater = (date, equity)
-
-            daily_return = (equity - last[1]) / last[1]
-            daily_returns.append((daily_return * daily_returns[-1]) + daily_returns[-1])
-
-            last = (date, equity)
-
-        total_days = (ending_date - starting_date).days
-        total_years = float(total_days) / 365.0
-        equity_return = ending_value - starting_value
-        equity_percent = 100.0 * (equity_return / starting_value)
-        cagr = 100.0 * (math.pow((ending_value / starting_value), (1 / total_years)) - 1)
-        drawdown_percent = 0.0
-        if max_draw_down_amount['high'] != None:
-            drawdown_percent = 100.0 * (max_draw_down_amount['amount'] / max_draw_down_amount['high'][1])
+        if len(equity) > 1:
+            highwater = numpy.maximum.accumulate(equity)
+            ends = numpy.flatnonzero(equity[1:] >= highwater[:-1]) + 1
+            if len(ends) == 0 or ends[-1] != len(equity) - 1:
+                ends = numpy.append(ends, len(equity) - 1)
+            starts = numpy.concatenate(([0], ends[:-1]))
+
+            durations = dates[ends] - dates[starts]
+            k = durations.argmax()
+            if durations[k] > 0:
+                max_draw_down_duration['days'] = int(durations[k])
+                max_draw_down_duration['start'] = (datetime.datetime.fromordinal(dates[starts[k]]), equity[starts[k]])
+                max_draw_down_duration['end'] = (datetime.datetime.fromordinal(dates[ends[k]]), equity[ends[k]])
+
+            amounts = equity[starts] - numpy.minimum.reduceat(equity[:-1], starts)
+            k = amounts.argmax()
+            if amounts[k] > 0.0:
+                segment = equity[starts[k]:ends[k]]
+                low = starts[k] + len(segment) - 1 - segment[::-1].argmin()
+                max_draw_down_amount['amount'] = amounts[k]
+                max_draw_down_amount['high'] = (datetime.datetime.fromordinal(dates[starts[k]]), equity[starts[k]])
+                max_draw_down_amount['low'] = (datetime.datetime.fromordinal(dates[low]), equity[low])
+
+            underwater = equity < highwater
+            returns = numpy.diff(equity.astype(float)) / equity[:-1]
+        else:
+            underwater = numpy.zeros(len(equity), dtype=bool)
+            returns = numpy.zeros(0)
+    finally:
+        numpy.seterr(**old)
+
+    total_days = (ending_date - starting_date).days
+    total_years = float(total_days) / 365.0
+    equity_return = ending_value - starting_value
+    equity_percent = 100.0 * (equity_return / starting_value)
+    cagr = 100.0 * (math.pow((ending_value / starting_value), (1 / total_years)) - 1)
+    drawdown_percent = 0.0
+    if max_draw_down_amount['high'] != None:
+        drawdown_percent = 100.0 * (max_draw_down_amount['amount'] / max_draw_down_amount['high'][1])
+
+    # Risk metrics on the daily returns, annualized and without a risk
+    # free rate
+    volatility = 0.0
+    sharpe = 0.0
+    sortino = 0.0
+    if len(returns) > 1:
+        volatility = returns.std(ddof=1) * math.sqrt(TRADING_DAYS)
+        if volatility > 0:
+            sharpe = returns.mean() * TRADING_DAYS / volatility
+        downside = math.sqrt((numpy.minimum(returns, 0.0) ** 2).mean()) * math.sqrt(TRADING_DAYS)
+        if downside > 0:
+            sortino = returns.mean() * TRADING_DAYS / downside
+    calmar = 0.0
+    if drawdown_percent > 0:
+        calmar = cagr / drawdown_percent
       
-        report['period'] = total_days
-        report['starting_date'] = starting_date
-        report['starting_value'] = starting_value
-        report['ending_date'] = ending_date
-        report['ending_value'] = ending_value
-        report['ending_value'] = ending_value
-        report['equity_return'] = equity_return
-        report['equity_percent'] = equity_percent 
-        report['cagr'] = cagr
-        report['drawdown_dur'] = max_draw_down_duration['days']
-        report['drawdown_amt'] = max_draw_down_amount['amount']
-        report['drawdown_per'] = drawdown_percent
-        report['initial_pos'] = (starting_date, starting_value)
-        report['final_pos'] = (ending_date, ending_value)
-
-        report['orders'] = []
+    report['period'] = total_days
+    report['starting_date'] = starting_date
+    report['starting_value'] = starting_value
+    report['ending_date'] = ending_date
+    report['ending_value'] = ending_value
+    report['ending_value'] = ending_value
+    report['equity_return'] = equity_return
+    report['equity_percent'] = equity_percent 
+    report['cagr'] = cagr
+    report['drawdown_dur'] = max_draw_down_duration['days']
+    report['drawdown_amt'] = max_draw_down_amount['amount']
+    report['drawdown_per'] = drawdown_percent
+    report['initial_pos'] = (starting_date, starting_value)
+    report['final_pos'] = (ending_date, ending_value)
+    report['volatility'] = 100.0 * volatility
+    report['sharpe'] = sharpe
+    report['sortino'] = sortino
+    report['calmar'] = calmar
+    report['underwater_dur'] = _longest_run(underwater)
+    report['underwater_per'] = 100.0 * underwater.mean()
+    return report
+
+def calculate_performance(inputfname="~/.quant/simulation.h5", where="/"):
+    """The performance of the simulation in the group where of an output,
+    the root unless it holds many, see simulate_batch"""
+    inputFile = tables.openFile(os.path.expanduser(inputfname), "r")
+    try:
+        tbl = inputFile.getNode(where, "Performance", classname="Table")
+        report = equity_performance(tbl.col("date").astype(int), tbl.col("value"))
+
         # Calculate cost-basis/and profit on trades using single-category method
-        tbl = inputFile.getNode("/Orders", classname="Table")
-        winning = 0
-        losing = 0
-        largest_winning = (0, "")
-        largest_losing = (0, "")
-        conseq_win = 0
-        conseq_lose = 0
-        largest_conseq_win = 0
-        largest_conseq_lose = 0
-        total_profit = 0
-        total_win = 0
-        total_lose = 0
-        total_trades = 0
-        for order in tbl.iterrows():
-            o = (datetime.datetime.fromordinal(order['date']).date(), order['executed_quantity'], order['executed_price'], order['basis'], order['order'])
-            report['orders'].append(o)
-            if order['order_type'] == "SELL":
-                total_trades += 1
-                profit = (order['executed_price'] - order['basis']) * order['executed_quantity']
-                total_profit += profit
-                if profit > 0:
-                    winning += 1
-                    conseq_win += 1
-                    total_win += profit
-                    if conseq_lose > largest_conseq_lose:
-                        largest_conseq_lose = conseq_lose
-                    conseq_lose = 0
-                elif profit < 0:
-                    losing += 1
-                    conseq_lose += 1
-                    total_lose += profit
-                    if conseq_win > largest_conseq_win:
-                        largest_conseq_win = conseq_win
-                    conseq_win = 0
-
-                if profit > largest_winning[0]:
-                    largest_winning = (profit, order['date_str'])
-                if profit < largest_losing[0]:
-                    largest_losing = (profit, order['date_str'])
-
-        if winning == 0:
-            avg_winning = 0
-        else:
-            avg_winning = total_win / winning
-        if losing == 0:
-            avg_losing = 0
-        else:
-            avg_losing = total_lose / losing
-        if conseq_win > largest_conseq_win:
-            largest_conseq_win = conseq_win
-        if conseq_lose > largest_conseq_lose:
-            largest_conseq_lose = conseq_lose
+        orders = inputFile.getNode(where, "Orders", classname="Table").read()
+        report['orders'] = [(datetime.datetime.fromordinal(o['date']).date(), o['executed_quantity'], o['executed_price'], o['basis'], o['order']) for o in orders]
+
+        sells = orders[orders['order_type'] == "SELL"]
+        profits = (sells['executed_price'] - sells['basis']) * sells['executed_quantity']
+        wins = profits[profits > 0]
+        losses = profits[profits < 0]
+        # Trades that break even do not end a run of winners or losers
+        outcomes = profits[profits != 0] > 0
 
+        total_trades = len(sells)
         report['total_trades'] = total_trades
-        report['winning_trades'] = winning
-        report['losing_trades'] = losing
+        report['winning_trades'] = len(wins)
+        report['losing_trades'] = len(losses)
         if total_trades > 0:
-            report['avg_trade'] = total_profit / total_trades
+            report['avg_trade'] = profits.sum() / total_trades
         else:
             report['avg_trade'] = 0
-        report['avg_winning_trade'] = avg_winning
-        report['avg_losing_trade'] = avg_losing
-        report['conseq_win'] = largest_conseq_win
-        report['conseq_lose'] = largest_conseq_lose
-        report['largest_win'] = largest_winning
-        report['largest_lose'] = largest_losing
+        report['avg_winning_trade'] = len(wins) and wins.mean() or 0
+        report['avg_losing_trade'] = len(losses) and losses.mean() or 0
+        report['conseq_win'] = _longest_run(outcomes)
+        report['conseq_lose'] = _longest_run(~outcomes)
+        report['largest_win'] = (0, "")
+        report['largest_lose'] = (0, "")
+        if len(wins) > 0:
+            k = profits.argmax()
+            report['largest_win'] = (profits[k], sells['date_str'][k])
+        if len(losses) > 0:
+            k = profits.argmin()
+            report['largest_lose'] = (profits[k], sells['date_str'][k])
 
     finally:
         inputFile.close()
@@ -167,10 +189,12 @@ def calculate_performance(inputfname="~/.quant/simulation.h5"):
     return report
 
 @command("report_performance")
-def report_performance(inputfname="~/.quant/simulation.h5"):
-    report = calculate_performance(inputfname)
+def report_performance(inputfname="~/.quant/simulation.h5", where="/"):
+    report = calculate_performance(inputfname, where)
     print
     print "######################################################################################"
+    if where != "/":
+        inputfname = "%s:%s" % (inputfname, where)
     print " Report:", inputfname
     print
     print "Simulation Period: %(period)s days" % report
@@ -180,6 +204,11 @@ def report_performance(inputfname="~/.quant/simulation.h5"):
     print "CAGR: %(cagr)3.2f%%" % report
     print "Maximum Drawdown Duration: %(drawdown_dur)d days" % report
     print "Maxium Drawdown Amount: $%(drawdown_amt)0.2f (%(drawdown_per)3.2f%%)" % report
+    print "Longest Time Underwater: %(underwater_dur)d sessions (%(underwater_per)3.2f%% underwater)" % report
+    print "Annualized Volatility: %(volatility)3.2f%%" % report
+    print "Sharpe Ratio: %(sharpe)0.2f" % report
+    print "Sortino Ratio: %(sortino)0.2f" % report
+    print "Calmar Ratio: %(calmar)0.2f" % report
     print "Inital Position:", report['starting_date'], report['starting_value']
     print "Final Position:", report['ending_date'], report['ending_value']
     print
@@ -207,6 +236,130 @@ def report_performance(inputfname="~/.quant/simulation.h5"):
     print "######################################################################################"
     print
 
+def _montecarlo_chunk(args):
+    """Resamples paths of the changes of an equity curve in blocks of
+    block consecutive ones and returns the ending value, CAGR and largest
+    drawdown of each path"""
+    changes, compound, length, block, paths, seed, starting_value, years = args
+    rng = numpy.random.RandomState(seed)
+    block = min(block, len(changes))
+    blocks = (length + block - 1) // block
+
+    # A (paths x length) matrix of offsets into the changes, made of runs
+    # of block consecutive offsets from random starts
+    starts = rng.randint(0, len(changes) - block + 1, size=(paths, blocks))
+    offsets = (starts[:,:,numpy.newaxis] + numpy.arange(block)).reshape(paths, blocks * block)[:,:length]
+    if compound:
+        equity = starting_value * numpy.cumprod(1.0 + changes[offsets], axis=1)
+    else:
+        equity = starting_value + numpy.cumsum(changes[offsets], axis=1)
+    del offsets
+
+    ending = equity[:,-1]
+    highwater = numpy.maximum.accumulate(numpy.maximum(equity, starting_value), axis=1)
+    old = numpy.seterr(divide="ignore", invalid="ignore")
+    try:
+        drawdown = 100.0 * ((highwater - equity) / highwater).max(axis=1)
+        cagr = 100.0 * (numpy.power(numpy.maximum(ending, 0.0) / starting_value, 1.0 / years) - 1.0)
+    finally:
+        numpy.seterr(**old)
+    return ending, cagr, drawdown
+
+def calculate_montecarlo(inputfname="~/.quant/simulation.h5", paths=10000, block=20, method="returns", seed=0, processes=1, where="/"):
+    """Block bootstrap of the equity curve of a simulation.
+
+    With a method of 'returns' the daily returns of /Performance are
+    resampled, in blocks of block consecutive sessions so that runs of
+    good and bad days are kept, into paths as long as the simulation and
+    compounded from its starting value.  With 'trades' the profits of the
+    trades in /Orders are resampled in blocks of block consecutive trades
+    and added up instead.
+
+    The paths are built as a (paths x length) matrix, MONTECARLO_CHUNK
+    paths at a time, on processes processes (0 for one per core).  Each
+    chunk draws from a generator seeded with both seed and its number, so
+    runs with different seeds share none of their paths.
+    Returns the ending value, CAGR and largest drawdown in percent of
+    every path, and the percentiles of each.  where is the group of the
+    simulation, as for calculate_performance.
+    """
+    report = calculate_performance(inputfname, where)
+    years = report['period'] / 365.0
+    if method == "returns":
+        inputFile = tables.openFile(os.path.expanduser(inputfname), "r")
+        try:
+            equity = inputFile.getNode(where, "Performance", classname="Table").col("value").astype(float)
+        finally:
+            inputFile.close()
+        old = numpy.seterr(divide="ignore", invalid="ignore")
+        try:
+            changes = numpy.diff(equity) / equity[:-1]
+        finally:
+            numpy.seterr(**old)
+        changes[(changes != changes) | numpy.isinf(changes)] = 0.0
+        compound = True
+    elif method == "trades":
+        orders = report['orders']
+        sells = [(price - basis) * qty for date, qty, price, basis, order in orders if order.startswith("SELL")]
+        changes = numpy.array(sells, dtype=float)
+        compound = False
+    else:
+        raise StandardError, "Unknown method %s, use returns or trades" % method
+    if len(changes) == 0 or years <= 0:
+        raise StandardError, "%s has no %s to resample" % (inputfname, method)
+
+    paths = int(paths)
+    chunks = [(changes, compound, len(changes), int(block), min(MONTECARLO_CHUNK, paths - start),
+               [int(seed), k], float(report['starting_value']), years)
+              for k, start in enumerate(xrange(0, paths, MONTECARLO_CHUNK))]
+    if int(processes) == 1 or len(chunks) == 1:
+        results = map(_montecarlo_chunk, chunks)
+    else:
+        pool = multiprocessing.Pool(int(processes) or None)
+        try:
+            results = pool.map(_montecarlo_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    montecarlo = {'paths': paths, 'method': method, 'block': int(block), 'performance': report}
+    for i, name in enumerate(("ending_value", "cagr", "drawdown_per")):
+        values = numpy.concatenate([result[i] for result in results])
+        montecarlo[name] = values
+        montecarlo[name + "_percentiles"] = numpy.percentile(values, MONTECARLO_PERCENTILES)
+    return montecarlo
+
+def _column(value):
+    # A value of report_montecarlo, 13 characters wide
+    text = "%.2f" % value
+    if len(text) > 12:
+        text = "%.6g" % value
+    return "%13s" % text
+
+@command("report_montecarlo")
+def report_montecarlo(inputfname="~/.quant/simulation.h5", paths=10000, block=20, method="returns", seed=0, processes=0, where="/"):
+    """Prints the percentiles of the ending value, CAGR and drawdown of
+    paths resampled from a simulation, see calculate_montecarlo"""
+    montecarlo = calculate_montecarlo(inputfname, paths, block, method, seed, processes, where)
+    report = montecarlo['performance']
+    print
+    print "######################################################################################"
+    if where != "/":
+        inputfname = "%s:%s" % (inputfname, where)
+    print " Monte Carlo:", inputfname
+    print
+    print "%(paths)d paths resampling %(method)s in blocks of %(block)d" % montecarlo
+    print
+    # Values that do not fit the columns, such as a CAGR of a path that
+    # loses everything, are shown in exponent form and stay separated
+    print "%-16s %13s" % ("", "Simulated") + "".join(["%13s" % ("%d%%" % p) for p in MONTECARLO_PERCENTILES])
+    for label, name, actual in (("Ending Value", "ending_value", report['ending_value']),
+                                ("CAGR %", "cagr", report['cagr']),
+                                ("Drawdown %", "drawdown_per", report['drawdown_per'])):
+        print "%-16s %s" % (label, _column(actual)) + "".join([_column(v) for v in montecarlo[name + "_percentiles"]])
+    print "######################################################################################"
+    print
+
 @command("list_orders")
 def list_orders(input_="~/.quant/simulation.h5", node="/Orders"):
     try:
@@ -216,3 +369,152 @@ def list_orders(input_="~/.quant/simulation.h5", node="/Orders"):
             print d
     finally:
         inputFile.close()
+
+if __name__ == "__main__":
+    import unittest
+    import tempfile
+    import datetime
+    from utils.model import openOutputFile, openBatchOutputFile
+
+    class MonteCarloTest(unittest.TestCase):
+
+        def setUp(self):
+            fd, self.path = tempfile.mkstemp(suffix=".h5")
+            os.close(fd)
+
+        def tearDown(self):
+            os.remove(self.path)
+
+        def write(self, equity):
+            outputFile = openOutputFile(self.path)
+            try:
+                tbl = outputFile.getNode("/Performance")
+                day = datetime.date(2010, 1, 4)
+                for i, value in enumerate(equity):
+                    d = day + datetime.timedelta(i)
+                    tbl.row['date'] = d.toordinal()
+                    tbl.row['date_str'] = str(d)
+                    tbl.row['value'] = value
+                    tbl.row.append()
+            finally:
+                outputFile.close()
+
+        def test_Chunk(self):
+            changes = numpy.array([0.01, -0.02, 0.03, 0.0])
+            ending, cagr, drawdown = _montecarlo_chunk((changes, True, 7, 2, 5, [0, 0], 100.0, 1.0))
+            self.assertEqual(ending.shape, (5,))
+            self.assertEqual(cagr.shape, (5,))
+            self.assertEqual(drawdown.shape, (5,))
+
+        def test_Seeded(self):
+            rng = numpy.random.RandomState(1)
+            self.write(1000.0 * numpy.cumprod(1.0 + rng.normal(0.0, 0.01, size=300)))
+            first = calculate_montecarlo(self.path, paths=1200, block=5, seed=3)
+            again = calculate_montecarlo(self.path, paths=1200, block=5, seed=3)
+            other = calculate_montecarlo(self.path, paths=1200, block=5, seed=4)
+            self.assertEqual(len(first['ending_value']), 1200)
+            self.assertEqual(list(first['ending_value']), list(again['ending_value']))
+            # Neighbouring seeds share none of their chunks
+            for a in xrange(0, 1200, MONTECARLO_CHUNK):
+                for b in xrange(0, 1200, MONTECARLO_CHUNK):
+                    self.assertNotEqual(list(first['ending_value'][a:a+MONTECARLO_CHUNK][:100]),
+                                        list(other['ending_value'][b:b+MONTECARLO_CHUNK][:100]))
+
+        def test_Group(self):
+            outputFile = openBatchOutputFile(self.path, ["flat", "grow"])
+            try:
+                for where, equity in (("/flat", [1000.0] * 50), ("/grow", 1000.0 * 1.01 ** numpy.arange(50))):
+                    tbl = outputFile.getNode(where, "Performance")
+                    day = datetime.date(2010, 1, 4)
+                    for i, value in enumerate(equity):
+                        d = day + datetime.timedelta(i)
+                        tbl.row['date'] = d.toordinal()
+                        tbl.row['date_str'] = str(d)
+                        tbl.row['value'] = value
+                        tbl.row.append()
+            finally:
+                outputFile.close()
+            flat = calculate_montecarlo(self.path, paths=10, block=5, where="/flat")
+            grow = calculate_montecarlo(self.path, paths=10, block=5, where="/grow")
+            self.assertTrue(numpy.allclose(flat['ending_value'], 1000.0))
+            self.assertTrue(numpy.allclose(grow['ending_value'], 1000.0 * 1.01 ** 49, rtol=1e-4))
+
+        def test_Column(self):
+            self.assertEqual(_column(54844.5), "     54844.50")
+            self.assertEqual(len(_column(-44387968.53)), 13)
+            self.assertEqual(_column(-44387968.53), " -44387968.53")
+            self.assertEqual(_column(-123456789012.5).strip(), "-1.23457e+11")
+            self.assertEqual(len(_column(-123456789012.5).split()), 1)
+
+        def test_Constant(self):
+            self.write(1000.0 * 1.001 ** numpy.arange(100))
+            montecarlo = calculate_montecarlo(self.path, paths=50, block=10, seed=0)
+            self.assertTrue((montecarlo['drawdown_per'] == 0.0).all())
+            self.assertTrue(numpy.allclose(montecarlo['ending_value'], montecarlo['ending_value'][0], rtol=1e-4))
+
+    class PerformanceTest(unittest.TestCase):
+
+        def setUp(self):
+            fd, self.path = tempfile.mkstemp(suffix=".h5")
+            os.close(fd)
+            outputFile = openOutputFile(self.path)
+            try:
+                day = datetime.date(2010, 1, 4)
+                tbl = outputFile.getNode("/Performance")
+                for i, value in enumerate([1000.0, 1100.0, 1050.0, 990.0, 1150.0, 1120.0]):
+                    d = day + datetime.timedelta(i)
+                    tbl.row['date'] = d.toordinal()
+                    tbl.row['date_str'] = str(d)
+                    tbl.row['value'] = value
+                    tbl.row.append()
+                tbl = outputFile.getNode("/Orders")
+                for i, (order_type, qty, price) in enumerate([("BUY", 10, 10.0), ("SELL", 10, 12.5), ("SELL", 4, 8.0),
+                                                               ("SELL", 2, 15.0), ("SELL", 5, 10.0), ("SELL", 1, 11.0)]):
+                    d = day + datetime.timedelta(i)
+                    tbl.row['date'] = d.toordinal()
+                    tbl.row['date_str'] = str(d)
+                    tbl.row['order_type'] = order_type
+                    tbl.row['symbol'] = "spy"
+                    tbl.row['order'] = "%s %d spy at MARKET_PRICE" % (order_type, qty)
+                    tbl.row['executed_quantity'] = qty
+                    tbl.row['executed_price'] = price
+                    tbl.row['basis'] = order_type == "SELL" and 10.0 or 0.0
+                    tbl.row.append()
+            finally:
+                outputFile.close()
+
+        def tearDown(self):
+            os.remove(self.path)
+
+        def test_Equity(self):
+            report = calculate_performance(self.path)
+            self.assertEqual(report['period'], 5)
+            self.assertEqual(report['starting_value'], 1000.0)
+            self.assertEqual(report['ending_value'], 1120.0)
+            # The equity is stored as Float32
+            self.assertAlmostEqual(report['equity_percent'], 12.0, 4)
+            self.assertAlmostEqual(report['cagr'] / (100.0 * (1.12 ** (365.0 / 5) - 1)), 1.0, 4)
+            # From the high of 1100 on the 5th to the low of 990 on the
+            # 7th, recovered on the 8th
+            self.assertEqual(report['drawdown_amt'], 110.0)
+            self.assertAlmostEqual(report['drawdown_per'], 10.0, 4)
+            self.assertEqual(report['drawdown_dur'], 3)
+            self.assertEqual(report['underwater_dur'], 2)
+            self.assertAlmostEqual(report['underwater_per'], 50.0)
+
+        def test_Trades(self):
+            # Profits of 25, -8, 10, 0 and 1, the break even trade does
+            # not end the run of winners around it
+            report = calculate_performance(self.path)
+            self.assertEqual(report['total_trades'], 5)
+            self.assertEqual(report['winning_trades'], 3)
+            self.assertEqual(report['losing_trades'], 1)
+            self.assertAlmostEqual(report['avg_trade'], 28.0 / 5)
+            self.assertAlmostEqual(report['avg_winning_trade'], 12.0)
+            self.assertAlmostEqual(report['avg_losing_trade'], -8.0)
+            self.assertEqual(report['conseq_win'], 2)
+            self.assertEqual(report['conseq_lose'], 1)
+            self.assertEqual(report['largest_win'], (25.0, "2010-01-05"))
+            self.assertEqual(report['largest_lose'], (-8.0, "2010-01-06"))
+
+    unittest.main()
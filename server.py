@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import os
+import sys
+import socket
+import SocketServer
+import traceback
+from pycommando.commando import command, Commando
+
+SOCKET = "~/.quant/quant.sock"
+
+# Separates a command's output from its exit status in the reply
+END = "\0"
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """Runs one command line per connection, sending back everything it
+    prints followed by END and the exit status"""
+    def handle(self):
+        line = self.rfile.readline().strip()
+        if line.split(" ")[0] in ("quit", "exit"):
+            self.server.done = True
+            self.wfile.write("%s0\n" % END)
+            return
+
+        # The data may have changed, through a db_up run by another
+        # process for example, since the last command
+        from config import CONFIG
+        from utils.YahooQuote import refreshCaches
+        CONFIG.load()
+        refreshCaches()
+
+        status = 0
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = self.wfile
+        try:
+            try:
+                commando = Commando(stdin=self.rfile, stdout=self.wfile)
+                commando.onecmd(line)
+            except SystemExit:
+                # Commands exit when they fail while not on a terminal
+                status = 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        self.wfile.write("%s%d\n" % (END, status))
+
+class _Server(SocketServer.UnixStreamServer):
+    def __init__(self, path):
+        # The socket is created accessible to the user only, other users
+        # must not be able to connect even before it is listening
+        umask = os.umask(0077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(umask)
+        self.done = False
+
+@command("serve")
+def serve(path=SOCKET):
+    """Keeps Quant running, with its market data and calendar loaded,
+    and runs the commands sent by 'quant --remote' over a unix socket.
+    Commands are run one at a time in the order they arrive.  Send
+    'quit' to stop the server."""
+    path = os.path.expanduser(path)
+    if os.path.exists(path):
+        try:
+            call("", path)
+        except socket.error:
+            os.remove(path) # Left behind by a server that did not exit
+        else:
+            raise StandardError, "A server is already listening on %s" % path
+
+    server = _Server(path)
+    print "Serving on", path
+    try:
+        while not server.done:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def call(line, path=SOCKET, out=sys.stdout):
+    """Runs a command line on the server, copying its output to out,
+    and returns the command's exit status"""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.connect(os.path.expanduser(path))
+    try:
+        s.sendall(line.strip() + "\n")
+        reply = ""
+        while True:
+            data = s.recv(4096)
+            if not data:
+                raise socket.error, "Connection closed by server"
+            if END in data:
+                head, reply = data.split(END, 1)
+                out.write(head)
+                break
+            out.write(data)
+            out.flush()
+        while not reply.endswith("\n"):
+            data = s.recv(64)
+            if not data:
+                break
+            reply += data
+        return int(reply.strip() or 1)
+    finally:
+        s.close()
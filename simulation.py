@@ -25,20 +25,27 @@ import sys
 import tables
 import math
 import yaml
+import itertools
+import multiprocessing
+import report
 from config import CONFIG
 from yahoo import Market
 from utils.progress_bar import ProgressBar
 from utils.model import *
 from utils.market import *
-from utils.date import ONE_DAY
+from utils.date import ONE_DAY, ordinalToYmd
+from utils.backtest import Backtest, BatchBacktest, COMMISSION
+from utils.h5writer import H5Writer, FLUSH_ROWS
+from utils.panel import Panel
+from utils.snapshot import Snapshots
 from pycommando.commando import command
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
-import matplotlib.ticker as ticker
-import matplotlib.dates as dates
 
 MARKET = Market()
 
+# A Panel that simulate_vector reads prices from, when it covers them,
+# instead of the cache
+PANEL = None
+
 def initialize_position(portfolio, date):
     p = CONFIG['portfolios'][portfolio]
 
@@ -47,7 +54,7 @@ def initialize_position(portfolio, date):
 
     # Turn the initial cash value into shares based off the portfolio percentage
     position = {'$': 0.0}
-    market = Market()
+    market = MARKET
     for instrument, amt in p.items():
         instrument = instrument.strip()
         if type(amt) == str:
@@ -80,42 +87,52 @@ def initialize_position(portfolio, date):
                     amt = float(amt[1:])
                     amt = math.floor(amt / price)
                 position[instrument] = Position(float(amt), price)
-    return position
-
-def write_position(table, position, date):
-    for instrument, p in position.items():
-        table.row['date'] = date.date().toordinal()
-        table.row['date_str'] = str(date.date())
-        table.row['symbol'] = instrument 
-        if instrument == '$':
-            table.row['amount'] = 0
-            table.row['value'] = p
-        else:
-            table.row['amount'] = p.amount
-            table.row['basis'] = p.basis
-            price = MARKET[instrument][date].adjclose
-            if price:
-                table.row['value'] = price
-            else:
-                table.row['value'] = 0.0
-        table.row.append()
-
-def write_performance(table, position, date):
-    value = 0.0
-    for instrument, p in position.items():
-        if instrument == '$':
-            value += p
-        else:
-            price = MARKET[instrument][date].adjclose
-            if price:
-                value += (price * p.amount)
-
-    table.row['date'] = date.date().toordinal()
-    table.row['date_str'] = str(date.date())
-    table.row['value'] = value
-    table.row.append()
+    return PositionBook(position)
+
+def write_position(table, position, date, prices):
+    """Appends a row per key of the position, valued at prices, a row of
+    adjusted closes over position.symbols"""
+    rows = numpy.zeros(len(position), dtype=table.dtype)
+    rows['date'] = date.date().toordinal()
+    rows['date_str'] = str(date.date())
+    rows['symbol'] = position.keys()
+    held = position.index >= 0
+    columns = position.index[held]
+    rows['value'][~held] = position['$']
+    rows['amount'][held] = position.amounts[columns]
+    rows['basis'][held] = position.basis[columns]
+    rows['value'][held] = position.prices(prices)[columns]
+    table.append(rows)
+
+def write_performance(table, position, cash, amounts, fills, days, closes):
+    """Appends the value of the position on each of days, the sessions of
+    the rows of closes, computed after the simulation.  The position
+    starts with cash and amounts, over position.symbols, and changes with
+    fills, a list of (session index, cash, executed) where executed are
+    the (symbol, quantity) of the orders that took effect on that session,
+    sells negative, and cash is the cash left after them."""
+    n = len(closes)
+    changes = numpy.zeros((n + 1, len(position.symbols)))
+    starts = [0]
+    balances = [cash]
+    for i, balance, executed in fills:
+        for symbol, qty in executed:
+            changes[i, position.columns[symbol]] += qty
+        starts.append(i)
+        balances.append(balance)
+    holdings = amounts + numpy.cumsum(changes[:n], axis=0)
+    cashes = numpy.array(balances)[numpy.searchsorted(starts, numpy.arange(n), side="right") - 1]
+
+    rows = numpy.zeros(n, dtype=table.dtype)
+    rows['date'] = [d.toordinal() for d in days]
+    rows['date_str'] = [str(d.date()) for d in days]
+    rows['value'] = cashes + (position.prices(closes) * holdings).sum(axis=1)
+    table.append(rows)
 
 def execute_orders(table, position, date, orders):
+    """Executes the orders on date, returning the (symbol, quantity) of
+    the ones executed with the quantities sold negative"""
+    executed = []
     for order in orders:
         logging.debug("Executing order %s", order)
         if position.has_key(order.symbol):
@@ -134,7 +151,7 @@ def execute_orders(table, position, date, orders):
                 else:
                     qty = order.quantity
 
-                if qty > position[order.symbol] or qty < 1:
+                if qty > position[order.symbol].amount or qty < 1:
                     logging.warn("Ignoring invalid order %s.  Invalid quantity", order)
                     continue
              
@@ -150,9 +167,10 @@ def execute_orders(table, position, date, orders):
                 table.row['basis'] = position[order.symbol].basis 
                 table.row.append()
 
-                position[order.symbol].remove(qty, strike_price)
+                position.remove(order.symbol, qty, strike_price)
+                executed.append((order.symbol, -qty))
                 position['$'] += (qty * strike_price)
-                position['$'] -= 9.99 # TODO make trading cost configurable
+                position['$'] -= COMMISSION # TODO make trading cost configurable
 
             elif order.order == Order.BUY:
                 if order.price_type == Order.MARKET_PRICE:
@@ -175,9 +193,11 @@ def execute_orders(table, position, date, orders):
                 table.row['basis'] = 0.0
                 table.row.append()
 
-                position[order.symbol].add(qty, strike_price)
+                position.add(order.symbol, qty, strike_price)
+                executed.append((order.symbol, qty))
                 position['$'] -= (qty * strike_price)
-                position['$'] -= 9.99
+                position['$'] -= COMMISSION
+    return executed
 
 
 def load_strategy(name):
@@ -196,23 +216,180 @@ def load_strategy(name):
 
 
 @command("analyze")
-def analyze(strategy_name, portfolio, strategy_params="{}"):
-    """Using a given strategy and portfolio, make a trading decision"""
+def analyze(strategy_name, portfolio, strategy_params="{}", snapshot=True):
+    """Using a given strategy and portfolio, make a trading decision
+
+    If snapshot is True the indicators start from the snapshot the last
+    analyze of the same strategy, portfolio and parameters saved and are
+    only updated with the sessions since, then saved again.
+    """
     now = datetime.datetime.today()
     position = initialize_position(portfolio, now)
+    symbols = [symbol for symbol in position.keys() if symbol != '$']
 
     # Initialize the strategy
     params = yaml.load(strategy_params)
+    snapshots = Snapshots()
+    state = None
+    if snapshot:
+        state = snapshots.load(portfolio, strategy_name, params, symbols, MARKET)
     strategy_clazz = load_strategy(strategy_name)
-    strategy = strategy_clazz(now, now, position, MARKET, params)
+    strategy = strategy_clazz(now, now, position, MARKET, params, state=state)
     
     orders = strategy.evaluate(now, position, MARKET)
+    if snapshot:
+        snapshots.save(portfolio, strategy_name, params, strategy.getState(), MARKET)
 
     for order in orders:
         print order
 
+def vector_prices(symbols, sessions):
+    """The prices the vector engine trades the symbols on over the
+    sessions.  Returns the sessions followed by the one after the last,
+    when the orders placed on it execute, and (sessions x symbols) arrays
+    of the adjusted closes and of the adjusted opens that the orders
+    placed on each session fill at, NaN where there is no quote."""
+    if len(sessions) == 0:
+        raise StandardError, "No sessions to trade"
+    after = CALENDAR.next(sessions[-1])
+    days = sessions + [after or sessions[-1]]
+    ordinals = numpy.array([d.toordinal() for d in days])
+    dates = ordinalToYmd(ordinals)
+
+    closes = numpy.zeros((len(sessions), len(symbols)))
+    fills = numpy.zeros((len(sessions), len(symbols)))
+    for j, symbol in enumerate(symbols):
+        if PANEL != None and PANEL.covers(symbol, ordinals[0], ordinals[-1]):
+            closes[:,j] = PANEL.column("adjclose", symbol, ordinals[:-1])
+            fills[:,j] = PANEL.column("adjopen", symbol, ordinals[1:])
+            continue
+        MARKET[symbol].ensure(dates[0], dates[-1])
+        history = MARKET.cache.load(MARKET[symbol].symbol)
+        closes[:,j] = history.column("adjclose", dates[:-1])
+        fills[:,j] = history.column("adjopen", dates[1:])
+    if after == None:
+        fills[-1] = numpy.nan
+    return days, closes, fills
+
+def write_backtest(outputFile, instruments, backtest, days, closes, where="/"):
+    """Appends the rows of a run of utils.backtest.Backtest over the
+    sessions of days, which ends with the session after them, to the
+    Orders, Position and Performance tables in the group where of an
+    output file.  instruments are the keys of the position, '$'
+    included."""
+    order_tbl = outputFile.getNode(where, "Orders")
+    postion_tbl = outputFile.getNode(where, "Position")
+    performance_tbl = outputFile.getNode(where, "Performance")
+    symbols = backtest.symbols
+    n = len(closes)
+    ordinals = numpy.array([d.toordinal() for d in days])
+    date_strs = numpy.array([str(d.date()) for d in days])
+
+    # Rows are written in the same order as the event loop writes them
+    rows = numpy.zeros(n * len(instruments), dtype=postion_tbl.dtype)
+    rows = rows.reshape(n, len(instruments))
+    for k, symbol in enumerate(instruments):
+        rows['date'][:,k] = ordinals[:-1]
+        rows['date_str'][:,k] = date_strs[:-1]
+        rows['symbol'][:,k] = symbol
+        if symbol == '$':
+            rows['value'][:,k] = backtest.cash
+        else:
+            j = symbols.index(symbol)
+            rows['amount'][:,k] = backtest.amounts[:,j]
+            rows['basis'][:,k] = backtest.basis[:,j]
+            priced = (closes[:,j] == closes[:,j]) & (closes[:,j] != 0)
+            rows['value'][:,k] = numpy.where(priced, closes[:,j], 0.0)
+    postion_tbl.append(rows.ravel())
+
+    rows = numpy.zeros(n, dtype=performance_tbl.dtype)
+    rows['date'] = ordinals[:-1]
+    rows['date_str'] = date_strs[:-1]
+    rows['value'] = backtest.equity(closes)
+    performance_tbl.append(rows)
+
+    rows = numpy.zeros(len(backtest.orders), dtype=order_tbl.dtype)
+    for k, (i, order, qty, price, basis) in enumerate(backtest.orders):
+        rows['date'][k] = ordinals[i + 1]
+        rows['date_str'][k] = date_strs[i + 1]
+        rows['order_type'][k] = order.order
+        rows['symbol'][k] = order.symbol
+        rows['order'][k] = str(order)
+        rows['executed_quantity'][k] = qty
+        rows['executed_price'][k] = price
+        rows['basis'][k] = basis
+    if len(rows) > 0:
+        order_tbl.append(rows)
+
+def simulate_vector(strategy_name, portfolio, start_date, end_date, output="~/.quant/simulation.h5", strategy_params="{}"):
+    """Simulates a strategy that provides signal arrays through
+    Strategy.signals, see utils.backtest.Backtest for the trading rules.
+    Produces the same /Orders, /Position and /Performance tables as the
+    event driven simulation."""
+    outputFile = openOutputFile(output)
+
+    start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+    now = getPrevTradingDay(start_date)
+
+    try:
+        position = initialize_position(portfolio, now)
+        symbols = [symbol for symbol in position.keys() if symbol != '$']
+
+        params = yaml.load(strategy_params)
+        strategy_clazz = load_strategy(strategy_name)
+        strategy = strategy_clazz(start_date, end_date, position, MARKET, params)
+
+        sessions = CALENDAR.range(now, end_date)
+        if len(sessions) == 0:
+            print "No sessions to simulate from", start_date.date(), "to", end_date.date()
+            return
+
+        days, closes, fills = vector_prices(symbols, sessions)
+
+        print "Starting Simulation"
+        signals = strategy.signals(sessions, symbols, closes)
+
+        backtest = Backtest(symbols, position['$'],
+                            [position[symbol].amount for symbol in symbols],
+                            [position[symbol].basis for symbol in symbols], strategy.SELL_ALL)
+        backtest.run(signals, closes, fills)
+        write_backtest(outputFile, position.keys(), backtest, days, closes)
+
+        outputFile.flush()
+        strategy.finalize()
+    finally:
+        outputFile.close()
+
+def save_state(h5file, strategy_name, portfolio, strategy_params, start_date, date, position, pending, strategy):
+    """Stores what simulate needs to continue the simulation after date
+    as the state attribute of /Strategy"""
+    state = {'strategy': strategy_name,
+             'portfolio': portfolio,
+             'params': yaml.load(strategy_params),
+             'start_date': str(start_date.date()),
+             'date': str(date.date()),
+             'cash': float(position['$']),
+             'position': [[symbol, float(p.amount), float(p.basis)] for symbol, p in position.items() if symbol != '$'],
+             'pending': [[o.order, o.symbol, o.quantity, o.price_type, o.stop, o.limit] for o in pending],
+             'indicators': strategy.getState()}
+    h5file.getNode("/Strategy")._v_attrs.state = yaml.safe_dump(state)
+
+def load_state(h5file, strategy_name, portfolio, strategy_params):
+    """The state save_state stored, checked against the arguments of the
+    simulation that continues it"""
+    try:
+        state = yaml.safe_load(h5file.getNode("/Strategy")._v_attrs.state)
+    except (tables.NoSuchNodeError, AttributeError):
+        raise StandardError, "Output has no simulation state to append to"
+    if state['strategy'] != strategy_name or state['portfolio'] != portfolio:
+        raise StandardError, "Output was simulated with strategy %s and portfolio %s" % (state['strategy'], state['portfolio'])
+    if state['params'] != yaml.load(strategy_params):
+        raise StandardError, "Output was simulated with strategy parameters %s" % state['params']
+    return state
+
 @command("simulate")
-def simulate(strategy_name, portfolio, start_date, end_date, output="~/.quant/simulation.h5", strategy_params="{}"):
+def simulate(strategy_name, portfolio, start_date, end_date, output="~/.quant/simulation.h5", strategy_params="{}", engine="event", flush_rows=FLUSH_ROWS, append=False):
     """A simple simulator that simulates a strategy that only makes
     decisions at closing.  Only BUY and SELL orders are supported.  Orders
     are only good for the next day.
@@ -229,65 +406,504 @@ def simulate(strategy_name, portfolio, start_date, end_date, output="~/.quant/si
 
     A price type of STOP_LIMIT will be executed at the LIMIT price the next day if STOP
     is between the low and high prices of the day.
-    """
 
-    outputFile = openOutputFile(output)
+    An engine of 'vector' runs strategies that provide signal arrays
+    through the array backtest instead of evaluating them day by day.
+
+    Output rows, including the indicators, are buffered and written
+    flush_rows at a time per table, and once more when the simulation ends
+    or fails.
+
+    If append is True and output already exists, the simulation continues
+    from the last session in output up to end_date instead, restoring the
+    position, the orders still pending and the indicators, and appending
+    to the tables.  The strategy, portfolio and parameters must be the
+    ones output was simulated with; start_date is ignored.  Only the
+    event engine can append.
+    """
+    append = str(append).lower() in ("1", "true", "yes")
+    if engine == "vector":
+        # The vector engine writes a new output, it would replace the one
+        # to append to
+        if append:
+            raise StandardError, "append is only supported by the event engine"
+        return simulate_vector(strategy_name, portfolio, start_date, end_date, output, strategy_params)
+
+    resume = append and os.path.exists(os.path.expanduser(output))
+    outputFile = H5Writer(openOutputFile(output, resume), int(flush_rows))
     # Get some of the tables from the output file
-    order_tbl = outputFile.getNode("/Orders")
-    postion_tbl = outputFile.getNode("/Position")
-    performance_tbl = outputFile.getNode("/Performance")
-        
-    start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d")
-    end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
-    # Start the simulation at closing of the previous trading day
-    now = getPrevTradingDay(start_date)
+    order_tbl = outputFile.getTable("/Orders")
+    postion_tbl = outputFile.getTable("/Position")
+    performance_tbl = outputFile.getTable("/Performance")
 
+    state = None
+    pending = []
     try:
+        if resume:
+            state = load_state(outputFile, strategy_name, portfolio, strategy_params)
+            start_date = state['start_date']
+        
+        start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+        end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+        # Start the simulation at closing of the previous trading day
+        now = getPrevTradingDay(start_date)
         position = initialize_position(portfolio, now)
 
+        if state != None:
+            # Continue with the session after the last one simulated
+            last = datetime.datetime.strptime(state['date'], "%Y-%m-%d")
+            position['$'] = state['cash']
+            for symbol, amount, basis in state['position']:
+                position[symbol] = Position(amount, basis)
+            pending = [Order(*order) for order in state['pending']]
+            now = CALENDAR.next(last)
+            if now == None or now > end_date:
+                print "No sessions to simulate after", last.date()
+                return
+
         # Pre-cache some info to make the simulation faster
-        ticker = MARKET["^DJI"].updateHistory(start_date, end_date)
-        for symbol in position.keys():
-            if symbol != '$':
-                MARKET[symbol].updateHistory(start=start_date, end=end_date)
-        days = (end_date - start_date).days
+        ticker = MARKET["^DJI"].updateHistory(now, end_date)
+        for symbol in position.symbols:
+            MARKET[symbol].updateHistory(start=now, end=end_date)
+        sessions = CALENDAR.range(now, end_date)
+        if len(sessions) == 0:
+            print "No sessions to simulate from", start_date.date(), "to", end_date.date()
+            return
+        # The position is valued against the closes of all its symbols
+        # at once
+        days, closes, opens = vector_prices(position.symbols, sessions)
         
         # Initialize the strategy
         params = yaml.load(strategy_params)
         strategy_clazz = load_strategy(strategy_name)
-        strategy = strategy_clazz(start_date, end_date, position, MARKET, params, outputFile)
-
-        p = ProgressBar(maxValue=days, totalWidth=80)
+        strategy = strategy_clazz(start_date, end_date, position, MARKET, params, outputFile, state and state['indicators'])
+
+        # The performance is valued after the simulation from where the
+        # position starts and the orders executed
+        cash = position['$']
+        amounts = position.amounts.copy()
+        fills = []
+
+        # Orders placed on the last session of the appended simulation
+        # that could not be executed then
+        executed = execute_orders(order_tbl, position, sessions[0], pending)
+        if executed:
+            fills.append((0, position['$'], executed))
+        pending = []
+
+        p = ProgressBar(maxValue=len(sessions), totalWidth=80)
         print "Starting Simulation"
 
-        while now <= end_date:
+        for i, now in enumerate(sessions):
 
             # Write the initial position to the database
-            write_position(postion_tbl, position, now)
-            write_performance(performance_tbl, position, now)
+            write_position(postion_tbl, position, now, closes[i])
             
             # Remember 'now' is after closing, so the strategy
             # can use any information from 'now' or earlier
             orders = strategy.evaluate(now, position, MARKET)
                
-            # Go to the next day to evalute the orders
-            now += ONE_DAY
-            while not isTradingDay(now):
-                now += ONE_DAY
-                p.performWork(1)
-                continue
+            # Go to the next session to evalute the orders, orders
+            # placed on the last day execute after the end date
+            if i + 1 < len(sessions):
+                now = sessions[i + 1]
+            else:
+                if CALENDAR.next(now) == None:
+                    pending = orders
+                    break
+                now = CALENDAR.next(now)
             
             # Execute orders
-            execute_orders(order_tbl, position, now, orders)
+            executed = execute_orders(order_tbl, position, now, orders)
+            if executed:
+                fills.append((i + 1, position['$'], executed))
 
-            # Flush the data to disk
-            outputFile.flush()
             p.performWork(1)
             print p, '\r',
 
         p.updateAmount(p.max)
         print p, '\r',
         print '\n' # End the progress bar here before calling finalize
+        write_performance(performance_tbl, position, cash, amounts, fills, sessions, closes)
+        save_state(outputFile, strategy_name, portfolio, strategy_params, start_date, sessions[-1], position, pending, strategy)
         orders = strategy.finalize()
     finally:
         outputFile.close()
+
+# Sessions simulate_batch keeps the holdings of in memory at once
+BATCH_SESSIONS = 250
+
+@command("simulate_batch")
+def simulate_batch(strategy_name, portfolios, start_date, end_date, output="~/.quant/batch.h5", strategy_params="{}", sessions_per_pass=BATCH_SESSIONS):
+    """Simulates a strategy on many portfolios at once, with the rules of
+    the vector engine.
+
+    portfolios is a YAML list of portfolio names, or 'all' for every
+    portfolio in quant.cfg.  The prices and the signals of the strategy
+    are computed once for all of the symbols the portfolios hold, then
+    the portfolios are traded together with their cash and holdings as
+    (portfolios x symbols) arrays, so the time taken grows with the
+    number of symbols rather than the number of portfolios.  The signals
+    of a symbol must not depend on the other symbols of its portfolio,
+    which holds for the strategies that provide Strategy.signals.
+
+    Each portfolio is written to a group of its own in output, holding
+    the tables simulate writes, i.e. /<portfolio>/Performance, see
+    report_performance.  The holdings of sessions_per_pass sessions are
+    kept in memory at a time.
+    """
+    if portfolios == "all":
+        names = sorted(CONFIG['portfolios'].keys())
+    else:
+        names = yaml.load(portfolios)
+        if type(names) != list:
+            names = [names]
+    start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+    now = getPrevTradingDay(start_date)
+
+    positions = [initialize_position(name, now) for name in names]
+    symbols = sorted(set([symbol for position in positions for symbol in position.keys() if symbol != '$']))
+    offsets = dict((symbol, j) for j, symbol in enumerate(symbols))
+    columns = []
+    amounts = numpy.zeros((len(names), len(symbols)))
+    basis = numpy.zeros((len(names), len(symbols)))
+    for k, position in enumerate(positions):
+        # Orders are executed in the order simulate executes them
+        columns.append([offsets[symbol] for symbol in position.keys() if symbol != '$'])
+        for symbol, j in offsets.items():
+            if position.has_key(symbol):
+                amounts[k,j] = position[symbol].amount
+                basis[k,j] = position[symbol].basis
+    cash = [position['$'] for position in positions]
+
+    # One strategy computes the signals of every symbol
+    union = {'$': 0.0}
+    for symbol in symbols:
+        union[symbol] = Position(0.0, 0.0)
+    params = yaml.load(strategy_params)
+    strategy = load_strategy(strategy_name)(start_date, end_date, union, MARKET, params)
+
+    sessions = CALENDAR.range(now, end_date)
+    if len(sessions) == 0:
+        raise StandardError, "No sessions to simulate from %s to %s" % (start_date.date(), end_date.date())
+    days, closes, fills = vector_prices(symbols, sessions)
+    print "Starting Simulation of %d portfolios" % len(names)
+    signals = strategy.signals(sessions, symbols, closes)
+
+    outputFile = openBatchOutputFile(output, names)
+    try:
+        # Holding on to the tables keeps them open, there are more than
+        # the file caches
+        opened = [outputFile.getNode("/" + name, table) for name in names for table in ("Orders", "Position", "Performance")]
+        step = int(sessions_per_pass)
+        for a in xrange(0, len(sessions), step):
+            b = min(a + step, len(sessions))
+            batch = BatchBacktest(symbols, columns, cash, amounts, basis, strategy.SELL_ALL)
+            batch.run(signals[a:b], closes[a:b], fills[a:b])
+            for k, name in enumerate(names):
+                backtest, own = batch.portfolio(k)
+                write_backtest(outputFile, positions[k].keys(), backtest, days[a:b+1], closes[a:b,own], "/" + name)
+            cash, amounts, basis = batch.final_cash, batch.final_amounts, batch.final_basis
+        outputFile.flush()
+        strategy.finalize()
+    finally:
+        outputFile.close()
+
+    print
+    print "%-20s %10s %10s %10s %8s" % ("Portfolio", "Ending", "CAGR", "Drawdown", "Trades")
+    for name in names:
+        r = report.calculate_performance(output, "/" + name)
+        print "%-20s %10.2f %9.2f%% %9.2f%% %8d" % (name, r['ending_value'], r['cagr'], r['drawdown_per'], r['total_trades'])
+
+def _sweep_init(panel=None):
+    # The histories were loaded before the fork, only the sqlite
+    # connections can not be shared with the parent
+    global PANEL
+    MARKET.cache.reconnect()
+    CALENDAR.market.cache.reconnect()
+    if panel != None:
+        PANEL = Panel(panel)
+
+def _sweep_run(args):
+    strategy_name, portfolio, start_date, end_date, output, params, engine = args
+    simulate(strategy_name, portfolio, start_date, end_date, output, yaml.dump(params), engine)
+    return report.calculate_performance(output)
+
+def sweep_params(strategy_params):
+    """Expands a YAML list of strategy_params, or a mapping where lists
+    are the values to try for that parameter, into a list of params"""
+    grid = yaml.load(strategy_params)
+    if type(grid) == list:
+        return grid
+    names = sorted(grid.keys())
+    values = [grid[name] if type(grid[name]) == list else [grid[name]] for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def sweep_backfill(runs):
+    """The days before the start that the indicators of any of the runs
+    backfill, the largest backfill or long of their params and at least
+    a year"""
+    days = 365
+    for params in runs:
+        if type(params) != dict:
+            continue
+        for name in ("backfill", "long"):
+            if type(params.get(name)) in (int, float):
+                days = max(days, int(math.ceil(params[name])))
+    return days
+
+@command("sweep")
+def sweep(strategy_name, portfolio, start_date, end_date, strategy_params="{}", output="~/.quant/sweep", engine="vector", processes=0):
+    """Simulates a strategy once for every combination of strategy_params
+    in parallel and tabulates the performance of each run.
+    
+    strategy_params is either a YAML list of params, or a mapping where a
+    list gives the values to try for that parameter, i.e.
+    '{long: [50, 100, 200], short: [10, 15]}'.  Each run is written to
+    <output>_<n>.h5 and the table to <output>.h5.  Market data is loaded
+    before the worker processes are started so they all share it, the
+    prices the vector engine trades on are published as a memory-mapped
+    Panel in <output>_panel for the duration of the sweep.
+    """
+    runs = sweep_params(strategy_params)
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+
+    # Load everything the runs need before forking, including the
+    # backfill of the indicators
+    first = start - (sweep_backfill(runs) * ONE_DAY)
+    CALENDAR.range(first, end)
+    symbols = [symbol.strip() for symbol in CONFIG['portfolios'][portfolio].keys() if symbol.strip() != '$']
+    for symbol in symbols:
+        MARKET[symbol].ensure(first, min(end, datetime.datetime.today()))
+
+    # The panel reaches the session after the end, when orders placed on
+    # the last session are filled
+    sessions = CALENDAR.range(getPrevTradingDay(start), end)
+    if len(sessions) == 0:
+        raise StandardError, "No sessions to simulate from %s to %s" % (start_date, end_date)
+    after = CALENDAR.next(sessions[-1])
+    panel = Panel.build(output + "_panel", symbols, sessions + [after] if after else sessions, MARKET)
+
+    args = [(strategy_name, portfolio, start_date, end_date, "%s_%d.h5" % (output, n), params, engine)
+            for n, params in enumerate(runs)]
+    pool = multiprocessing.Pool(processes or None, _sweep_init, (panel.path,))
+    try:
+        reports = pool.map(_sweep_run, args)
+    finally:
+        pool.close()
+        pool.join()
+        panel.remove()
+
+    outputFile = tables.openFile(os.path.expanduser(output + ".h5"), mode="w", title="Quant Sweep")
+    try:
+        tbl = outputFile.createTable("/", "Results", SweepData)
+        for (strategy_name, portfolio, start_date, end_date, fname, params, engine), r in zip(args, reports):
+            tbl.row['params'] = yaml.dump(params, default_flow_style=True).strip()
+            tbl.row['output'] = fname
+            for name in SweepData.columns.keys():
+                if name not in ('params', 'output'):
+                    tbl.row[name] = r[name]
+            tbl.row.append()
+        tbl.flush()
+    finally:
+        outputFile.close()
+
+    print
+    print "%-40s %10s %10s %10s %8s %8s %8s" % ("Params", "Ending", "CAGR", "Drawdown", "Days", "Sharpe", "Trades")
+    for (strategy_name, portfolio, start_date, end_date, fname, params, engine), r in zip(args, reports):
+        print "%-40s %10.2f %9.2f%% %9.2f%% %8d %8.2f %8d" % (yaml.dump(params, default_flow_style=True).strip(),
+            r['ending_value'], r['cagr'], r['drawdown_per'], r['drawdown_dur'], r['sharpe'], r['total_trades'])
+
+def _walkforward_run(args):
+    # The signals of one set of params over all of the sessions, and its
+    # performance in each in-sample window
+    strategy_name, position, symbols, params, start, end, windows, metric = args
+    strategy = load_strategy(strategy_name)(start, end, position, MARKET, params)
+    sessions = CALENDAR.range(getPrevTradingDay(start), end)
+    days, closes, fills = vector_prices(symbols, sessions)
+    signals = strategy.signals(sessions, symbols, closes)
+
+    scores = []
+    for (a, b), (cash, amounts, basis) in windows:
+        backtest = Backtest(symbols, cash, amounts, basis)
+        backtest.run(signals[a:b], closes[a:b], fills[a:b])
+        ordinals = [d.toordinal() for d in sessions[a:b]]
+        scores.append(report.equity_performance(ordinals, backtest.equity(closes[a:b]))[metric])
+    return scores, signals
+
+def walkforward_windows(sessions, start, end, in_sample, out_sample):
+    """Splits the sessions from start to end into rolling windows of
+    in_sample days, each followed by out_sample days that are traded
+    with what was learned in it.  Returns the (first, last, stop) offsets
+    of the sessions of each window, in sample from first up to last and
+    out of sample from last up to stop; the out-of-sample parts follow
+    one another without gaps."""
+    ordinals = numpy.array([d.toordinal() for d in sessions])
+    windows = []
+    first = start
+    while first + (in_sample * ONE_DAY) <= end:
+        last = first + (in_sample * ONE_DAY)
+        stop = min(last + (out_sample * ONE_DAY), end + ONE_DAY)
+        a, b, c = ordinals.searchsorted([first.toordinal(), last.toordinal(), stop.toordinal()])
+        # Performance needs at least two sessions to be measured
+        if b - a > 1 and c - b > 1:
+            windows.append((int(a), int(b), int(c)))
+        first += out_sample * ONE_DAY
+    return windows
+
+@command("walkforward")
+def walkforward(strategy_name, portfolio, start_date, end_date, strategy_params="{}", output="~/.quant/walkforward.h5", in_sample=365, out_sample=91, metric="sharpe", processes=0):
+    """Walk-forward optimization of the strategy_params of a strategy.
+
+    The sessions from start_date to end_date are split into rolling
+    windows of in_sample days, each followed by out_sample days.  The
+    params, given like for sweep, with the highest metric (a measure of
+    report_performance, i.e. sharpe, cagr or calmar) in a window's
+    in-sample days are traded in its out-of-sample days.  The
+    out-of-sample days are traded one after the other, each starting from
+    the holdings the previous one ended with, and written to output as
+    one simulation, along with a /Windows table of the params chosen for
+    each window and how they did.
+
+    Strategies must provide Strategy.signals, as with the vector engine.
+    The signals of each set of params are computed once over all of the
+    sessions, in parallel, from a Panel of the prices, and every window
+    is backtested on slices of them, so overlapping windows do not load
+    prices or compute indicators again.
+    """
+    runs = sweep_params(strategy_params)
+    start = datetime.datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.datetime.strptime(end_date, "%Y-%m-%d")
+
+    # Load everything the runs need before forking, including the
+    # backfill of the indicators
+    first = start - (sweep_backfill(runs) * ONE_DAY)
+    CALENDAR.range(first, end)
+    now = getPrevTradingDay(start)
+    position = initialize_position(portfolio, now)
+    symbols = [symbol for symbol in position.keys() if symbol != '$']
+    for symbol in symbols:
+        MARKET[symbol].ensure(first, min(end, datetime.datetime.today()))
+
+    sessions = CALENDAR.range(now, end)
+    windows = walkforward_windows(sessions, start, end, int(in_sample), int(out_sample))
+    if len(windows) == 0:
+        raise StandardError, "No window of %s in-sample and %s out-of-sample days fits from %s to %s" % (in_sample, out_sample, start_date, end_date)
+    days, closes, fills = vector_prices(symbols, sessions)
+
+    # Each in-sample window starts from the portfolio as it would be
+    # bought at its start
+    samples = []
+    for a, b, c in windows:
+        initial = initialize_position(portfolio, sessions[a])
+        samples.append(((a, b), (initial['$'], [initial[s].amount for s in symbols], [initial[s].basis for s in symbols])))
+
+    panel = Panel.build(os.path.splitext(output)[0] + "_panel", symbols, days, MARKET)
+    args = [(strategy_name, position, symbols, params, start, end, samples, metric) for params in runs]
+    pool = multiprocessing.Pool(processes or None, _sweep_init, (panel.path,))
+    try:
+        results = pool.map(_walkforward_run, args)
+    finally:
+        pool.close()
+        pool.join()
+        panel.remove()
+
+    sell_all = load_strategy(strategy_name).SELL_ALL
+    outputFile = openOutputFile(output)
+    try:
+        tbl = outputFile.createTable("/", "Windows", WalkForwardData)
+        initial = initialize_position(portfolio, sessions[windows[0][1]])
+        cash = initial['$']
+        amounts = [initial[s].amount for s in symbols]
+        basis = [initial[s].basis for s in symbols]
+        for k, (a, b, c) in enumerate(windows):
+            scores = numpy.array([result[0][k] for result in results], dtype=float)
+            best = numpy.where(scores == scores, scores, -numpy.inf).argmax()
+            signals = results[best][1]
+
+            backtest = Backtest(symbols, cash, amounts, basis, sell_all)
+            backtest.run(signals[b:c], closes[b:c], fills[b:c])
+            write_backtest(outputFile, initial.keys(), backtest, days[b:c+1], closes[b:c])
+            cash, amounts, basis = backtest.final_cash, backtest.final_amounts, backtest.final_basis
+
+            r = report.equity_performance([d.toordinal() for d in sessions[b:c]], backtest.equity(closes[b:c]))
+            tbl.row['in_start'] = str(sessions[a].date())
+            tbl.row['in_end'] = str(sessions[b - 1].date())
+            tbl.row['out_start'] = str(sessions[b].date())
+            tbl.row['out_end'] = str(sessions[c - 1].date())
+            tbl.row['params'] = yaml.dump(runs[best], default_flow_style=True).strip()
+            tbl.row['in_sample'] = scores[best]
+            tbl.row['out_sample'] = r[metric]
+            tbl.row['out_percent'] = r['equity_percent']
+            tbl.row.append()
+        outputFile.flush()
+
+        print
+        print "%-12s %-12s %-40s %10s %10s %10s" % ("In sample", "Out sample", "Params", "In " + metric, "Out " + metric, "Return")
+        for row in tbl.read():
+            print "%-12s %-12s %-40s %10.2f %10.2f %9.2f%%" % (row['in_start'], row['out_start'], row['params'],
+                row['in_sample'], row['out_sample'], row['out_percent'])
+    finally:
+        outputFile.close()
+
+if __name__ == "__main__":
+    import unittest
+    import tempfile
+
+    class SimulateTest(unittest.TestCase):
+
+        def test_VectorAppend(self):
+            # Appending with the vector engine fails and leaves the output
+            # it was asked to extend as it was
+            fd, path = tempfile.mkstemp(suffix=".h5")
+            os.write(fd, "earlier rows")
+            os.close(fd)
+            try:
+                self.assertRaises(StandardError, simulate, "hold", "spy", "2005-01-01", "2006-01-01",
+                                  path, "{}", engine="vector", append=True)
+                self.assertEqual(open(path).read(), "earlier rows")
+            finally:
+                os.remove(path)
+
+        def test_EmptyRange(self):
+            # A range without sessions writes an empty simulation
+            CONFIG['portfolios']['_empty_range'] = {'$': 1000.0}
+            fd, path = tempfile.mkstemp(suffix=".h5")
+            os.close(fd)
+            try:
+                for engine in ("event", "vector"):
+                    simulate("hold", "_empty_range", "2007-07-10", "2007-07-01", path, "{}", engine=engine)
+                    outputFile = tables.openFile(path, "r")
+                    try:
+                        self.assertEqual(outputFile.getNode("/Performance").nrows, 0)
+                        self.assertEqual(outputFile.getNode("/Orders").nrows, 0)
+                    finally:
+                        outputFile.close()
+                self.assertRaises(StandardError, vector_prices, ["spy"], [])
+            finally:
+                os.remove(path)
+                del CONFIG['portfolios']['_empty_range']
+
+        def test_SweepBackfill(self):
+            self.assertEqual(sweep_backfill(sweep_params("{short: [10, 15]}")), 365)
+            self.assertEqual(sweep_backfill(sweep_params("{long: [50, 400]}")), 400)
+            self.assertEqual(sweep_backfill(sweep_params("[{long: 50, backfill: 500}]")), 500)
+
+        def test_SellOrders(self):
+            # The event loop and the vector engine record the same orders
+            # for the sell strategy
+            day = datetime.datetime(2010, 1, 4)
+            position = PositionBook({'$': 0.0, 'spy': Position(10.0, 20.0), 'iwm': Position(0.0, 0.0)})
+            strategy = load_strategy("sell")(day, day, position, None, {})
+            event = [str(order) for order in strategy.evaluate(day, position, None)]
+
+            symbols = position.symbols
+            closes = numpy.array([[21.0, 30.0]])
+            backtest = Backtest(symbols, position['$'], position.amounts, position.basis, strategy.SELL_ALL)
+            signals = strategy.signals([day], symbols, closes)
+            vector = [str(order) for i, order, qty, price, basis in backtest.run(signals, closes, closes)]
+            self.assertEqual(event, vector)
+
+    unittest.main()
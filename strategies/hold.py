@@ -19,6 +19,8 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 from strategy import Strategy
 from utils.model import Order
+from utils.backtest import HOLD
+import numpy
 
 class Hold(Strategy):
     """The most basic strategy.  It holds the initial postion and
@@ -27,4 +29,7 @@ class Hold(Strategy):
     def evaluate(self, date, position, market):
         return () # There are never any orders from this strategy
 
+    def signals(self, dates, symbols, closes):
+        return numpy.zeros(closes.shape, dtype=numpy.int8) + HOLD
+
 CLAZZ = Hold
@@ -19,9 +19,13 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 from strategy import Strategy
 from utils.model import Order
+from utils.backtest import SELL
+import numpy
 
 class SellOff(Strategy):
     """A simple strategy, useful for testing, that sells everything immediately."""
+    SELL_ALL = False
+
     def evaluate(self, date, position, market):
         orders = [] 
         for symbol, p in position.items():
@@ -29,4 +33,7 @@ class SellOff(Strategy):
                 orders.append(Order(Order.SELL, symbol, p.amount, Order.MARKET_PRICE))
         return orders
 
+    def signals(self, dates, symbols, closes):
+        return numpy.zeros(closes.shape, dtype=numpy.int8) + SELL
+
 CLAZZ = SellOff
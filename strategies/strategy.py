@@ -16,11 +16,20 @@ You should have received a copy of the GNU General Public License
 along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
-from utils.date import ONE_DAY
+from utils.date import ONE_DAY, ordinalToYmd
+import datetime
+from utils.market import CALENDAR
+from indicators.graph import IndicatorGraph
+from utils.results import defaultResults
+import numpy
 import tables
 
 class Strategy(object):
-    def __init__(self, start_date, end_date, initial_position, market, params, h5file=None):
+    # Whether evaluate sells holdings with orders to sell ALL, as the
+    # vector engine then records them, or orders the quantity held
+    SELL_ALL = True
+
+    def __init__(self, start_date, end_date, initial_position, market, params, h5file=None, state=None, graph=None):
         self.start_date = start_date
         self.end_date = end_date
         self.initial_position = initial_position
@@ -32,16 +41,44 @@ class Strategy(object):
         #  value = dictionary(key="indicator name", value=indicator)
         self.indicators = {}
 
-        # If the strategy was passed h5 info, use it to store information
+        # The indicators are computed by a graph that keeps identical
+        # indicators, and the ones they are computed from, only once.  A
+        # graph can be shared by strategies that are updated in step.
+        # Backfills are loaded from the results cache when the prices and
+        # parameters are the same as in an earlier run.
+        if graph == None:
+            graph = IndicatorGraph(defaultResults())
+        self.graph = graph
+
+        # A state from getState to resume from, the indicators of the
+        # symbols in it start from their saved state and are rolled forward
+        # from the session after the one it was saved on
+        self.state = state or {}
+        self.updated = {} # The last session the indicators of a symbol saw
+        self.resumed = set()
+        self.restored = False
+
+        # If the strategy was passed h5 info, use it to store information,
+        # appending to the groups if they already exist
         self.h5file = h5file
         if h5file != None:
-            self.indicator_h5group = h5file.createGroup("/", "Indicators")
-            self.strategy_h5group = h5file.createGroup("/", "Strategy")
+            self.indicator_h5group = self._h5group("Indicators")
+            self.strategy_h5group = self._h5group("Strategy")
+
+    def _h5group(self, name):
+        try:
+            return self.h5file.getNode("/", name, classname="Group")
+        except tables.NoSuchNodeError:
+            return self.h5file.createGroup("/", name)
 
     def addIndicator(self, symbol, name, indicator):
+        """Adds an indicator of a symbol under a name and returns it.  If
+        the graph already has the same indicator, that one is used
+        instead and returned."""
         if not self.indicators.has_key(symbol):
             self.indicators[symbol] = {}
-        self.indicators[symbol][name] = indicator
+        added = self.graph.add(symbol, indicator, self)
+        self.indicators[symbol][name] = added
 
         if self.h5file != None:
             try:
@@ -49,32 +86,102 @@ class Strategy(object):
             except tables.NoSuchNodeError:
                 symgroup = self.h5file.createGroup(self.indicator_h5group._v_pathname, symbol)
 
-            if self.h5file and self.indicator_h5group:
-                indicator.setupH5(self.h5file, symgroup, name)
+            if getattr(added, "tbl", None) == None:
+                added.setupH5(self.h5file, symgroup, name)
+            else:
+                # The indicator is stored under another name already
+                try:
+                    self.h5file.getNode(symgroup, name)
+                except tables.NoSuchNodeError:
+                    self.h5file.createHardLink(symgroup, name, getattr(added.tbl, "table", added.tbl))
+
+        return added
 
     def removeIndicator(self, symbol, name):
         del self.indicators[symbol][name]
 
+    def _restore(self):
+        # Resume the symbols that the state has every indicator of
+        self.restored = True
+        for symbol, saved in self.state.get('indicators', {}).items():
+            date = self.state.get('dates', {}).get(symbol, self.state.get('date'))
+            if date != None and self.indicators.has_key(symbol) and self.graph.setState(symbol, saved):
+                self.updated[symbol] = datetime.datetime.strptime(date, "%Y-%m-%d")
+                self.resumed.add(symbol)
+
     def updateIndicators(self, start_date, end_date=None):
-        for symbol, indicators in self.indicators.items():
+        if not self.restored:
+            self._restore()
+        if end_date != None:
+            end = end_date
+        else:
+            end = start_date + ONE_DAY
+        sessions = CALENDAR.range(start_date, end - ONE_DAY)
+
+        for symbol in self.indicators.keys():
+            days = sessions
+            if symbol in self.resumed:
+                # Only the sessions the saved state has not seen, which
+                # may start before start_date if the state is old
+                days = CALENDAR.range(self.updated[symbol] + ONE_DAY, end - ONE_DAY)
+            if len(days) == 0:
+                continue
+
             ticker = self.market[symbol]
             if end_date != None:
-                quotes = ticker[start_date:end_date] # Call this to cache everything
-                end = end_date
-            else:
-                end = start_date + ONE_DAY
+                # Ranges, like the backfill, are fed to the indicators as
+                # arrays
+                ticker.ensure(days[0], end_date) # Call this to cache everything
+                history = self.market.cache.load(ticker.symbol)
+                ymds = ordinalToYmd(numpy.array([d.toordinal() for d in days]))
+                closes = history.column("adjclose", ymds)
+                valid = numpy.flatnonzero(closes == closes)
+                days = [days[i] for i in valid]
+                columns = dict([(field, history.column(field, ymds[valid])) for field in self.graph.fields(symbol)])
+                self.graph.updateSeries(self, symbol, days, columns)
+                if len(days) > 0:
+                    self._updated(symbol, days[-1])
+                continue
 
-            d = start_date
-            while d < end:
+            for d in days:
                 quote = ticker[d]
                 if quote.adjclose != None:
-                    for indicator in indicators.values():
-                        indicator.update(quote.adjclose, d)
-                d += ONE_DAY
+                    self.graph.update(self, symbol, d, quote)
+                    self._updated(symbol, d)
+
+    def _updated(self, symbol, date):
+        # Sessions without a close are not counted as seen, so a state
+        # saved before the close arrived picks it up when it is resumed
+        if self.updated.get(symbol) == None or date > self.updated[symbol]:
+            self.updated[symbol] = date
+
+    def getState(self):
+        """The state of the indicators, which can be passed as the state
+        argument of a new strategy to continue where this one left off.
+        indicators holds the states of the indicators of each symbol by
+        their key in the graph, dates the last session each symbol was
+        updated with and date the latest of them."""
+        indicators = {}
+        dates = {}
+        for symbol in self.indicators.keys():
+            indicators[symbol] = self.graph.getState(symbol)
+            if self.updated.get(symbol) != None:
+                dates[symbol] = str(self.updated[symbol].date())
+        date = None
+        if len(dates) > 0:
+            date = max(dates.values())
+        return {'date': date, 'dates': dates, 'indicators': indicators}
 
     def evaluate(self, date, position):
         raise NotImplementedError
 
+    def signals(self, dates, symbols, closes):
+        """Array form of evaluate used by the vector engine.  Given the
+        session dates and a (sessions x symbols) array of adjusted closes,
+        NaN where there is no quote, returns an array of the same shape of
+        utils.backtest BUY, SELL or HOLD signals decided at each close."""
+        raise NotImplementedError
+
     def finalize(self):
         self.h5file = None
         self.indicator_h5group = None
@@ -20,9 +20,6 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 import datetime
 import os
 import tables
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
-import matplotlib.ticker as ticker
 
 from indicators.ema import EMA
 from indicators.rsi import RSI 
@@ -30,6 +27,8 @@ from indicators.simplevalue import SimpleValue
 from strategy import Strategy
 from utils.model import Order
 from utils.date import ONE_DAY
+from utils.backtest import BUY, SELL
+import numpy
 
 class SymbolData(tables.IsDescription):
     date = tables.TimeCol()
@@ -42,8 +41,8 @@ class Trending(Strategy):
     DEF_SHORT_DAYS = 15
     DEF_RSI_PERIOD = 14
 
-    def __init__(self, start_date, end_date, initial_position, market, params, h5file=None):
-        Strategy.__init__(self, start_date, end_date, initial_position, market, params, h5file)
+    def __init__(self, start_date, end_date, initial_position, market, params, h5file=None, state=None, graph=None):
+        Strategy.__init__(self, start_date, end_date, initial_position, market, params, h5file, state, graph)
         for symbol in initial_position.keys():
             if symbol == "$":
                 continue
@@ -112,4 +111,28 @@ class Trending(Strategy):
                 
         return orders
 
+    def signals(self, dates, symbols, closes):
+        # Carry the backfilled averages forward over the closes, the money
+        # management done in evaluate is applied by the backtest
+        signals = numpy.zeros(closes.shape, dtype=numpy.int8)
+        for j, symbol in enumerate(symbols):
+            short = self.indicators[symbol]["short"]
+            long_ = self.indicators[symbol]["long"]
+            # Sessions before the first close keep the backfilled values
+            if short.value < long_.value:
+                signals[:,j] = SELL
+            elif short.value > long_.value:
+                signals[:,j] = BUY
+
+            valid = numpy.flatnonzero(closes[:,j] == closes[:,j])
+            if len(valid) == 0:
+                continue
+            shorts = self.graph.series(symbol, short, closes[valid,j])
+            longs = self.graph.series(symbol, long_, closes[valid,j])
+            # The last close at or before each session
+            last = valid.searchsorted(numpy.arange(len(dates)), side="right") - 1
+            after = last >= 0
+            signals[after,j] = numpy.where(shorts < longs, SELL, numpy.where(shorts > longs, BUY, 0))[last[after]]
+        return signals
+
 CLAZZ = Trending
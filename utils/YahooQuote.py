@@ -70,12 +70,19 @@ import logging
 import Queue, thread, threading
 import datetime
 import sqlite3
+import numpy
+from utils.date import ymdToOrdinal, ordinalToYmd
 
 Y2KCUTOFF=60
 __version__ = "0.4"
 
 CACHE='~/.quant/stocks.db'
 
+# The store used by L{Market}, either the "sqlite" L{Cache} or the "binary"
+# L{BinaryCache} kept in STORE_DIR
+STORE="sqlite"
+STORE_DIR='~/.quant/store'
+
 MONTH2NUM = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
   'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
 
@@ -91,9 +98,19 @@ baseUrlQuote = "http://download.finance.yahoo.com/d/quotes.csv"
 
 fetchWindow = 90
 
+# sqlite pragmas used while bulk loading histories, trading durability
+# of the load in progress for speed
+LOAD_PRAGMAS = {"synchronous": "OFF", "journal_mode": "MEMORY"}
+
 # maximum number of threads for fetching histories
 maxHistoryThreads = 10
 
+# minimum seconds between requests to the same host, and how often and
+# after how long (doubling each time) failed requests are retried
+minRequestInterval = 0.1
+fetchRetries = 3
+fetchBackoff = 1.0
+
 # hardwired table listing the various stock indexes around the world.
 # from time to time, this will need to be updated
 indexes = {
@@ -171,6 +188,284 @@ class SymbolNotFound(Exception):
     pass
 
 
+class RateLimiter:
+    """
+    Spaces out requests to each host by at least a given interval,
+    shared by all threads
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next = {}
+
+    def wait(self, url):
+        host = urllib.splithost(urllib.splittype(url)[1])[0]
+        self.lock.acquire()
+        try:
+            now = time.time()
+            when = max(now, self.next.get(host, now))
+            self.next[host] = when + self.interval
+        finally:
+            self.lock.release()
+        if when > now:
+            time.sleep(when - now)
+
+rateLimiter = RateLimiter(minRequestInterval)
+
+def urlopen(url):
+    """
+    urllib.urlopen with per-host rate limiting, retrying failed requests
+    and server errors with exponential backoff
+    """
+    delay = fetchBackoff
+    attempt = 0
+    while True:
+        rateLimiter.wait(url)
+        try:
+            resp = urllib.urlopen(url)
+            if resp.getcode() == None or resp.getcode() < 500:
+                return resp
+            error = "HTTP %s" % resp.getcode()
+        except IOError, e:
+            error = e
+        attempt += 1
+        if attempt > fetchRetries:
+            raise IOError("%s: %s" % (url, error))
+        logging.info("retrying %s in %0.1fs: %s", url, delay, error)
+        time.sleep(delay)
+        delay *= 2
+
+
+class HistoryFetcher:
+    """
+    Fetches the histories of many tickers with a bounded pool of worker
+    threads.  The workers download and parse the CSV history concurrently;
+    the thread calling L{HistoryFetcher.fetch} is the only one that writes
+    to the cache, since the sqlite connection can not be shared.
+    """
+    def __init__(self, market, threads=maxHistoryThreads):
+        self.market = market
+        self.threads = threads
+
+    def fetch(self, jobs, purge=False):
+        """
+        Fetches each (ticker, wantDate, priorDate) job, purging the
+        ticker's existing history first if purge is True
+        """
+        jobs = [(ticker,) + ticker._window(wantDate, priorDate) for ticker, wantDate, priorDate in jobs]
+        if len(jobs) == 0:
+            return
+        todo = Queue.Queue()
+        done = Queue.Queue()
+        for job in jobs:
+            todo.put(job)
+
+        def worker():
+            while True:
+                try:
+                    ticker, wantDate, priorDate = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    done.put((ticker, wantDate, priorDate, ticker._download(wantDate, priorDate), None))
+                except Exception, e:
+                    done.put((ticker, wantDate, priorDate, None, e))
+
+        workers = [threading.Thread(target=worker) for i in xrange(min(self.threads, len(jobs)))]
+        for w in workers:
+            w.setDaemon(True)
+            w.start()
+
+        for i in xrange(len(jobs)):
+            # poll so that a KeyboardInterrupt is still delivered
+            while True:
+                try:
+                    ticker, wantDate, priorDate, quotes, error = done.get(True, 1.0)
+                    break
+                except Queue.Empty:
+                    pass
+            if error != None:
+                logging.error("%s: failed to fetch: %s" % (ticker.symbol, error))
+                continue
+            if quotes == None:
+                # the existing history is kept when the fetch failed
+                continue
+            if purge:
+                self.market.cache.purge(ticker.symbol)
+            ticker._store(wantDate, priorDate, quotes)
+
+
+class History:
+    """
+    Columnar, in-memory copy of the cached history of a single symbol.
+
+    The rows are held as parallel numpy arrays sorted by date, so single
+    days and date ranges are served with a binary search instead of a
+    query against the sqlite cache.  Placeholder rows, for days that were
+    requested but have no data, are kept with NaN values.
+    """
+    FIELDS = ("open", "close", "low", "high", "volume", "adjclose")
+
+    def __init__(self, symbol, rows):
+        """
+        Builds the arrays from rows of (date, open, close, low, high,
+        volume, adjclose) in ascending date order
+        """
+        self.symbol = symbol
+        if len(rows) == 0:
+            self.date = numpy.zeros(0, dtype=numpy.int32)
+            values = numpy.zeros((0, len(History.FIELDS)))
+        else:
+            self.date = numpy.array([row[0] for row in rows], dtype=numpy.int32)
+            values = numpy.array([row[1:] for row in rows], dtype=float)
+        for i, field in enumerate(History.FIELDS):
+            setattr(self, field, values[:,i].copy())
+
+    @classmethod
+    def fromColumns(cls, symbol, date, columns):
+        """
+        Builds a history around existing arrays, without copying them,
+        from an array of dates and a dict of arrays keyed by L{FIELDS}
+        """
+        history = cls(symbol, [])
+        history.date = date
+        for field in History.FIELDS:
+            setattr(history, field, columns[field])
+        return history
+
+    def __len__(self):
+        return len(self.date)
+
+    def find(self, date):
+        """
+        Returns the offset of the row for a yyyymmdd date, or -1
+        if the date has no row
+        """
+        i = self.date.searchsorted(date)
+        if i < len(self.date) and self.date[i] == date:
+            return i
+        return -1
+
+    def range(self, priorDate, wantDate):
+        """
+        Returns the (start, stop) offsets of the rows between
+        priorDate and wantDate inclusive
+        """
+        return (self.date.searchsorted(priorDate, side="left"),
+                self.date.searchsorted(wantDate, side="right"))
+
+    def column(self, field, dates):
+        """
+        Returns the values of a field for an array of yyyymmdd dates,
+        NaN where there is no row.  The adjusted fields adjopen, adjlow
+        and adjhigh are derived the same way as on L{Quote}.
+        """
+        dates = numpy.asarray(dates)
+        if len(self.date) == 0:
+            return numpy.zeros(len(dates)) + numpy.nan
+        if field in ("adjopen", "adjlow", "adjhigh"):
+            old = numpy.seterr(divide="ignore", invalid="ignore")
+            try:
+                values = (self.adjclose / self.close) * getattr(self, field[3:])
+            finally:
+                numpy.seterr(**old)
+        else:
+            values = getattr(self, field)
+        offsets = self.date.searchsorted(dates)
+        offsets[offsets >= len(self.date)] = 0
+        return numpy.where(self.date[offsets] == dates, values[offsets], numpy.nan)
+
+    def quote(self, i):
+        """
+        Builds a L{Quote} for the row at offset i
+        """
+        values = [getattr(self, field)[i] for field in History.FIELDS]
+        values = [float(v) if v == v else None for v in values]
+        return Quote(self.symbol, date=int(self.date[i]), **dict(zip(History.FIELDS, values)))
+
+    def quotes(self, start, stop):
+        """
+        Builds a list of L{Quote} objects for the rows in [start, stop)
+        """
+        return [self.quote(i) for i in xrange(start, stop)]
+
+
+class Coverage:
+    """
+    The date ranges of a symbol that have been fetched from the source,
+    kept as sorted, non-overlapping [start, end] QuoteDate intervals.
+    Days inside the intervals without a history row are known to have
+    no quote, so they never have to be fetched again.
+    """
+    def __init__(self, intervals=()):
+        self.intervals = []
+        for start, end in intervals:
+            self.add(start, end)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, start, end):
+        """
+        Merges [start, end] into the intervals
+        """
+        start, end = QuoteDate(start), QuoteDate(end)
+        if end < start:
+            return
+        merged = []
+        for a, b in self.intervals:
+            if b + 1 < start or end + 1 < a:
+                merged.append((a, b))
+            else:
+                start, end = min(a, start), max(b, end)
+        merged.append((start, end))
+        merged.sort()
+        self.intervals = merged
+
+    def covers(self, date):
+        for a, b in self.intervals:
+            if a <= date <= b:
+                return True
+        return False
+
+    def gaps(self, start, end):
+        """
+        Returns the [start, end] intervals between start and end
+        that have not been fetched
+        """
+        gaps = []
+        for a, b in self.intervals:
+            if b < start:
+                continue
+            if a > end:
+                break
+            if a > start:
+                gaps.append((start, a - 1))
+            start = b + 1
+            if start > end:
+                return gaps
+        gaps.append((start, end))
+        return gaps
+
+    def last(self):
+        """
+        Returns the last covered day, or None
+        """
+        if len(self.intervals) == 0:
+            return None
+        return self.intervals[-1][1]
+
+
+# Every open cache, see L{refreshCaches}
+caches = weakref.WeakSet()
+
+def refreshCaches():
+    """
+    Calls L{Cache.refresh} on every open cache
+    """
+    for cache in list(caches):
+        cache.refresh()
+
 class Cache:
     """
     Class that provides the cache using sqllite.
@@ -185,19 +480,65 @@ class Cache:
         "high float",
         "volume float",
         "adjclose float")
+    COVERAGE_COL_DEF=(
+        "symbol text not null",
+        "start date",
+        "end date")
 
-    def __init__(self):
-        dbPath = os.path.expanduser(CACHE)
-        dbDir = os.path.split(dbPath)[0]
+    def __init__(self, path=CACHE):
+        self.path = os.path.expanduser(path)
+        dbDir = os.path.split(self.path)[0]
         if not os.path.isdir(dbDir):
-            os.mkdir(dbDir)
+            os.makedirs(dbDir)
 
-        self.db = sqlite3.connect(dbPath)
+        self.db = sqlite3.connect(self.path)
+
+        # Columnar copies of symbol histories, see L{Cache.load}
+        self.histories = {}
+        # Fetched date ranges of symbols, see L{Cache.coverage}
+        self.coverages = {}
+
+        # Rows stored and pragmas to restore, see L{Cache.beginLoad}
+        self.stored = 0
+        self.restore = {}
+
+        self.version = self._dataVersion()
+        caches.add(self)
 
         cursor = self.db.cursor()
+        self._createTables(cursor)
+	cursor.close()
+
+    def _createTables(self, cursor):
 	cursor.execute("CREATE TABLE IF NOT EXISTS history (%s)" % (", ".join(Cache.HISTORY_COL_DEF)))
 	cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ticker ON history (symbol, date ASC)")
-	cursor.close()
+	cursor.execute("CREATE TABLE IF NOT EXISTS coverage (%s)" % (", ".join(Cache.COVERAGE_COL_DEF)))
+	cursor.execute("CREATE INDEX IF NOT EXISTS covered ON coverage (symbol)")
+
+    def reconnect(self):
+        """
+        Opens a new connection to the database, the loaded histories are
+        kept.  A process forked from the one that created this cache
+        must call this before using it.
+        """
+        self.db = sqlite3.connect(self.path)
+        self.version = self._dataVersion()
+
+    def _dataVersion(self):
+        return self.db.execute("PRAGMA data_version").fetchone()[0]
+
+    def refresh(self):
+        """
+        Drops the in-memory histories and coverages if the database has
+        been changed through another connection, or another process,
+        since they were read.  Long running processes call this before
+        each unit of work.
+        """
+        version = self._dataVersion()
+        if version != self.version:
+            self.histories.clear()
+            self.coverages.clear()
+            self.version = version
 
     def symbols(self):
         """Return a list of symbols that have been cached."""
@@ -214,25 +555,179 @@ class Cache:
             hist = cursor.execute("SELECT * FROM HISTORY WHERE (date>='%s' and date<='%s' and symbol='%s')" % (priorDate, wantDate, symbol)).fetchall()
         return [Quote.fromRow(x) for x in hist]
 
+    def days(self, symbol, start=None, end=None):
+        """
+        Returns (date, has_data) rows, in ascending date order, for the
+        days of a symbol between the yyyymmdd dates start and end
+        """
+        cursor = self.db.cursor()
+        days = cursor.execute("SELECT date, adjclose IS NOT NULL FROM HISTORY WHERE (symbol=? and date>=? and date<=?) ORDER BY date ASC",
+                              (symbol, start or 0, end or 99999999)).fetchall()
+        cursor.close()
+        return days
+
+    def load(self, symbol):
+        """
+        Returns the L{History} for a symbol.  The whole history is
+        read with one query the first time it is requested and kept
+        until the symbol's rows are changed through this cache.
+        """
+        history = self.histories.get(symbol)
+        if history == None:
+            cursor = self.db.cursor()
+            rows = cursor.execute("SELECT date, open, close, low, high, volume, adjclose FROM HISTORY WHERE (symbol=?) ORDER BY date ASC", (symbol,)).fetchall()
+            cursor.close()
+            history = History(symbol, rows)
+            self.histories[symbol] = history
+        return history
+
+    def unload(self, symbol):
+        """
+        Drops the in-memory history and coverage of a symbol so that
+        they are re-read on next use
+        """
+        self.histories.pop(symbol, None)
+        self.coverages.pop(symbol, None)
+
+    def unloadCoverage(self, symbol):
+        """
+        Drops the in-memory coverage of a symbol, keeping its history
+        """
+        self.coverages.pop(symbol, None)
+
+    def coverage(self, symbol):
+        """
+        Returns the L{Coverage} of a symbol.  For symbols cached before
+        coverage was recorded it is derived from the runs of consecutive
+        days in the history, which were always stored with placeholders.
+        """
+        coverage = self.coverages.get(symbol)
+        if coverage == None:
+            cursor = self.db.cursor()
+            rows = cursor.execute("SELECT start, end FROM coverage WHERE (symbol=?) ORDER BY start ASC", (symbol,)).fetchall()
+            cursor.close()
+            coverage = Coverage(rows)
+            if len(coverage) == 0:
+                dates = self.load(symbol).date
+                if len(dates) > 0:
+                    ordinals = ymdToOrdinal(dates)
+                    breaks = numpy.flatnonzero(numpy.diff(ordinals) != 1)
+                    starts = numpy.concatenate(([0], breaks + 1))
+                    ends = numpy.concatenate((breaks, [len(dates) - 1]))
+                    coverage = Coverage([(dates[a], dates[b]) for a, b in zip(starts, ends)])
+                    self._storeCoverage(symbol, coverage)
+            self.coverages[symbol] = coverage
+        return coverage
+
+    def cover(self, symbol, start, end):
+        """
+        Records that the days from start to end have been fetched
+        """
+        coverage = self.coverage(symbol)
+        coverage.add(start, end)
+        self._storeCoverage(symbol, coverage)
+
+    def _storeCoverage(self, symbol, coverage):
+        cursor = self.db.cursor()
+        try:
+            cursor.execute("DELETE FROM coverage WHERE (symbol=?)", (symbol,))
+            cursor.executemany("INSERT INTO coverage VALUES (?, ?, ?)",
+                               [(symbol, int(a), int(b)) for a, b in coverage.intervals])
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+        finally:
+            cursor.close()
+
     def init(self, symbol, wantDate, priorDate):
+        """
+        Stores empty placeholder rows for every day from priorDate
+        to wantDate
+        """
+        self.unload(symbol)
+        rows = []
         d = priorDate
         while d <= wantDate:
-            cursor = self.db.cursor()
-            cursor.execute("INSERT OR REPLACE INTO HISTORY VALUES (NULL, '%s', '%s', NULL, NULL, NULL, NULL, NULL, NULL)" % (symbol, d))
-            cursor.close()
+            rows.append((symbol, int(d)))
             d += 1
-        self.db.commit()
+        self._store("INSERT OR REPLACE INTO HISTORY VALUES (NULL, ?, ?, NULL, NULL, NULL, NULL, NULL, NULL)", rows)
 
     def put(self, quotes):
-        for quote in quotes:
-            cursor = self.db.cursor()
-            cursor.execute("INSERT OR REPLACE INTO HISTORY VALUES (NULL, '%(symbol)s', '%(date)s', '%(open)s', %(close)f, %(low)f, %(high)f, %(volume)f, %(adjclose)f)" % quote.__dict__)
+        """
+        Stores the quotes, replacing any existing rows for their days
+        """
+        for symbol in set([quote.symbol for quote in quotes]):
+            self.unload(symbol)
+        rows = [(q.symbol, int(q.date), q.open, q.close, q.low, q.high, q.volume, q.adjclose) for q in quotes]
+        self._store("INSERT OR REPLACE INTO HISTORY VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def putHistory(self, history):
+        """
+        Stores every row of a L{History}, replacing any existing rows
+        for their days
+        """
+        self.unload(history.symbol)
+        values = zip(*[getattr(history, field).tolist() for field in History.FIELDS])
+        rows = [(history.symbol, date) + tuple([v if v == v else None for v in row])
+                for date, row in zip(history.date.tolist(), values)]
+        self._store("INSERT OR REPLACE INTO HISTORY VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _store(self, statement, rows):
+        """
+        Executes statement for all rows in a single transaction
+        """
+        start = time.time()
+        cursor = self.db.cursor()
+        try:
+            cursor.executemany(statement, rows)
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+        finally:
             cursor.close()
-        self.db.commit()
+        self.stored += len(rows)
+        elapsed = time.time() - start
+        if elapsed > 0:
+            logging.debug("stored %d rows in %0.3fs (%d rows/s)", len(rows), elapsed, len(rows) / elapsed)
+
+    def beginLoad(self, **pragmas):
+        """
+        Prepares the database for a large load.  The pragmas default to
+        L{LOAD_PRAGMAS} and are restored by L{Cache.endLoad}.
+        """
+        settings = dict(LOAD_PRAGMAS)
+        settings.update(pragmas)
+        self.restore = {}
+        cursor = self.db.cursor()
+        for name, value in settings.items():
+            self.restore[name] = cursor.execute("PRAGMA %s" % name).fetchone()[0]
+            cursor.execute("PRAGMA %s=%s" % (name, value))
+        cursor.close()
+        self.stored = 0
+        self.loadStart = time.time()
+
+    def endLoad(self):
+        """
+        Restores the pragmas changed by L{Cache.beginLoad} and returns the
+        number of rows stored and the rows per second for the load
+        """
+        cursor = self.db.cursor()
+        for name, value in self.restore.items():
+            cursor.execute("PRAGMA %s=%s" % (name, value))
+        cursor.close()
+        self.restore = {}
+        elapsed = time.time() - self.loadStart
+        rate = (self.stored / elapsed) if elapsed > 0 else 0.0
+        logging.info("stored %d rows in %0.2fs (%d rows/s)", self.stored, elapsed, rate)
+        return self.stored, rate
 
     def purge(self, symbol):
+        self.unload(symbol)
 	cursor = self.db.cursor()
 	hist = cursor.execute("DELETE FROM HISTORY WHERE (symbol='%s')" % (symbol)).fetchall()
+	cursor.execute("DELETE FROM coverage WHERE (symbol=?)", (symbol,))
 	cursor.close()
         self.db.commit()
 
@@ -243,6 +738,183 @@ class Cache:
             pass
 
 
+class BinaryCache(Cache):
+    """
+    Cache that keeps the history of each symbol in a fixed-layout binary
+    file that is read with numpy.memmap, so loading a full history maps
+    the file instead of querying and converting rows.  A sqlite catalog
+    in the same directory lists the symbols with their number of rows and
+    first and last dates, and holds the coverage like L{Cache} does.
+
+    The file of a symbol with n rows holds each of L{History.FIELDS} as n
+    little-endian float64, NaN where there is no value, followed by the n
+    int32 yyyymmdd dates in ascending order.  Files are replaced, never
+    changed in place, so histories already mapped stay valid.
+    """
+    CATALOG_COL_DEF=(
+        "symbol text primary key",
+        "rows integer",
+        "first date",
+        "last date")
+    ROW_SIZE = (8 * len(History.FIELDS)) + 4
+
+    def __init__(self, path=STORE_DIR):
+        self.dir = os.path.expanduser(path)
+        Cache.__init__(self, os.path.join(self.dir, "catalog.db"))
+
+    def _createTables(self, cursor):
+        cursor.execute("CREATE TABLE IF NOT EXISTS symbols (%s)" % (", ".join(BinaryCache.CATALOG_COL_DEF)))
+        cursor.execute("CREATE TABLE IF NOT EXISTS coverage (%s)" % (", ".join(Cache.COVERAGE_COL_DEF)))
+        cursor.execute("CREATE INDEX IF NOT EXISTS covered ON coverage (symbol)")
+
+    def _file(self, symbol):
+        return os.path.join(self.dir, urllib.quote(symbol, safe="") + ".ohlcv")
+
+    def symbols(self):
+        """Return a list of symbols that have been cached."""
+        cursor = self.db.cursor()
+        symbols = cursor.execute("SELECT symbol FROM symbols ORDER BY symbol").fetchall()
+        cursor.close()
+        return [x[0] for x in symbols]
+
+    def get(self, symbol, wantDate, priorDate=None):
+        history = self.load(symbol)
+        start, stop = history.range(priorDate or wantDate, wantDate)
+        return history.quotes(start, stop)
+
+    def days(self, symbol, start=None, end=None):
+        history = self.load(symbol)
+        start, stop = history.range(start or 0, end or 99999999)
+        adjclose = history.adjclose[start:stop]
+        return zip(history.date[start:stop].tolist(), (adjclose == adjclose).tolist())
+
+    def load(self, symbol):
+        """
+        Returns the L{History} for a symbol, its arrays are views of the
+        mapped file
+        """
+        history = self.histories.get(symbol)
+        if history == None:
+            history = self._read(symbol)
+            self.histories[symbol] = history
+        return history
+
+    def _read(self, symbol):
+        try:
+            n = os.path.getsize(self._file(symbol)) // BinaryCache.ROW_SIZE
+        except OSError:
+            n = 0
+        if n == 0:
+            return History(symbol, [])
+        data = numpy.memmap(self._file(symbol), dtype=numpy.uint8, mode="r", shape=(n * BinaryCache.ROW_SIZE,))
+        columns = {}
+        for i, field in enumerate(History.FIELDS):
+            columns[field] = data[8*n*i:8*n*(i+1)].view("<f8")
+        return History.fromColumns(symbol, data[8*n*len(History.FIELDS):].view("<i4"), columns)
+
+    def init(self, symbol, wantDate, priorDate):
+        dates = []
+        d = priorDate
+        while d <= wantDate:
+            dates.append(int(d))
+            d += 1
+        dates = numpy.array(dates, dtype=numpy.int32)
+        self._merge(symbol, dates, dict([(field, numpy.zeros(len(dates)) + numpy.nan) for field in History.FIELDS]))
+
+    def put(self, quotes):
+        bySymbol = {}
+        for quote in quotes:
+            bySymbol.setdefault(quote.symbol, []).append(quote)
+        for symbol, quotes in bySymbol.items():
+            dates = numpy.array([int(q.date) for q in quotes], dtype=numpy.int32)
+            columns = {}
+            for field in History.FIELDS:
+                columns[field] = numpy.array([getattr(q, field) for q in quotes], dtype=float)
+            self._merge(symbol, dates, columns)
+
+    def putHistory(self, history):
+        self._merge(history.symbol, history.date, dict([(field, getattr(history, field)) for field in History.FIELDS]))
+
+    def _merge(self, symbol, dates, columns):
+        """
+        Rewrites the file of a symbol with the given rows replacing any
+        existing rows for their days
+        """
+        start = time.time()
+        old = self._read(symbol)
+        self.unload(symbol)
+        if len(old) == 0 and len(dates) == 0:
+            return
+
+        # A stable sort leaves the new rows after the old ones of the
+        # same day, so the last row of each day is kept
+        merged = numpy.concatenate((old.date, dates)).astype(numpy.int32)
+        order = numpy.argsort(merged, kind="mergesort")
+        merged = merged[order]
+        keep = numpy.append(merged[1:] != merged[:-1], True)
+
+        path = self._file(symbol)
+        f = open(path + ".tmp", "wb")
+        try:
+            for field in History.FIELDS:
+                values = numpy.concatenate((getattr(old, field), columns[field]))
+                f.write(values[order][keep].astype("<f8").tostring())
+            f.write(merged[keep].astype("<i4").tostring())
+        finally:
+            f.close()
+        os.rename(path + ".tmp", path)
+
+        merged = merged[keep]
+        cursor = self.db.cursor()
+        try:
+            cursor.execute("INSERT OR REPLACE INTO symbols VALUES (?, ?, ?, ?)",
+                           (symbol, len(merged), int(merged[0]), int(merged[-1])))
+            self.db.commit()
+        except:
+            self.db.rollback()
+            raise
+        finally:
+            cursor.close()
+        self.stored += len(dates)
+        elapsed = time.time() - start
+        if elapsed > 0:
+            logging.debug("stored %d rows in %0.3fs (%d rows/s)", len(dates), elapsed, len(dates) / elapsed)
+
+    def purge(self, symbol):
+        self.unload(symbol)
+        try:
+            os.remove(self._file(symbol))
+        except OSError:
+            pass
+        cursor = self.db.cursor()
+        cursor.execute("DELETE FROM symbols WHERE (symbol=?)", (symbol,))
+        cursor.execute("DELETE FROM coverage WHERE (symbol=?)", (symbol,))
+        cursor.close()
+        self.db.commit()
+
+STORES = {"sqlite": Cache, "binary": BinaryCache}
+
+def copyCache(source, target, symbols=None):
+    """
+    Copies the histories and coverage of the symbols, or of every symbol
+    in the source, from one cache to another.  Returns the number of rows
+    copied and the rows per second.
+    """
+    target.beginLoad()
+    try:
+        for symbol in symbols or source.symbols():
+            target.putHistory(source.load(symbol))
+            coverage = target.coverage(symbol)
+            for start, end in source.coverage(symbol).intervals:
+                coverage.add(start, end)
+            target._storeCoverage(symbol, coverage)
+            source.unload(symbol)
+            target.unload(symbol)
+    finally:
+        rows, rate = target.endLoad()
+    return rows, rate
+
+
 class Market:
     """
     Main top-level class for YahooQuote.
@@ -252,14 +924,14 @@ class Market:
     Use this like a dict, where the keys are ticker symbols,
     and the values are Ticker objects (see class Ticker)
     """
-    def __init__(self):
+    def __init__(self, store=None):
         """
         Creates a 'Market' object, which accesses quotes for
         various ticker symbols through Ticker object
 
-        No args or keywords needed.
+        store selects the cache from L{STORES}, L{STORE} by default.
         """
-        self.cache = Cache()
+        self.cache = STORES[store or STORE]()
 
         self.indexes = {}
         self.tickersBySymbol = {}
@@ -326,10 +998,12 @@ class Market:
 	    self.loadIndexes()
 
         try:
+            symbols = []
             for index in self.indexes.values():
-                # fill the queue with callable methods
 		logging.debug("fetching index %s", index)
-                index.fetchHistory()
+                symbols.extend([sym for sym in index.components if sym not in symbols])
+            tickers = [self[sym] for sym in symbols]
+            HistoryFetcher(self).fetch([ticker._historyRange() for ticker in tickers], purge=True)
         except KeyboardInterrupt:
             logging.info("interrupted by user")
 
@@ -338,10 +1012,16 @@ class Market:
         Updates all known stocks' histories. Don't run this unless
         you have previously invoked L{Market.fetchHistory}
         """
+        jobs = []
+        tickers = []
         for symbol in self.cache.symbols():
 	    logging.debug("updating symbol %s", symbol)
             ticker = self[symbol]
-            ticker.updateHistory()
+            tickers.append(ticker) # keep the weakly referenced tickers alive
+            job = ticker._updateRange()
+            if job != None:
+                jobs.append(job)
+        HistoryFetcher(self).fetch(jobs)
 
 
 class Index:
@@ -394,7 +1074,7 @@ class Index:
         url = "http://download.finance.yahoo.com/d/quotes.csv?%s" % parms
 
         # get the CSV for this index
-        f = urllib.urlopen(url)
+        f = urlopen(url)
         lines = f.readlines()
         csvReader = csv.reader(lines)
 
@@ -411,10 +1091,8 @@ class Index:
         """
         logging.debug("index %s" % self.symbol)
 
-        for sym in self.components:
-
-            ticker = self.market[sym]
-            ticker.fetchHistory()
+        tickers = [self.market[sym] for sym in self.components]
+        HistoryFetcher(self.market).fetch([ticker._historyRange() for ticker in tickers], purge=True)
 
     def __getitem__(self, symbol):
         """
@@ -477,7 +1155,7 @@ class Ticker:
         url = baseUrl + "?" + "&".join(parms)
 
         # get the raw csv lines from Yahoo
-        lines = urllib.urlopen(url).readlines()
+        lines = urlopen(url).readlines()
 
         # and get the quote from it
         return Quote.fromYahooQuote(self, lines[0])
@@ -489,7 +1167,9 @@ class Ticker:
         """
         logging.debug("date=%s", date)
 
-        logging.debug("%s(1): refs=%s" % (self.symbol, self.refs))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            # counting referrers walks every object, so only do it when asked
+            logging.debug("%s(1): refs=%s" % (self.symbol, self.refs))
 
         now = QuoteDate.now()
 
@@ -510,20 +1190,60 @@ class Ticker:
         if wantDate > now or priorDate > now:
             raise IndexError("Prescience disabled by order of Homeland Security")
 
-        # no, seek it from db or yahoo
-        quotes = self.market.cache.get(self.symbol, wantDate, priorDate)
+        # no, seek it from the in-memory history, db or yahoo
         if priorDate == None:
-            expectedQuotes = 1
+            self.ensure(wantDate, wantDate)
         else:
-            expectedQuotes = (wantDate - priorDate) + 1
-        if len(quotes) != expectedQuotes:
-            self._fetch(wantDate, priorDate)
-            quotes = self.market.cache.get(self.symbol, wantDate, priorDate)
-       
-        if isinstance(date, slice):
-            return quotes
+            self.ensure(priorDate, wantDate)
+
+        history = self.market.cache.load(self.symbol)
+        if priorDate == None:
+            i = history.find(wantDate)
+            if i < 0:
+                return Quote(self.symbol, date=int(wantDate))
+            return history.quote(i)
+
+        # days that were fetched but have no quote get an empty Quote
+        start, stop = history.range(priorDate, wantDate)
+        quotes = dict([(q.date, q) for q in history.quotes(start, stop)])
+        result = []
+        d = priorDate
+        while d <= wantDate:
+            result.append(quotes.get(int(d)) or Quote(self.symbol, date=int(d)))
+            d += 1
+        return result
+
+    def ensure(self, start, end):
+        """
+        Fetches the parts of the range from start to end that are not
+        covered yet.  A single missing day fetches up to L{fetchWindow}
+        days before it that are not covered either.
+        """
+        if not isinstance(start, QuoteDate):
+            start = QuoteDate(start)
+        if not isinstance(end, QuoteDate):
+            end = QuoteDate(end)
+
+        cache = self.market.cache
+        gaps = cache.coverage(self.symbol).gaps(start, end)
+        if len(gaps) > 0:
+            # another cache may have fetched them since the coverage was
+            # loaded, the history is only re-read if it did
+            cache.unloadCoverage(self.symbol)
+            covered = cache.coverage(self.symbol).gaps(start, end)
+            if covered != gaps:
+                cache.unload(self.symbol)
+            gaps = covered
+        if len(gaps) == 0:
+            return
+
+        if start == end:
+            windowStart = end - fetchWindow + 1
+            gaps = cache.coverage(self.symbol).gaps(windowStart, end)
+            start = gaps[-1][0]
         else:
-            return quotes[0]
+            start = gaps[0][0]
+        self._fetch(gaps[-1][1], start)
 
     def __repr__(self):
         if self.index:
@@ -551,16 +1271,34 @@ class Ticker:
 
         argument 'date' MUST be a QuoteDate object
         """
+        wantDate, priorDate = self._window(wantDate, priorDate)
+        quotes = self._download(wantDate, priorDate)
+        self._store(wantDate, priorDate, quotes)
+
+    def _window(self, wantDate, priorDate=None):
+        """
+        Returns the (wantDate, priorDate) range that L{Ticker._fetch}
+        requests for the given dates
+        """
         if not isinstance(wantDate, QuoteDate):
             raise Exception("Invalid date %s: not a QuoteDate" % wantDate)
 
         # go some days before and after
         if priorDate == None:
             priorDate = wantDate - fetchWindow + 1
+        return wantDate, priorDate
+
+    def _download(self, wantDate, priorDate):
+        """
+        Downloads and parses the quotes between priorDate and wantDate,
+        without touching the database so it is safe to call from any
+        thread.  Returns the quotes in ascending date order, an empty
+        list if there is no history in the range or None if the fetch
+        failed.
+        """
         year1, month1, day1 = priorDate.toYmd()
         year2, month2, day2 = (wantDate + 1).toYmd()
 
-        self.market.cache.init(self.symbol, wantDate, priorDate)
         logging.info("fetching %s for %s-%s-%s to %s-%s-%s" % (
                     self.symbol,
                     year1, month1, day1,
@@ -584,74 +1322,99 @@ class Ticker:
         #print "url=%s" % url
 
         # get the raw csv lines from Yahoo
-        resp = urllib.urlopen(url)
+        resp = urlopen(url)
         if resp.getcode() == 404:
             logging.info("%s: No history for %04d-%02d-%02d to %04d-%02d-%02d" % (
                         self.symbol,
                         year1, month1, day1,
                         year2, month2, day2))
-            return
+            return []
+        if resp.getcode() not in (None, 200):
+            logging.warning("%s: failed to fetch, HTTP %s" % (self.symbol, resp.getcode()))
+            return None
         lines = resp.readlines()
 
         logging.debug("   fetched %s", lines)
 
-        if lines[0].startswith("Date"):
-            lines = lines[1:]
+        # anything but a CSV history, such as an error page, is a failure
+        if len(lines) == 0 or not lines[0].startswith("Date"):
+            logging.warning("%s: failed to fetch, the response is not a history" % self.symbol)
+            return None
+        lines = lines[1:]
 
-        quotes = []
         try:
             quotes = [Quote.fromYahooHistory(self.symbol, line) for line in lines]
         except:
             logging.exception("Failed to process yahoo data")
+            return None
 
         if len(quotes) == 0:
             logging.info("%s: No history for %04d-%02d-%02d to %04d-%02d-%02d" % (
                         self.symbol,
                         year1, month1, day1,
                         year2, month2, day2))
-        else:        
-            # sort quotes into ascending order and fill in any missing dates
+        else:
+            # sort quotes into ascending order
             quotes.sort(lambda q1, q2: cmp(q1.date, q2.date))
+        return quotes
+
+    def _store(self, wantDate, priorDate, quotes):
+        """
+        Stores downloaded quotes and records the range as covered.  Today
+        is only covered once its quote has been published.  Nothing is
+        covered if the download failed, so the range is fetched again.
+        """
+        if quotes == None:
+            return
+        if len(quotes) > 0:
             self.market.cache.put(quotes)
+        now = QuoteDate.now()
+        if wantDate >= now and (len(quotes) == 0 or quotes[-1].date < now):
+            wantDate = now - 1
+        self.market.cache.cover(self.symbol, priorDate, wantDate)
 
-    def fetchHistory(self, start=None, end=None):
+    def _historyRange(self, start=None, end=None):
         """
-        fetches this stock's entire history - you should only ever
-        do this once, and thereafter, invoke
-        L{Ticker.updateHistory} to keep the history up to date
+        Returns the (ticker, wantDate, priorDate) to fetch for
+        L{Ticker.fetchHistory}
         """
         if start == None:
             startDay = QuoteDate.fromYmd(1950, 1, 1)
         else:
-            startDay = QuoteDate(end)
+            startDay = QuoteDate(start)
 
         if end == None:
             endDay = QuoteDate.now()
         else:
-            endDay = QuoteDate(start)
-
-	cursor = self.market.cache.purge(self.symbol)
+            endDay = QuoteDate(end)
+        return self, endDay, startDay
 
+    def fetchHistory(self, start=None, end=None):
+        """
+        fetches this stock's entire history - you should only ever
+        do this once, and thereafter, invoke
+        L{Ticker.updateHistory} to keep the history up to date
+        """
         try:
             # now get the whole history, lock stock and barrel
-            self._fetch(endDay, startDay, False)
+            HistoryFetcher(self.market, 1).fetch([self._historyRange(start, end)], purge=True)
         except KeyboardInterrupt:
             raise
         except:
             logging.exception("%s: failed to fetch" % self.symbol)
 
-    def updateHistory(self, start=None, end=None):
+    def _updateRange(self, start=None, end=None):
         """
-        Updates this stock's history. You should not invoke this
-        method unless you have invoked L{Ticker.fetchHistory} at
-        some time in the past.
+        Returns the (ticker, wantDate, priorDate) that L{Ticker.updateHistory}
+        needs to fetch, or None if the history is complete
         """
+        coverage = self.market.cache.coverage(self.symbol)
         if end == None:
             end = QuoteDate.now()
         if start == None:
-            cursor = self.market.db
-            lastdate = cursor.execute("select MAX(date) from history where (symbol='%s')" % self.symbol).fetchone()[0]
-	    start = QuoteDate(lastdate) + 1
+            if coverage.last() == None:
+                return self._historyRange(end=end)
+            start = coverage.last() + 1
 
         if not isinstance(start, QuoteDate):
             start = QuoteDate(start)
@@ -659,11 +1422,22 @@ class Ticker:
             end = QuoteDate(end)
 
         if end <= start:
-            return
+            return None
 
-        quotes = self.market.cache.get(self.symbol, end, start)
-        if (len(quotes) - 1) != (end - start):
-            self._fetch(end, start)
+        gaps = coverage.gaps(start, end)
+        if len(gaps) == 0:
+            return None
+        return self, gaps[-1][1], gaps[0][0]
+
+    def updateHistory(self, start=None, end=None):
+        """
+        Updates this stock's history. You should not invoke this
+        method unless you have invoked L{Ticker.fetchHistory} at
+        some time in the past.
+        """
+        job = self._updateRange(start, end)
+        if job != None:
+            self._fetch(job[1], job[2])
 
 class Quote:
     """
@@ -821,13 +1595,16 @@ class Quote:
 class QuoteDate(int):
     """
     Simple int subclass that represents yyyymmdd quote dates
+
+    Day arithmetic is done on proleptic Gregorian ordinals, so it is
+    independent of the local timezone and daylight saving time.
     """
     def __new__(cls, val):
         """
         Create a QuoteDate object. Argument can be an int or string,
         as long as it is in the form YYYYMMDD
         """
-        if isinstance(val, datetime.datetime):
+        if isinstance(val, (datetime.datetime, datetime.date)):
             val = (val.year * 10000) + (val.month * 100) + val.day
         inst = super(QuoteDate, cls).__new__(cls, val)
         inst.year, inst.month, inst.day = inst.toYmd()
@@ -837,16 +1614,31 @@ class QuoteDate(int):
         """
         Adds n days to this QuoteDate, and returns a new QuoteDate object
         """
-        return QuoteDate.fromUnix(self.toUnix() + n * DAYSECS)
+        return QuoteDate.fromOrdinal(self.toOrdinal() + n)
 
     def __sub__(self, n):
         """
         Subtracts n days from this QuoteDate, and returns a new QuoteDate object
         """
         if isinstance(n, QuoteDate):
-            return int((self.toUnix() - n.toUnix()) / DAYSECS)
+            return self.toOrdinal() - n.toOrdinal()
         else:
-            return QuoteDate.fromUnix(self.toUnix() - n * DAYSECS)
+            return QuoteDate.fromOrdinal(self.toOrdinal() - n)
+
+    def toOrdinal(self):
+        """
+        Converts this QuoteDate to a proleptic Gregorian ordinal
+        """
+        return ymdToOrdinal(self)
+
+    def fromOrdinal(ordinal):
+        """
+        Static method - converts a proleptic Gregorian ordinal
+        into a QuoteDate
+        """
+        return QuoteDate(ordinalToYmd(ordinal))
+
+    fromOrdinal = staticmethod(fromOrdinal)
 
     def toUnix(self):
         """
@@ -860,18 +1652,18 @@ class QuoteDate(int):
         Static method - converts a unix 'seconds since epoch'
         date into a QuoteDate string
         """
-        return QuoteDate(time.strftime("%Y%m%d", time.localtime(float(udate))))
+        return QuoteDate.fromYmd(*time.localtime(float(udate))[0:3])
 
     fromUnix = staticmethod(fromUnix)
 
     def toDateTime(self):
-        return datetime.date.fromtimestamp(self.toUnix())
+        return datetime.date(self.year, self.month, self.day)
 
     def now():
         """
         Static method - returns a QuoteDate object for today
         """
-        return QuoteDate.fromUnix(time.time())
+        return QuoteDate(datetime.date.today())
 
     now = staticmethod(now)
 
@@ -879,15 +1671,14 @@ class QuoteDate(int):
         """
         returns tuple (year, month, day)
         """
-        s = "%08d" % self
-        return int(s[0:4]), int(s[4:6]), int(s[6:8])
+        return int(self // 10000), int((self // 100) % 100), int(self % 100)
 
     def fromYmd(year, month, day):
         """
         Static method - instantiates a QuoteDate
         set to given year, month, day
         """
-        return QuoteDate("%04d%02d%02d" % (int(year), int(month), int(day)))
+        return QuoteDate((int(year) * 10000) + (int(month) * 100) + int(day))
 
     fromYmd = staticmethod(fromYmd)
 
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import numpy
+from utils.model import Order
+
+# Signals returned by Strategy.signals, one per session and symbol
+BUY = 1
+HOLD = 0
+SELL = -1
+
+COMMISSION = 9.99
+
+class Backtest(object):
+    """Array form of the simulation loop.
+
+    Given (sessions x symbols) arrays of signals, closing prices and the
+    prices that orders placed on each session fill at, replays the same
+    money management the event loop uses:
+
+    - SELL sells the entire holding, if there is one
+    - BUY splits the cash available at the close among all of that
+      session's BUY signals, skipping symbols where the share would not
+      buy a single share at the close
+    - orders of symbols that have no price to fill at are not executed
+
+    The cash and holdings are path dependent, so they are carried forward
+    one session at a time, but only as array rows; the valuation of every
+    session is done in one pass afterwards.
+
+    Sells are recorded as orders to sell ALL, or, if sell_all is False,
+    the quantity held, as the strategy's evaluate would order them (see
+    Strategy.SELL_ALL).
+    """
+    def __init__(self, symbols, cash, amounts, basis, sell_all=True):
+        self.symbols = symbols
+        self.sell_all = sell_all
+        self.initial_cash = float(cash)
+        self.initial_amounts = numpy.array(amounts, dtype=float)
+        self.initial_basis = numpy.array(basis, dtype=float)
+
+    def run(self, signals, closes, fills):
+        """fills[i] are the prices for the orders decided at session i, a row
+        of NaN means the orders are not executed.  Returns the list of
+        executed orders as (session index, Order, quantity, price, basis)
+        where the index is the session the order was decided on."""
+        n, m = closes.shape
+        amount = self.initial_amounts.copy()
+        basis = self.initial_basis.copy()
+        cash = self.initial_cash
+
+        self.amounts = numpy.zeros((n, m))
+        self.basis = numpy.zeros((n, m))
+        self.cash = numpy.zeros(n)
+        self.orders = []
+        for i in xrange(n):
+            self.amounts[i] = amount
+            self.basis[i] = basis
+            self.cash[i] = cash
+
+            price = fills[i]
+            if not (price == price).any():
+                continue
+
+            # Orders of symbols without a price to fill at are not executed
+            filled = price == price
+            sells = numpy.flatnonzero((signals[i] == SELL) & (amount > 0) & filled)
+            buys = numpy.flatnonzero(signals[i] == BUY)
+            if len(buys) > 0:
+                cashamt = cash / len(buys)
+                close = closes[i, buys]
+                priced = close == close
+                buys = buys[priced & (numpy.floor(cashamt / numpy.where(priced, close, 1)) >= 1) & filled[buys]]
+
+            for j in sells:
+                qty = amount[j]
+                if qty < 1:
+                    continue
+                self.orders.append((i, Order(Order.SELL, self.symbols[j], "ALL" if self.sell_all else float(qty), Order.MARKET_PRICE), qty, price[j], basis[j]))
+                amount[j] -= qty
+                cash += (qty * price[j])
+                cash -= COMMISSION
+
+            for j in buys:
+                order = Order(Order.BUY, self.symbols[j], "$%f" % cashamt, Order.MARKET_PRICE)
+                qty = int(float(order.quantity[1:]) / price[j])
+                self.orders.append((i, order, qty, price[j], 0.0))
+                if amount[j] + qty != 0:
+                    basis[j] = ((amount[j] * basis[j]) + (qty * price[j])) / (amount[j] + qty)
+                amount[j] += qty
+                cash -= (qty * price[j])
+                cash -= COMMISSION
+
+        # What a backtest of the sessions that follow starts from
+        self.final_cash = cash
+        self.final_amounts = amount
+        self.final_basis = basis
+        return self.orders
+
+    def values(self, closes):
+        """The value of the holdings of every session at the given prices"""
+        priced = (closes == closes) & (closes != 0)
+        return numpy.where(priced, closes * self.amounts, 0.0)
+
+    def equity(self, closes):
+        """The equity curve, cash plus the value of the holdings"""
+        return self.cash + self.values(closes).sum(axis=1)
+
+class BatchBacktest(object):
+    """Backtest of many portfolios at once.
+
+    The portfolios trade their own subsets of one list of symbols on the
+    same signals, with the money management of Backtest.  columns lists
+    the offsets of the symbols of each portfolio, in the order its orders
+    are executed, the cash is an array of portfolios and the holdings and
+    their basis are (portfolios x symbols) arrays, so each session is
+    decided for all of the portfolios with array operations and only the
+    orders executed are handled one by one.
+    """
+    def __init__(self, symbols, columns, cash, amounts, basis, sell_all=True):
+        self.symbols = symbols
+        self.sell_all = sell_all
+        self.columns = [numpy.array(c, dtype=int) for c in columns]
+        self.members = numpy.zeros((len(columns), len(symbols)), dtype=bool)
+        for k, c in enumerate(self.columns):
+            self.members[k,c] = True
+        self.initial_cash = numpy.array(cash, dtype=float)
+        self.initial_amounts = numpy.array(amounts, dtype=float)
+        self.initial_basis = numpy.array(basis, dtype=float)
+
+    def run(self, signals, closes, fills):
+        """Like Backtest.run, with the orders of each portfolio in a list
+        of their own"""
+        n, m = closes.shape
+        p = len(self.initial_cash)
+        amount = self.initial_amounts.copy()
+        basis = self.initial_basis.copy()
+        cash = self.initial_cash.copy()
+
+        self.amounts = numpy.zeros((n, p, m))
+        self.basis = numpy.zeros((n, p, m))
+        self.cash = numpy.zeros((n, p))
+        self.orders = [[] for k in xrange(p)]
+        for i in xrange(n):
+            self.amounts[i] = amount
+            self.basis[i] = basis
+            self.cash[i] = cash
+
+            price = fills[i]
+            if not (price == price).any():
+                continue
+
+            # Holdings of less than a share are not sold, and orders of
+            # symbols without a price to fill at are not executed
+            filled = price == price
+            sells = self.members & (signals[i] == SELL) & (amount >= 1) & filled
+            buys = self.members & (signals[i] == BUY)
+            cashamt = cash / numpy.maximum(buys.sum(axis=1), 1)
+            close = closes[i]
+            priced = close == close
+            buys &= priced & (numpy.floor(cashamt[:,numpy.newaxis] / numpy.where(priced, close, 1)) >= 1) & filled
+            if not (sells.any() or buys.any()):
+                continue
+
+            # The orders are executed in the order Backtest executes them
+            # so the cash adds up the same
+            for k in numpy.flatnonzero(sells.any(axis=1) | buys.any(axis=1)):
+                for j in self.columns[k][sells[k,self.columns[k]]]:
+                    qty = amount[k,j]
+                    self.orders[k].append((i, Order(Order.SELL, self.symbols[j], "ALL" if self.sell_all else float(qty), Order.MARKET_PRICE), qty, price[j], basis[k,j]))
+                    amount[k,j] -= qty
+                    cash[k] += (qty * price[j])
+                    cash[k] -= COMMISSION
+
+                for j in self.columns[k][buys[k,self.columns[k]]]:
+                    order = Order(Order.BUY, self.symbols[j], "$%f" % cashamt[k], Order.MARKET_PRICE)
+                    qty = int(float(order.quantity[1:]) / price[j])
+                    self.orders[k].append((i, order, qty, price[j], 0.0))
+                    if amount[k,j] + qty != 0:
+                        basis[k,j] = ((amount[k,j] * basis[k,j]) + (qty * price[j])) / (amount[k,j] + qty)
+                    amount[k,j] += qty
+                    cash[k] -= (qty * price[j])
+                    cash[k] -= COMMISSION
+
+        self.final_cash = cash
+        self.final_amounts = amount
+        self.final_basis = basis
+        return self.orders
+
+    def portfolio(self, k):
+        """The run of portfolio k as a Backtest over its own symbols, and
+        the offsets of those symbols"""
+        columns = self.columns[k]
+        backtest = Backtest([self.symbols[j] for j in columns], self.initial_cash[k],
+                            self.initial_amounts[k,columns], self.initial_basis[k,columns], self.sell_all)
+        backtest.cash = self.cash[:,k]
+        backtest.amounts = self.amounts[:,k,columns]
+        backtest.basis = self.basis[:,k,columns]
+        backtest.orders = self.orders[k]
+        backtest.final_cash = self.final_cash[k]
+        backtest.final_amounts = self.final_amounts[k,columns]
+        backtest.final_basis = self.final_basis[k,columns]
+        return backtest, columns
+
+if __name__ == "__main__":
+    import unittest
+
+    class BacktestTest(unittest.TestCase):
+
+        def test_Hold(self):
+            closes = numpy.array([[10.0], [11.0], [12.0]])
+            bt = Backtest(["spy"], 5.0, [10], [10.0])
+            orders = bt.run(numpy.zeros((3, 1)), closes, closes)
+            self.assertEqual(orders, [])
+            self.assertEqual(list(bt.equity(closes)), [105.0, 115.0, 125.0])
+
+        def test_SellThenBuy(self):
+            closes = numpy.array([[10.0], [11.0], [12.0], [13.0]])
+            fills = numpy.array([[10.5], [11.5], [12.5], [numpy.nan]])
+            signals = numpy.array([[SELL], [HOLD], [BUY], [BUY]])
+            bt = Backtest(["spy"], 0.0, [10], [10.0])
+            orders = bt.run(signals, closes, fills)
+            self.assertEqual(len(orders), 2)
+            self.assertEqual(orders[0][2], 10)
+            self.assertAlmostEqual(bt.cash[1], 105.0 - COMMISSION)
+            self.assertEqual(orders[1][2], int((105.0 - COMMISSION) / 12.5))
+            self.assertEqual(bt.amounts[3][0], 7)
+            self.assertAlmostEqual(bt.basis[3][0], 12.5)
+
+        def test_Chained(self):
+            # Running the sessions in two parts, the second starting from
+            # where the first ended, is the same as running them at once
+            closes = numpy.array([[10.0], [11.0], [12.0], [13.0]])
+            fills = numpy.array([[10.5], [11.5], [12.5], [numpy.nan]])
+            signals = numpy.array([[SELL], [BUY], [SELL], [BUY]])
+            whole = Backtest(["spy"], 0.0, [10], [10.0])
+            whole.run(signals, closes, fills)
+            first = Backtest(["spy"], 0.0, [10], [10.0])
+            first.run(signals[:2], closes[:2], fills[:2])
+            second = Backtest(["spy"], first.final_cash, first.final_amounts, first.final_basis)
+            second.run(signals[2:], closes[2:], fills[2:])
+            self.assertEqual(list(whole.equity(closes)), list(first.equity(closes[:2])) + list(second.equity(closes[2:])))
+
+        def test_Batch(self):
+            # Each portfolio of a batch trades like a Backtest of its own
+            rng = numpy.random.RandomState(4)
+            closes = 10 + rng.random_sample((50, 3)) * 5
+            fills = closes + rng.random_sample((50, 3)) - 0.5
+            fills[-1] = numpy.nan
+            signals = rng.randint(-1, 2, size=(50, 3)).astype(numpy.int8)
+            columns = [[0, 1], [2, 1], [1, 2, 0]]
+            cash = [1000.0, 0.0, 500.0]
+            amounts = [[10, 20, 0], [0, 5, 50], [3, 0, 7]]
+            basis = [[10.0, 11.0, 0.0], [0.0, 12.0, 10.0], [9.0, 0.0, 13.0]]
+            batch = BatchBacktest(["spy", "iwm", "vwo"], columns, cash, amounts, basis)
+            batch.run(signals, closes, fills)
+            for k in xrange(3):
+                view, columns = batch.portfolio(k)
+                alone = Backtest(view.symbols, cash[k], numpy.array(amounts[k])[columns], numpy.array(basis[k])[columns])
+                orders = alone.run(signals[:,columns], closes[:,columns], fills[:,columns])
+                self.assertEqual([(i, str(o), q, p) for i, o, q, p, b in view.orders], [(i, str(o), q, p) for i, o, q, p, b in orders])
+                self.assertEqual(list(view.equity(closes[:,columns])), list(alone.equity(closes[:,columns])))
+                self.assertEqual(view.final_cash, alone.final_cash)
+
+        def test_Unfilled(self):
+            # An order without a fill price is not executed, so the
+            # equity stays a number
+            closes = numpy.array([[10.0, 5.0], [10.5, 5.5], [11.0, 5.0], [12.0, 6.0]])
+            fills = closes.copy()
+            fills[1,1] = numpy.nan
+            signals = numpy.array([[BUY, BUY], [BUY, SELL], [SELL, BUY], [BUY, BUY]])
+            bt = Backtest(["spy", "iwm"], 1000.0, [0, 0], [0.0, 0.0])
+            orders = bt.run(signals, closes, fills)
+            self.assertEqual([o for i, o, q, p, b in orders if i == 1 and o.symbol == "iwm"], [])
+            self.assertFalse(numpy.isnan(bt.equity(closes)).any())
+            batch = BatchBacktest(["spy", "iwm"], [[0, 1]], [1000.0], [[0, 0]], [[0.0, 0.0]])
+            batch.run(signals, closes, fills)
+            self.assertEqual(list(batch.portfolio(0)[0].equity(closes)), list(bt.equity(closes)))
+
+    unittest.main()
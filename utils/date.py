@@ -17,5 +17,71 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 import datetime
+import numpy
 
 ONE_DAY = datetime.timedelta(days=1)
+
+# Dates are converted between yyyymmdd integers and proleptic Gregorian
+# ordinals, as used by datetime.date.toordinal, with a table covering the
+# years below.  Dates outside of it fall back to datetime.
+FIRST_YEAR = 1950
+LAST_YEAR = 2100
+
+FIRST_ORDINAL = datetime.date(FIRST_YEAR, 1, 1).toordinal()
+LAST_ORDINAL = datetime.date(LAST_YEAR, 12, 31).toordinal()
+
+def _table():
+    days = numpy.arange("%04d-01-01" % FIRST_YEAR, "%04d-01-01" % (LAST_YEAR + 1), dtype="datetime64[D]")
+    months = days.astype("datetime64[M]")
+    years = months.astype("datetime64[Y]").astype(int) + 1970
+    return ((years * 10000) + ((months.astype(int) % 12 + 1) * 100) +
+            ((days - months).astype(int) + 1)).astype(numpy.int32)
+
+# YMD_TABLE[ordinal - FIRST_ORDINAL] is the yyyymmdd of ordinal
+YMD_TABLE = _table()
+
+def ymdToOrdinal(ymd):
+    """Converts a yyyymmdd integer, or an array of them, to ordinals"""
+    if numpy.isscalar(ymd):
+        ymd = int(ymd)
+        return datetime.date(ymd // 10000, (ymd // 100) % 100, ymd % 100).toordinal()
+    ymd = numpy.asarray(ymd)
+    i = YMD_TABLE.searchsorted(ymd)
+    i[i >= len(YMD_TABLE)] = 0
+    ordinals = (i + FIRST_ORDINAL).astype(numpy.int32)
+    outside = YMD_TABLE[i] != ymd
+    for k in numpy.flatnonzero(outside):
+        ordinals[k] = ymdToOrdinal(int(ymd[k]))
+    return ordinals
+
+def ordinalToYmd(ordinal):
+    """Converts an ordinal, or an array of them, to yyyymmdd integers"""
+    if numpy.isscalar(ordinal):
+        d = datetime.date.fromordinal(int(ordinal))
+        return (d.year * 10000) + (d.month * 100) + d.day
+    ordinal = numpy.asarray(ordinal)
+    inside = (ordinal >= FIRST_ORDINAL) & (ordinal <= LAST_ORDINAL)
+    ymd = YMD_TABLE[numpy.where(inside, ordinal - FIRST_ORDINAL, 0)]
+    for k in numpy.flatnonzero(~inside):
+        ymd[k] = ordinalToYmd(int(ordinal[k]))
+    return ymd
+
+if __name__ == "__main__":
+    import unittest
+
+    class DateTest(unittest.TestCase):
+
+        def test_Table(self):
+            self.assertEqual(YMD_TABLE[0], 19500101)
+            self.assertEqual(YMD_TABLE[-1], 21001231)
+            self.assertEqual(len(YMD_TABLE), LAST_ORDINAL - FIRST_ORDINAL + 1)
+            for o in (FIRST_ORDINAL, datetime.date(2000, 2, 29).toordinal(), LAST_ORDINAL):
+                self.assertEqual(YMD_TABLE[o - FIRST_ORDINAL], ordinalToYmd(o))
+
+        def test_Arrays(self):
+            ymd = numpy.array([19491231, 19500101, 20080229, 20110314, 21010101])
+            ordinals = ymdToOrdinal(ymd)
+            self.assertEqual(list(ordinals), [ymdToOrdinal(int(x)) for x in ymd])
+            self.assertEqual(list(ordinalToYmd(ordinals)), list(ymd))
+
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import numpy
+import tables
+
+# Rows buffered per table before they are appended to the file
+FLUSH_ROWS = 10000
+
+class TableWriter(object):
+    """Buffers the rows of a table in a record array and appends them in
+    chunks of up to size rows.  Rows are written through the same
+    row['field'] = value; row.append() idiom as a PyTables table, or in
+    bulk with append(rows)."""
+    def __init__(self, table, size=FLUSH_ROWS):
+        self.table = table
+        self.dtype = table.dtype
+        self.size = max(1, int(size))
+        self.defaults = numpy.zeros(1, dtype=table.dtype)
+        for name, default in table.coldflts.items():
+            self.defaults[name] = default
+        self.buffer = numpy.resize(self.defaults, self.size)
+        self.count = 0
+
+    @property
+    def row(self):
+        return self
+
+    def __setitem__(self, name, value):
+        self.buffer[name][self.count] = value
+
+    def __len__(self):
+        return self.table.nrows + self.count
+
+    def append(self, rows=None):
+        """Commits the current row, or appends an array or sequence of rows"""
+        if rows is None:
+            self.count += 1
+            if self.count == self.size:
+                self.flush()
+            return
+
+        if not isinstance(rows, numpy.ndarray):
+            rows = numpy.rec.fromrecords(list(rows), dtype=self.table.dtype) if len(rows) else []
+        if len(rows) > 0:
+            self.flush()
+            self.table.append(rows)
+
+    def flush(self):
+        if self.count > 0:
+            self.table.append(self.buffer[:self.count])
+            self.buffer[:self.count] = self.defaults
+            self.count = 0
+
+class H5Writer(object):
+    """Wraps an open output file so that tables created or looked up
+    through it are buffered with L{TableWriter}.  Everything else is passed
+    through to the file, so the writer can be handed to code that expects
+    the file itself, such as Strategy and the indicators.  flush() writes
+    every buffer, it is called on close and should be called before the
+    output is read back or on error."""
+    def __init__(self, h5file, size=FLUSH_ROWS):
+        self.h5file = h5file
+        self.size = size
+        self.writers = {}
+
+    def __getattr__(self, name):
+        return getattr(self.h5file, name)
+
+    def _writer(self, table):
+        path = table._v_pathname
+        if not self.writers.has_key(path):
+            self.writers[path] = TableWriter(table, self.size)
+        return self.writers[path]
+
+    def createTable(self, where, name, description, *args, **kwargs):
+        return self._writer(self.h5file.createTable(where, name, description, *args, **kwargs))
+
+    def getNode(self, where, name=None, classname=None):
+        node = self.h5file.getNode(where, name, classname)
+        if isinstance(node, tables.Table):
+            return self._writer(node)
+        return node
+
+    def getTable(self, where, name=None):
+        return self.getNode(where, name, classname="Table")
+
+    def flush(self):
+        for writer in self.writers.values():
+            writer.flush()
+        self.h5file.flush()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.h5file.close()
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import unittest
+
+    class Data(tables.IsDescription):
+        date = tables.TimeCol()
+        value = tables.Float32Col(dflt=-1.0)
+
+    class H5WriterTest(unittest.TestCase):
+
+        def setUp(self):
+            fd, self.path = tempfile.mkstemp(suffix=".h5")
+            os.close(fd)
+            self.h5file = tables.openFile(self.path, mode="w")
+
+        def tearDown(self):
+            self.h5file.close()
+            os.remove(self.path)
+
+        def test_Buffered(self):
+            writer = H5Writer(self.h5file, size=3)
+            tbl = writer.createTable("/", "Data", Data)
+            for i in xrange(4):
+                tbl.row["date"] = i
+                if i != 1:
+                    tbl.row["value"] = i * 2.0
+                tbl.row.append()
+            self.assertEqual(tbl.table.nrows, 3)
+            self.assertEqual(len(tbl), 4)
+            writer.flush()
+            self.assertEqual(list(self.h5file.getNode("/Data").col("value")), [0.0, -1.0, 4.0, 6.0])
+
+        def test_Bulk(self):
+            writer = H5Writer(self.h5file)
+            tbl = writer.createTable("/", "Data", Data)
+            tbl.row["date"] = 1
+            tbl.row.append()
+            tbl.append([(2, 2.0), (3, 3.0)])
+            self.assertTrue(writer.getTable("/Data") is tbl)
+            writer.flush()
+            self.assertEqual(list(self.h5file.getNode("/Data").col("date")), [1, 2, 3])
+
+    unittest.main()
@@ -17,30 +17,204 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 from yahoo import Market
-from utils.date import ONE_DAY
+from config import QUANT_DIR
+from utils.date import ONE_DAY, ymdToOrdinal, ordinalToYmd
 import datetime
+import logging
+import numpy
+import os
 
 MARKET = Market()
 
-def isTradingDay(date):
-    if date.weekday() in (0,1,2,3,4):
-        # Consider any day the Dow was active as a trading day
-        ticker = MARKET["^DJI"]
-        if (ticker != None):
-            quote = ticker[date]
-            if quote.adjclose != None:
-                return True
-    return False
+def _ordinal(date):
+    if isinstance(date, (datetime.date, datetime.datetime)):
+        return date.toordinal()
+    # A yyyymmdd integer as stored in the cache
+    return ymdToOrdinal(date)
+
+_ymd = ordinalToYmd
+
+def _weekend(ordinals):
+    # datetime.date.fromordinal(1) is a Monday
+    return ((ordinals - 1) % 7) >= 5
+
+class TradingCalendar(object):
+    """The trading sessions, taken to be every day the Dow was active.
+
+    Sessions are kept as a sorted array of date ordinals, plus two bitmaps
+    over the ordinals between the first and last cached day of the index:
+    one for the days the cache knows about and one for the days that were
+    sessions.  Membership is a bitmap lookup and next/previous/count are
+    binary searches.  The calendar is saved in QUANT_DIR and only the index
+    history that arrived since then is read from the cache when it loads.
+    """
+    SYMBOL = "^DJI"
+    CALENDAR_FILE = os.path.join(QUANT_DIR, "calendar.npz")
+
+    def __init__(self, market, path=CALENDAR_FILE):
+        self.market = market
+        self.path = path
+        self.first = None
+        self.known = numpy.zeros(0, dtype=bool)
+        self.bitmap = numpy.zeros(0, dtype=bool)
+        self.sessions = numpy.zeros(0, dtype=numpy.int32)
+        self.load()
+        self.update()
+
+    def load(self):
+        try:
+            data = numpy.load(self.path)
+            self.first = int(data['first'])
+            self.known = data['known']
+            self.bitmap = data['bitmap']
+            self.sessions = numpy.flatnonzero(self.bitmap).astype(numpy.int32) + self.first
+        except (IOError, KeyError, ValueError):
+            logging.debug("Rebuilding trading calendar from the cache")
+            self.first = None
+
+    def save(self):
+        try:
+            numpy.savez(self.path, first=self.first, known=self.known, bitmap=self.bitmap)
+        except IOError:
+            logging.warn("Unable to save trading calendar to %s", self.path)
+
+    def getLast(self):
+        if self.first == None:
+            return None
+        return self.first + len(self.known) - 1
+    last = property(fget=getLast)
+
+    def update(self, start=None, end=None):
+        """Merges the cached index history between start and end into the
+        calendar.  Without a range, only the days outside of the ones
+        already covered are read.  Days the cache has fetched without a
+        quote are known not to be sessions."""
+        cache = self.market.cache
+        symbol = self.SYMBOL.lower()
+        if start != None or end != None:
+            spans = [(start and _ordinal(start), end and _ordinal(end))]
+        elif self.first == None:
+            spans = [(None, None)]
+        else:
+            spans = [(None, self.first - 1), (self.last + 1, None)]
+
+        days = []
+        intervals = []
+        for a, b in spans:
+            a = a or 1
+            b = b or datetime.date.max.toordinal()
+            days.extend(cache.days(symbol, _ymd(a), _ymd(b)))
+            for i, j in cache.coverage(symbol).intervals:
+                i, j = max(_ordinal(i), a), min(_ordinal(j), b)
+                if i <= j:
+                    intervals.append((i, j))
+        if len(days) == 0 and len(intervals) == 0:
+            return
+
+        ordinals = ymdToOrdinal(numpy.array([d for d, has_data in days], dtype=numpy.int32))
+        has_data = numpy.array([bool(has_data) for d, has_data in days], dtype=bool)
 
+        bounds = list(ordinals) + [o for interval in intervals for o in interval]
+        first = int(min(bounds))
+        last = int(max(bounds))
+        if self.first != None:
+            first = min(first, self.first)
+            last = max(last, self.last)
+            if first != self.first or last != self.last:
+                known = numpy.zeros(last - first + 1, dtype=bool)
+                bitmap = numpy.zeros(last - first + 1, dtype=bool)
+                known[self.first - first:self.last - first + 1] = self.known
+                bitmap[self.first - first:self.last - first + 1] = self.bitmap
+                self.known, self.bitmap = known, bitmap
+        else:
+            self.known = numpy.zeros(last - first + 1, dtype=bool)
+            self.bitmap = numpy.zeros(last - first + 1, dtype=bool)
+        self.first = first
+        for i, j in intervals:
+            self.known[i - first:j - first + 1] = True
+        self.known[ordinals - first] = True
+        self.bitmap[ordinals - first] = has_data
+        self.sessions = numpy.flatnonzero(self.bitmap).astype(numpy.int32) + first
+        self.save()
+
+    def covers(self, start, end):
+        """True if the status of every weekday from start to end is known"""
+        return self._covers(_ordinal(start), _ordinal(end))
+
+    def _covers(self, a, b):
+        if self.first == None or a < self.first or b > self.last:
+            return False
+        known = self.known[a - self.first:b - self.first + 1]
+        return bool((known | _weekend(numpy.arange(a, b + 1))).all())
+
+    def ensure(self, start, end):
+        """Fetches index history for any weekdays from start to end that
+        the calendar does not know about yet"""
+        self._ensure(_ordinal(start), _ordinal(end))
+
+    def _ensure(self, a, b):
+        b = min(b, datetime.date.today().toordinal())
+        if a > b or self._covers(a, b):
+            return
+        self.market[self.SYMBOL].ensure(_ymd(a), _ymd(b))
+        self.update(datetime.date.fromordinal(a), datetime.date.fromordinal(b))
+
+    def isSession(self, date):
+        o = _ordinal(date)
+        if _weekend(o):
+            return False
+        self._ensure(o, o)
+        if self.first == None or o < self.first or o > self.last:
+            return False
+        return bool(self.bitmap[o - self.first])
+
+    def previous(self, date):
+        """Returns the session before date, or None if there is none"""
+        o = _ordinal(date)
+        window = 7
+        while True:
+            self._ensure(o - window, o - 1)
+            i = self.sessions.searchsorted(o) - 1
+            if i >= 0 and self.sessions[i] >= o - window:
+                return datetime.datetime.fromordinal(int(self.sessions[i]))
+            if self.first == None or (o - window) < self.first:
+                return None
+            window *= 2
+
+    def next(self, date):
+        """Returns the session after date, or None if it is not known yet"""
+        o = _ordinal(date)
+        window = 7
+        today = datetime.date.today().toordinal()
+        while True:
+            self._ensure(o + 1, o + window)
+            i = self.sessions.searchsorted(o, side="right")
+            if i < len(self.sessions) and self.sessions[i] <= o + window:
+                return datetime.datetime.fromordinal(int(self.sessions[i]))
+            if (o + window) >= today:
+                return None
+            window *= 2
+
+    def count(self, start, end):
+        """Number of sessions from start to end inclusive"""
+        a, b = _ordinal(start), _ordinal(end)
+        self._ensure(a, b)
+        return int(self.sessions.searchsorted(b, side="right") - self.sessions.searchsorted(a))
+
+    def range(self, start, end):
+        """Returns the sessions from start to end inclusive as datetimes"""
+        a, b = _ordinal(start), _ordinal(end)
+        self._ensure(a, b)
+        i, j = self.sessions.searchsorted(a), self.sessions.searchsorted(b, side="right")
+        return [datetime.datetime.fromordinal(int(o)) for o in self.sessions[i:j]]
+
+CALENDAR = TradingCalendar(MARKET)
+
+def isTradingDay(date):
+    return CALENDAR.isSession(date)
 
 def getPrevTradingDay(date):
-    prev_trading_day = date - ONE_DAY
-    while isTradingDay(prev_trading_day) == False:
-        prev_trading_day = prev_trading_day - ONE_DAY
-    return prev_trading_day
+    return CALENDAR.previous(date)
 
 def getNextTradingDay(date):
-    next_trading_day = date + ONE_DAY
-    while isTradingDay(next_trading_day) == False:
-        next_trading_day = next_trading_day - ONE_DAY
-    return next_trading_day
+    return CALENDAR.next(date)
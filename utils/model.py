@@ -98,7 +98,9 @@ class Position(object):
     def add(self, qty, price_paid):
         v = (self.amount * self.basis) + (qty * price_paid)
         self.amount += qty
-        self.basis = v / self.amount
+        # The basis of a holding that is closed out is kept
+        if self.amount != 0:
+            self.basis = v / self.amount
 
     def remove(self, qty, price_sold):
         self.amount -= qty
@@ -106,6 +108,119 @@ class Position(object):
     def __str__(self):
         return str(self.amount)
 
+class BookPosition(Position):
+    """The Position of one symbol of a PositionBook, reading and writing
+    the book's arrays"""
+    def __init__(self, book, column):
+        self.book = book
+        self.column = column
+
+    def getAmount(self):
+        return float(self.book.amounts[self.column])
+    def setAmount(self, amount):
+        self.book.amounts[self.column] = amount
+    amount = property(getAmount, setAmount)
+
+    def getBasis(self):
+        return float(self.book.basis[self.column])
+    def setBasis(self, basis):
+        self.book.basis[self.column] = basis
+    basis = property(getBasis, setBasis)
+
+class PositionBook(object):
+    """The holdings of a portfolio as arrays, a column per symbol.
+
+    amounts and basis are arrays over the columns of symbols and cash is
+    the cash held, so a portfolio is valued against a row of prices with
+    array operations instead of a lookup per holding.
+
+    The book also behaves as the dictionary of Position by symbol, with
+    the cash under '$', that strategies are given, so position['$'],
+    position[symbol].amount and position.items() keep working.  Keys are
+    kept in the order they were added.
+    """
+    def __init__(self, positions=None):
+        self.symbols = []
+        self.columns = {}
+        self.amounts = numpy.zeros(0)
+        self.basis = numpy.zeros(0)
+        self.cash = 0.0
+        # The column of each key, -1 for the cash
+        self.index = numpy.zeros(0, dtype=int)
+        self._keys = []
+        if positions != None:
+            for symbol, p in positions.items():
+                self[symbol] = p
+
+    def __getitem__(self, symbol):
+        if symbol == '$':
+            return self.cash
+        return BookPosition(self, self.columns[symbol])
+
+    def __setitem__(self, symbol, value):
+        if symbol == '$':
+            if not '$' in self._keys:
+                self._keys.append('$')
+                self.index = numpy.append(self.index, -1)
+            self.cash = value
+            return
+        if not self.columns.has_key(symbol):
+            self.columns[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            self.amounts = numpy.append(self.amounts, 0.0)
+            self.basis = numpy.append(self.basis, 0.0)
+            self._keys.append(symbol)
+            self.index = numpy.append(self.index, self.columns[symbol])
+        j = self.columns[symbol]
+        self.amounts[j] = value.amount
+        self.basis[j] = value.basis
+
+    def __contains__(self, symbol):
+        return symbol in self._keys
+
+    def has_key(self, symbol):
+        return symbol in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [self[symbol] for symbol in self._keys]
+
+    def items(self):
+        return [(symbol, self[symbol]) for symbol in self._keys]
+
+    def add(self, symbol, qty, price_paid):
+        """Buys qty of a symbol, averaging its basis"""
+        j = self.columns[symbol]
+        amount = self.amounts[j] + qty
+        if amount != 0:
+            self.basis[j] = ((self.amounts[j] * self.basis[j]) + (qty * price_paid)) / amount
+        self.amounts[j] = amount
+
+    def remove(self, symbol, qty, price_sold):
+        self.amounts[self.columns[symbol]] -= qty
+
+    def prices(self, row):
+        """A row of prices over the symbols with 0 where there is no price"""
+        row = numpy.asarray(row, dtype=float)
+        return numpy.where((row == row) & (row != 0), row, 0.0)
+
+    def marketValues(self, row):
+        """The value of each holding at a row of prices, one per symbol in
+        column order; holdings without a price are worth 0"""
+        return self.prices(row) * self.amounts
+
+    def marketValue(self, row):
+        """The cash plus the value of the holdings at a row of prices"""
+        return self.cash + self.marketValues(row).sum()
+
 ###############################################################################
 # PyTables data structures
 ###############################################################################
@@ -132,22 +247,112 @@ class PerformanceData(tables.IsDescription):
     date_str = tables.StringCol(16)
     value = tables.Float32Col()
 
+class SweepData(tables.IsDescription):
+    params = tables.StringCol(128)
+    output = tables.StringCol(128)
+    ending_value = tables.Float64Col()
+    equity_percent = tables.Float64Col()
+    cagr = tables.Float64Col()
+    drawdown_per = tables.Float64Col()
+    drawdown_dur = tables.Int32Col()
+    volatility = tables.Float64Col()
+    sharpe = tables.Float64Col()
+    sortino = tables.Float64Col()
+    calmar = tables.Float64Col()
+    total_trades = tables.Int32Col()
+    winning_trades = tables.Int32Col()
+    avg_trade = tables.Float64Col()
+
+class WalkForwardData(tables.IsDescription):
+    in_start = tables.StringCol(16)
+    in_end = tables.StringCol(16)
+    out_start = tables.StringCol(16)
+    out_end = tables.StringCol(16)
+    params = tables.StringCol(128)
+    in_sample = tables.Float64Col()  # The metric optimized, in sample
+    out_sample = tables.Float64Col() # and out of sample
+    out_percent = tables.Float64Col()
+
 ###############################################################################
 # Helper functions
 ###############################################################################
-def openOutputFile(filepath):
+def openOutputFile(filepath, append=False):
     """After opening the file, get the tables like this.
    
     file.getNode("/Orders")
     file.getNode("/Position")
     file.getNode("/Performance")
+
+    If append is True an existing file is opened for appending instead
+    of being replaced.
     """
+    if append and os.path.exists(os.path.expanduser(filepath)):
+        return tables.openFile(os.path.expanduser(filepath), mode="a")
     try:
         os.remove(os.path.expanduser(filepath))
     except OSError:
         pass
     outputFile = tables.openFile(os.path.expanduser(filepath), mode="w", title="Quant Simulation")
-    outputFile.createTable("/", 'Orders', OrderData)
-    outputFile.createTable("/", 'Position', PositionData)
-    outputFile.createTable("/", 'Performance', PositionData)
+    createSimulationTables(outputFile, "/")
+    return outputFile
+
+def createSimulationTables(outputFile, where):
+    """Creates the Orders, Position and Performance tables of a simulation
+    in the group where"""
+    outputFile.createTable(where, 'Orders', OrderData)
+    outputFile.createTable(where, 'Position', PositionData)
+    outputFile.createTable(where, 'Performance', PositionData)
+
+def openBatchOutputFile(filepath, portfolios):
+    """Creates an output file with a group for each portfolio, holding
+    the tables openOutputFile creates at the root, i.e.
+
+    file.getNode("/<portfolio>/Orders")
+    """
+    try:
+        os.remove(os.path.expanduser(filepath))
+    except OSError:
+        pass
+    outputFile = tables.openFile(os.path.expanduser(filepath), mode="w", title="Quant Batch Simulation")
+    for portfolio in portfolios:
+        createSimulationTables(outputFile, outputFile.createGroup("/", portfolio))
     return outputFile
+
+if __name__ == "__main__":
+    import unittest
+
+    class PositionBookTest(unittest.TestCase):
+
+        def test_Compatible(self):
+            book = PositionBook({'$': 100.0, 'spy': Position(10.0, 20.0)})
+            book['iwm'] = Position(0.0, 0.0)
+            self.assertEqual(book.keys()[-1], 'iwm')
+            self.assertEqual(sorted(book.keys()), ['$', 'iwm', 'spy'])
+            self.assertTrue(book.has_key('spy') and not book.has_key('vwo'))
+            book['$'] -= 10.0
+            self.assertEqual(book['$'], 90.0)
+
+            book['spy'].add(10, 30.0)
+            self.assertEqual(book['spy'].amount, 20.0)
+            self.assertEqual(book['spy'].basis, 25.0)
+            book.remove('spy', 5, 40.0)
+            self.assertEqual(book.amounts[book.columns['spy']], 15.0)
+
+        def test_ClosedOut(self):
+            book = PositionBook({'$': 0.0, 'spy': Position(10.0, 20.0)})
+            book.add('spy', -10, 30.0)
+            self.assertEqual(book['spy'].amount, 0.0)
+            self.assertEqual(book['spy'].basis, 20.0)
+            position = Position(10.0, 20.0)
+            position.add(-10, 30.0)
+            self.assertEqual(position.basis, 20.0)
+
+        def test_MarketValue(self):
+            book = PositionBook({'$': 5.0, 'spy': Position(10.0, 20.0), 'iwm': Position(2.0, 1.0)})
+            row = numpy.zeros(2)
+            row[book.columns['spy']] = 21.0
+            row[book.columns['iwm']] = numpy.nan
+            self.assertEqual(list(book.marketValues(row)), list(numpy.where(numpy.isnan(row), 0.0, row * book.amounts)))
+            self.assertEqual(book.marketValue(row), 215.0)
+
+    unittest.main()
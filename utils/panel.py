@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import os
+import shutil
+import numpy
+import yaml
+from numpy.lib.format import open_memmap
+from utils.date import ordinalToYmd
+
+def _ordinal(date):
+    if hasattr(date, "toordinal"):
+        return date.toordinal()
+    return int(date)
+
+class Panel(object):
+    """Adjusted daily prices of a set of symbols aligned on the trading
+    sessions, published as memory-mapped .npy files so that any number of
+    processes can open the same panel and share its pages.
+
+    A panel is a directory holding:
+
+    - manifest.yaml, the symbols, fields, shape and first/last session
+    - data.npy, float64 values shaped (fields, symbols, sessions), NaN
+      where a symbol has no quote
+    - sessions.npy, the int32 date ordinals of the sessions
+
+    The offset of a symbol is its index in the manifest's symbol list and
+    the offset of a date is found by binary search of the sessions.
+    """
+    FIELDS = ("adjopen", "adjhigh", "adjlow", "adjclose", "volume")
+    MANIFEST = "manifest.yaml"
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        manifest = yaml.safe_load(open(os.path.join(self.path, Panel.MANIFEST)))
+        self.symbols = manifest['symbols']
+        self.fields = tuple(manifest['fields'])
+        self.offsets = dict((symbol, i) for i, symbol in enumerate(self.symbols))
+        self.data = numpy.load(os.path.join(self.path, "data.npy"), mmap_mode="r")
+        self.sessions = numpy.load(os.path.join(self.path, "sessions.npy"), mmap_mode="r")
+        if self.data.shape != (len(self.fields), len(self.symbols), len(self.sessions)):
+            raise ValueError, "Panel %s does not match its manifest" % self.path
+
+    @classmethod
+    def build(cls, path, symbols, sessions, market):
+        """Builds a panel of the symbols over the sessions, a sequence of
+        dates or ordinals, from the market's cache and returns it opened.
+        The files are written under temporary names and renamed, manifest
+        last, so a panel is never seen half written."""
+        path = os.path.expanduser(path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        sessions = numpy.array([_ordinal(d) for d in sessions], dtype=numpy.int32)
+        dates = ordinalToYmd(sessions)
+
+        tmp = os.path.join(path, "data.npy.tmp")
+        data = open_memmap(tmp, mode="w+", dtype=numpy.float64, shape=(len(cls.FIELDS), len(symbols), len(sessions)))
+        for j, symbol in enumerate(symbols):
+            ticker = market[symbol]
+            if len(dates) > 0:
+                ticker.ensure(int(dates[0]), int(dates[-1]))
+            history = market.cache.load(ticker.symbol)
+            for i, field in enumerate(cls.FIELDS):
+                data[i, j] = history.column(field, dates)
+        data.flush()
+        del data
+        os.rename(tmp, os.path.join(path, "data.npy"))
+
+        f = open(os.path.join(path, "sessions.npy.tmp"), "wb")
+        numpy.save(f, sessions)
+        f.close()
+        os.rename(os.path.join(path, "sessions.npy.tmp"), os.path.join(path, "sessions.npy"))
+
+        manifest = {'symbols': list(symbols),
+                    'fields': list(cls.FIELDS),
+                    'shape': [len(cls.FIELDS), len(symbols), len(sessions)],
+                    'first': len(sessions) and int(sessions[0]) or None,
+                    'last': len(sessions) and int(sessions[-1]) or None}
+        f = open(os.path.join(path, Panel.MANIFEST + ".tmp"), "w")
+        f.write(yaml.safe_dump(manifest))
+        f.close()
+        os.rename(os.path.join(path, Panel.MANIFEST + ".tmp"), os.path.join(path, Panel.MANIFEST))
+        return cls(path)
+
+    def remove(self):
+        """Deletes the panel's files, views already open stay valid"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def covers(self, symbol, first, last):
+        """True if the panel has the symbol for the ordinals first to last"""
+        return (self.offsets.has_key(symbol) and len(self.sessions) > 0 and
+                self.sessions[0] <= first and last <= self.sessions[-1])
+
+    def offset(self, date):
+        """The offset of a session, a date or ordinal, or -1"""
+        ordinal = _ordinal(date)
+        i = self.sessions.searchsorted(ordinal)
+        if i < len(self.sessions) and self.sessions[i] == ordinal:
+            return int(i)
+        return -1
+
+    def field(self, field):
+        """A (symbols x sessions) view of a field"""
+        return self.data[self.fields.index(field)]
+
+    def series(self, symbol, field):
+        """A view of a field of one symbol over all the sessions"""
+        return self.data[self.fields.index(field), self.offsets[symbol]]
+
+    def column(self, field, symbol, ordinals):
+        """The values of a field of a symbol on an array of date ordinals,
+        NaN where the date is not a session of the panel"""
+        ordinals = numpy.asarray(ordinals)
+        series = self.series(symbol, field)
+        if len(series) == 0:
+            return numpy.zeros(len(ordinals)) + numpy.nan
+        offsets = self.sessions.searchsorted(ordinals)
+        offsets[offsets >= len(self.sessions)] = 0
+        return numpy.where(self.sessions[offsets] == ordinals, series[offsets], numpy.nan)
+
+if __name__ == "__main__":
+    import datetime
+    import tempfile
+    import unittest
+    from utils.YahooQuote import History
+
+    class _Ticker(object):
+        def __init__(self, symbol):
+            self.symbol = symbol
+        def ensure(self, start, end):
+            pass
+
+    class _Cache(object):
+        def load(self, symbol):
+            # date, open, close, low, high, volume, adjclose
+            return History(symbol, [(20110103, 10.0, 20.0, 9.0, 21.0, 100.0, 10.0),
+                                    (20110105, 20.0, 20.0, 19.0, 21.0, 200.0, 20.0)])
+
+    class _Market(object):
+        cache = _Cache()
+        def __getitem__(self, symbol):
+            return _Ticker(symbol)
+
+    class PanelTest(unittest.TestCase):
+
+        def setUp(self):
+            self.path = tempfile.mkdtemp()
+            sessions = [datetime.date(2011, 1, d) for d in (3, 4, 5)]
+            self.panel = Panel.build(self.path, ["spy", "iwm"], sessions, _Market())
+
+        def tearDown(self):
+            self.panel.remove()
+
+        def test_Views(self):
+            self.assertEqual(self.panel.data.shape, (5, 2, 3))
+            adjclose = self.panel.series("iwm", "adjclose")
+            self.assertEqual(adjclose[0], 10.0)
+            self.assertTrue(adjclose[1] != adjclose[1])
+            self.assertEqual(self.panel.field("adjopen")[0, 0], 5.0)
+            self.assertEqual(self.panel.offset(datetime.date(2011, 1, 5)), 2)
+            self.assertEqual(self.panel.offset(datetime.date(2011, 1, 6)), -1)
+
+        def test_Shared(self):
+            other = Panel(self.path)
+            self.assertEqual(other.symbols, ["spy", "iwm"])
+            self.assertTrue(other.covers("spy", self.panel.sessions[0], self.panel.sessions[-1]))
+            self.assertFalse(other.covers("vwo", self.panel.sessions[0], self.panel.sessions[-1]))
+            column = other.column("volume", "spy", [datetime.date(2011, 1, 5).toordinal(), 1])
+            self.assertEqual(column[0], 200.0)
+            self.assertTrue(column[1] != column[1])
+
+    unittest.main()
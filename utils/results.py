@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import os
+import shutil
+import hashlib
+import urllib
+import numpy
+import yaml
+from config import QUANT_DIR, CONFIG
+
+RESULTS_DIR = os.path.join(QUANT_DIR, "results")
+
+# The most bytes of results kept on disk, results_limit in quant.cfg
+# changes it and 0 turns the cache off
+RESULTS_LIMIT = 256 * 1024 * 1024
+if CONFIG.has_key("results_limit"):
+    RESULTS_LIMIT = int(CONFIG["results_limit"])
+
+class Results(object):
+    """Indicator series computed over ranges of sessions, kept on disk so
+    that later runs over the same prices load them instead of computing
+    them again.
+
+    A result is found by its digest, made from the symbol, the key of the
+    indicator (its type, parameters and inputs, see IndicatorGraph), the
+    state it started from and the dates and values of its inputs.  When
+    Cache.put changes the prices of a symbol the digests of anything
+    computed from them change too, so results are never served for prices
+    other than the ones they were computed from; the stale ones are left
+    to be evicted.
+
+    Each result is a npz file holding the series, the state the indicator
+    ended in and the rows it wrote to its table, if it had one.  Files are
+    touched when they are read and the least recently used ones are
+    removed once the total size is over the limit.
+    """
+    def __init__(self, path=RESULTS_DIR, limit=RESULTS_LIMIT):
+        self.path = os.path.expanduser(path)
+        self.limit = limit
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, symbol, key, state, dates, values):
+        digest = hashlib.sha1(symbol + "\0" + key + "\0")
+        digest.update(yaml.safe_dump(state))
+        if dates != None:
+            digest.update(numpy.array([d.toordinal() for d in dates], dtype="<i8").tostring())
+        for v in values:
+            digest.update(numpy.ascontiguousarray(v, dtype="<f8").tostring())
+        return digest.hexdigest()
+
+    def _file(self, symbol, digest):
+        return os.path.join(self.path, urllib.quote(symbol, safe=""), digest + ".npz")
+
+    def get(self, symbol, digest):
+        """Returns the (series, state, rows) stored under a digest, rows is
+        None if none were stored, or None if there is no result"""
+        filename = self._file(symbol, digest)
+        try:
+            npz = numpy.load(filename)
+            try:
+                series = npz["series"]
+                state = yaml.safe_load(str(npz["state"]))
+                rows = None
+                if "rows" in npz.files:
+                    rows = npz["rows"]
+            finally:
+                npz.close()
+            os.utime(filename, None)
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return series, state, rows
+
+    def put(self, symbol, digest, series, state, rows=None):
+        """Stores a result under a digest, rows is a record array of the
+        table rows the indicator wrote"""
+        filename = self._file(symbol, digest)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        arrays = {"series": numpy.asarray(series, dtype=float),
+                  "state": numpy.array(yaml.safe_dump(state))}
+        if rows is not None:
+            arrays["rows"] = rows
+        # Write and rename so a result is never read half written, the
+        # temporary name is per process as parallel runs can compute the
+        # same result
+        tmp = "%s.%d.tmp" % (filename, os.getpid())
+        f = open(tmp, "wb")
+        try:
+            numpy.savez(f, **arrays)
+        finally:
+            f.close()
+        os.rename(tmp, filename)
+
+        if self.size == None:
+            self.size = sum([size for mtime, size, filename in self._files()])
+        else:
+            self.size += os.path.getsize(filename)
+        if self.size > self.limit:
+            self.evict()
+
+    def _files(self):
+        files = []
+        if not os.path.isdir(self.path):
+            return files
+        for directory in os.listdir(self.path):
+            directory = os.path.join(self.path, directory)
+            for filename in os.listdir(directory):
+                if not filename.endswith(".npz"):
+                    continue
+                filename = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, filename))
+        return files
+
+    def evict(self):
+        """Removes the least recently used results until the total size
+        is within the limit"""
+        files = sorted(self._files())
+        self.size = sum([size for mtime, size, filename in files])
+        for mtime, size, filename in files:
+            if self.size <= self.limit:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            self.size -= size
+
+    def purge(self, symbol=None):
+        """Removes the results of a symbol, or all of them"""
+        path = self.path
+        if symbol != None:
+            path = os.path.join(path, urllib.quote(symbol, safe=""))
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        self.size = None
+
+def defaultResults():
+    """The Results strategies use, None if the cache is turned off"""
+    if RESULTS_LIMIT > 0:
+        return Results()
+    return None
+
+if __name__ == "__main__":
+    import unittest
+    import tempfile
+    import datetime
+
+    class ResultsTest(unittest.TestCase):
+
+        def setUp(self):
+            self.dir = tempfile.mkdtemp()
+            self.dates = [datetime.datetime(2010, 1, 4) + datetime.timedelta(i) for i in xrange(3)]
+            self.values = [numpy.array([1.0, 2.0, numpy.nan])]
+
+        def tearDown(self):
+            shutil.rmtree(self.dir)
+
+        def test_RoundTrip(self):
+            results = Results(self.dir)
+            digest = results.digest("spy", "EMA(10)<adjclose>", {'value': None}, self.dates, self.values)
+            self.assertEqual(results.get("spy", digest), None)
+            rows = numpy.rec.fromrecords([(1, 2.0)], names="date,value")
+            results.put("spy", digest, [1.0, 1.5, 1.5], {'value': 1.5}, rows)
+            series, state, saved = results.get("spy", digest)
+            self.assertEqual(list(series), [1.0, 1.5, 1.5])
+            self.assertEqual(state, {'value': 1.5})
+            self.assertEqual(saved.tolist(), rows.tolist())
+
+            # Any change to the inputs or starting state is another result
+            changed = [numpy.array([1.0, 2.5, numpy.nan])]
+            self.assertNotEqual(results.digest("spy", "EMA(10)<adjclose>", {'value': None}, self.dates, changed), digest)
+            self.assertNotEqual(results.digest("spy", "EMA(10)<adjclose>", {'value': 1.0}, self.dates, self.values), digest)
+            self.assertNotEqual(results.digest("iwm", "EMA(10)<adjclose>", {'value': None}, self.dates, self.values), digest)
+
+            results.purge("spy")
+            self.assertEqual(results.get("spy", digest), None)
+
+        def test_Evict(self):
+            results = Results(self.dir, limit=1 << 30)
+            results.put("spy", "a", numpy.zeros(100), {})
+            results.limit = os.path.getsize(results._file("spy", "a")) * 2
+            results.put("spy", "b", numpy.zeros(100), {})
+            past = os.path.getmtime(results._file("spy", "a")) - 10
+            os.utime(results._file("spy", "a"), (past, past))
+            os.utime(results._file("spy", "b"), (past + 5, past + 5))
+            results.get("spy", "a")
+            results.put("spy", "c", numpy.zeros(100), {})
+            self.assertNotEqual(results.get("spy", "a"), None)
+            self.assertEqual(results.get("spy", "b"), None)
+            self.assertNotEqual(results.get("spy", "c"), None)
+
+    unittest.main()
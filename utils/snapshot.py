@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+LICENSE="""
+Copyright (C) 2011  Michael Ihde
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+import os
+import shutil
+import hashlib
+import urllib
+import datetime
+import yaml
+from config import QUANT_DIR
+
+SNAPSHOT_DIR = os.path.join(QUANT_DIR, "snapshots")
+
+class Snapshots(object):
+    """Indicator states saved by Strategy.getState, kept per portfolio,
+    strategy, parameters and symbol so that a strategy built for the same
+    ones can resume from them instead of backfilling.
+
+    Each symbol is a yaml file holding its indicator states, the session
+    they were last updated with and the adjusted close of that session.
+    Adjusted closes change when dividends and splits are applied, so a
+    snapshot whose close no longer matches the market is not used.
+    """
+    def __init__(self, path=SNAPSHOT_DIR):
+        self.path = os.path.expanduser(path)
+
+    def _dir(self, portfolio, strategy, params):
+        # The parameters are normalized by dumping them with sorted keys
+        key = hashlib.sha1(yaml.safe_dump(params)).hexdigest()
+        return os.path.join(self.path, urllib.quote(portfolio, safe=""), urllib.quote(strategy, safe=""), key)
+
+    def _file(self, portfolio, strategy, params, symbol):
+        return os.path.join(self._dir(portfolio, strategy, params), urllib.quote(symbol, safe="") + ".yaml")
+
+    def load(self, portfolio, strategy, params, symbols, market=None):
+        """Returns a state for Strategy with the snapshots of the symbols
+        that have one.  If a market is given, snapshots whose close differs
+        from the market's are left out."""
+        state = {'dates': {}, 'indicators': {}}
+        for symbol in symbols:
+            try:
+                snapshot = yaml.safe_load(open(self._file(portfolio, strategy, params, symbol)))
+            except IOError:
+                continue
+            if snapshot == None or snapshot.get('params') != params:
+                continue
+            if market != None:
+                date = datetime.datetime.strptime(snapshot['date'], "%Y-%m-%d")
+                close = market[symbol][date].adjclose
+                if close == None or abs(close - snapshot['close']) > 1e-6 * abs(close):
+                    continue
+            state['dates'][symbol] = snapshot['date']
+            state['indicators'][symbol] = snapshot['indicators']
+        return state
+
+    def save(self, portfolio, strategy, params, state, market):
+        """Saves the symbols of a state from Strategy.getState, the market
+        provides the closes they are checked against when loaded"""
+        path = self._dir(portfolio, strategy, params)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for symbol, indicators in state['indicators'].items():
+            date = state.get('dates', {}).get(symbol)
+            if date == None:
+                continue
+            close = market[symbol][datetime.datetime.strptime(date, "%Y-%m-%d")].adjclose
+            if close == None:
+                continue
+            snapshot = {'params': params,
+                        'date': date,
+                        'close': float(close),
+                        'indicators': indicators}
+            # Write and rename so a snapshot is never read half written
+            filename = self._file(portfolio, strategy, params, symbol)
+            f = open(filename + ".tmp", "w")
+            try:
+                yaml.safe_dump(snapshot, f)
+            finally:
+                f.close()
+            os.rename(filename + ".tmp", filename)
+
+    def purge(self, portfolio=None):
+        """Removes the snapshots of a portfolio, or all of them"""
+        path = self.path
+        if portfolio != None:
+            path = os.path.join(path, urllib.quote(portfolio, safe=""))
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+if __name__ == "__main__":
+    import unittest
+    import tempfile
+
+    class Quote(object):
+        def __init__(self, adjclose):
+            self.adjclose = adjclose
+
+    class FakeMarket(object):
+        def __init__(self, closes):
+            self.closes = closes
+
+        def __getitem__(self, symbol):
+            return dict((d, Quote(c)) for d, c in self.closes[symbol].items())
+
+    class SnapshotsTest(unittest.TestCase):
+
+        def setUp(self):
+            self.dir = tempfile.mkdtemp()
+            self.day = datetime.datetime(2010, 1, 4)
+            self.market = FakeMarket({"spy": {self.day: 100.0}, "iwm": {self.day: 50.0}})
+            self.state = {'date': '2010-01-04',
+                          'dates': {'spy': '2010-01-04', 'iwm': '2010-01-04'},
+                          'indicators': {'spy': {'short': {'value': 99.5}},
+                                         'iwm': {'short': {'value': 49.5}}}}
+
+        def tearDown(self):
+            shutil.rmtree(self.dir)
+
+        def test_RoundTrip(self):
+            snapshots = Snapshots(self.dir)
+            snapshots.save("mix", "trending", {'short': 10}, self.state, self.market)
+            state = snapshots.load("mix", "trending", {'short': 10}, ["spy", "iwm", "vwo"], self.market)
+            self.assertEqual(state['dates'], self.state['dates'])
+            self.assertEqual(state['indicators'], self.state['indicators'])
+
+            # Other parameters, portfolios and strategies have their own
+            self.assertEqual(snapshots.load("mix", "trending", {'short': 15}, ["spy"])['indicators'], {})
+            self.assertEqual(snapshots.load("all", "trending", {'short': 10}, ["spy"])['indicators'], {})
+            self.assertEqual(snapshots.load("mix", "hold", {'short': 10}, ["spy"])['indicators'], {})
+
+            snapshots.purge("mix")
+            self.assertEqual(snapshots.load("mix", "trending", {'short': 10}, ["spy"])['indicators'], {})
+
+        def test_Readjusted(self):
+            snapshots = Snapshots(self.dir)
+            snapshots.save("mix", "trending", {}, self.state, self.market)
+            self.market.closes["spy"][self.day] = 98.0
+            state = snapshots.load("mix", "trending", {}, ["spy", "iwm"], self.market)
+            self.assertEqual(state['indicators'].keys(), ["iwm"])
+
+    unittest.main()
@@ -18,12 +18,15 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 import os
 import datetime
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
-import matplotlib.ticker as ticker
-import matplotlib.dates as dates
 from pycommando.commando import command
+from config import CONFIG
 from utils.YahooQuote import *
+import utils.YahooQuote
+
+# The market store can be chosen in quant.cfg, i.e. 'store: binary', the
+# sqlite cache is used otherwise
+if CONFIG.has_key("store"):
+    utils.YahooQuote.STORE = CONFIG["store"]
 
 @command("db_ls")
 def list():
@@ -39,12 +42,15 @@ def update(symbol):
     currently in the database.
     """
     market = Market()
+    market.cache.beginLoad()
     try:
         ticker = market[symbol]
         if ticker != None:
             ticker.updateHistory()
     except IndexError:
         market.updateHistory()
+    finally:
+        market.cache.endLoad()
 
 @command("db_flush")
 def flush():
@@ -63,12 +69,36 @@ def load(symbol=None):
     cache all major indexes from 1950 until today.
     """
     market = Market()
-    if symbol == None:
-        market.fetchHistory()
-    else:
-        ticker = market[symbol]
-        if ticker != None:
-            ticker.fetchHistory()
+    market.cache.beginLoad()
+    try:
+        if symbol == None:
+            market.fetchHistory()
+        else:
+            ticker = market[symbol]
+            if ticker != None:
+                ticker.fetchHistory()
+    finally:
+        rows, rate = market.cache.endLoad()
+    print "Stored %d rows (%d rows/s)" % (rows, rate)
+
+@command("db_export")
+def export(symbol=None):
+    """
+    Copies the historical prices, and the days they cover, of a symbol or
+    of all symbols from the sqlite cache to the binary store.  Set
+    'store: binary' in quant.cfg to use the binary store afterwards.
+    """
+    rows, rate = copyCache(Cache(), BinaryCache(), symbol and [symbol])
+    print "Exported %d rows (%d rows/s)" % (rows, rate)
+
+@command("db_import")
+def import_(symbol=None):
+    """
+    Copies the historical prices, and the days they cover, of a symbol or
+    of all symbols from the binary store to the sqlite cache.
+    """
+    rows, rate = copyCache(BinaryCache(), Cache(), symbol and [symbol])
+    print "Imported %d rows (%d rows/s)" % (rows, rate)
 
 @command("db_fetch")
 def fetch(symbol, start="today", end="today"):
@@ -99,6 +129,8 @@ def plot(symbol, start, end):
     """
     Prints the daily price for the stock on a given day.
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as dates
 
     quotes = fetch(symbol, start, end)
     x_data = [QuoteDate(q.date).toDateTime() for q in quotes]